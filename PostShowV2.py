@@ -6,19 +6,50 @@ Written by s0ph0s. https://github.com/vladasbarisas/XBN"""
 import os
 import re
 import csv
+import time
+import json
+import mmap
 import math
 import urwid
+import ctypes
 import random
+import shutil
 import signal
+import select
+import struct
+import base64
+import bisect
+import sqlite3
 import argparse
-import datetime
 import tempfile
+import datetime
+import hashlib
+import resource
 import mimetypes
 import threading
 import subprocess
+import ctypes.util
 import mutagen.id3
 import mutagen.mp3
+import mutagen.mp4
+import contextlib
 import configparser
+import mutagen.flac
+import mutagen.oggopus
+import importlib.metadata
+import concurrent.futures
+
+try:
+    import numpy
+except ImportError:
+    # Only needed for audio analysis
+    numpy = None
+
+try:
+    import lameenc
+except ImportError:
+    # Only needed for the in-process encoder backend
+    lameenc = None
 
 # import urllib.parse
 
@@ -36,6 +67,23 @@ REQUIRED_TEXT_KEYS = [
 ]
 # These keys must be in the configuration file, with boolean values
 REQUIRED_BOOL_KEYS = ["write_date", "write_trackno", "lyrics_equals_comment"]
+# These keys may be in the configuration file, with numeric values. If any are
+# set, the run stops before tagging when the loudness is outside of them.
+LOUDNESS_LIMIT_KEYS = ["loudness_min", "loudness_max", "true_peak_max", "clips_max"]
+# These keys may be in the configuration file, with numeric values
+NUMERIC_KEYS = LOUDNESS_LIMIT_KEYS + [
+    "snap_tolerance",
+    "silence_threshold",
+    "seek_interval",
+]
+# These keys may be in the configuration file, with paths that can use
+# environment variables and ~
+PATH_KEYS = ["cover_art", "catalog", "chapter_index", "publish"]
+# Where checked configuration files are cached
+CONFIG_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join("~", ".cache")), "postshow"
+)
+CONFIG_CACHE_VERSION = 1
 
 
 #
@@ -44,6 +92,8 @@ REQUIRED_BOOL_KEYS = ["write_date", "write_trackno", "lyrics_equals_comment"]
 class Chapter(object):
     """A podcast chapter."""
 
+    MAX_CHAP_TIME = 0xFFFFFFFF
+
     def __init__(
         self, start: int, end: int, url=None, image=None, text=None, indexed=True
     ):
@@ -91,10 +141,11 @@ class Chapter(object):
             sub_frames.append(mutagen.id3.WXXX(desc="chapter url", url=self.url))
         if self.image is not None:
             raise NotImplementedError("I haven't done this bit yet.")
+        # CHAP times are 32-bit milliseconds, which runs out after 49 days.
         return mutagen.id3.CHAP(
             element_id=self.elem_id,
-            start_time=self.start,
-            end_time=self.end,
+            start_time=min(self.start, self.MAX_CHAP_TIME),
+            end_time=min(self.end, self.MAX_CHAP_TIME),
             sub_frames=sub_frames,
         )
 
@@ -102,8 +153,13 @@ class Chapter(object):
 class MP3Tagger:
     """Tag an MP3."""
 
-    def __init__(self, path: str):
-        """Create a new tagger."""
+    def __init__(self, path: str, length_ms=None):
+        """Create a new tagger.
+
+        :param path: The MP3 to tag.
+        :param length_ms: The length of the audio, for the TLEN frame. If it
+        isn't given, it is worked out from the MP3.
+        """
         self.path = path
         # Create an ID3 tag if none exists
         try:
@@ -113,17 +169,29 @@ class MP3Tagger:
             broken.add_tags(ID3=mutagen.id3.ID3)
             self.tag = broken.ID3()
         # Determine the length of the MP3 and write it to a TLEN frame
-        mp3 = mutagen.mp3.MP3(path)
-        length = int(round(mp3.info.length * 1000, 0))
-        self.tag.add(mutagen.id3.TLEN(text=str(length)))
+        if length_ms is None:
+            mp3 = mutagen.mp3.MP3(path)
+            length_ms = int(round(mp3.info.length * 1000, 0))
+        self.tag.delall("TLEN")
+        self.tag.add(mutagen.id3.TLEN(text=str(length_ms)))
 
     @staticmethod
     def _no_padding(arg):
         return 0
 
     def save(self):
-        """Save the tag."""
-        self.tag.save(self.path, v2_version=3, padding=self._no_padding)
+        """Save the tag.
+
+        Frames are put in order of their IDs first (and otherwise kept in the
+        order they were added), so the same tags make the same bytes however
+        the file was tagged before.
+        """
+        frames = sorted(self.tag.values(), key=lambda frame: frame.FrameID)
+        self.tag.clear()
+        for frame in frames:
+            self.tag.add(frame)
+        with atomic_update(self.path) as path:
+            self.tag.save(path, v2_version=3, padding=self._no_padding)
 
     def set_title(self, title: str) -> None:
         """Set the title of the MP3."""
@@ -195,6 +263,11 @@ class MP3Tagger:
         self.tag.delall("TLAN")
         self.tag.add(mutagen.id3.TLAN(text=language))
 
+    def set_url(self, url: str) -> None:
+        """Set the URL of the MP3, like a chapter's URL for a clip."""
+        self.tag.delall("WXXX")
+        self.tag.add(mutagen.id3.WXXX(desc="chapter url", url=url))
+
     def add_comment(self, lang: str, desc: str, comment: str) -> None:
         """Add a comment to the MP3."""
         self.tag.add(mutagen.id3.COMM(lang=lang, desc=desc, text=[comment]))
@@ -209,6 +282,9 @@ class MP3Tagger:
 
     def add_chapters(self, chapters: list):
         """Add a whole list of chapters to the MP3."""
+        # Drop chapters from a previous tagging run, in case there were more.
+        self.tag.delall("CHAP")
+        self.tag.delall("CTOC")
         child_element_ids = []
         for chapter in chapters:
             self.add_chapter(chapter)
@@ -224,334 +300,3739 @@ class MP3Tagger:
         )
 
 
-class MP3Encoder(threading.Thread):
-    """Shell out to LAME to encode the WAV file as an MP3."""
+class OpusTagger:
+    """Tag an Ogg Opus file, the same way ``MP3Tagger`` tags an MP3.
 
-    def __init__(self):
-        super().__init__()
-        self.infile = None
-        self.outfile = None
-        self.bitrate = None
-        self.matcher = None
-        self.p = None
-        self.percent = 0
-        self.started = False
-        self.finished = False
+    Everything goes in the Vorbis comment. Chapters use the Vorbis chapter
+    extension (``CHAPTER000=00:00:00.000``, ``CHAPTER000NAME=...``).
+    """
 
-    def setup(self, infile: str, outfile: str, bitrate: str):
-        """Configure the input and output files, and the encoder bitrate.
+    def __init__(self, path: str, length_ms=None):
+        """Create a new tagger.
 
-        :param infile: Path to WAV file.
-        :param outfile: Path to create MP3 file at.
-        :param bitrate: LAME CBR bitrate, in Kbps.
+        :param path: The Opus file to tag.
+        :param length_ms: Ignored; Ogg files don't store their length.
         """
-        self.infile = infile
-        self.outfile = outfile
-        self.bitrate = bitrate
-        self.matcher = re.compile(r"\(([0-9]?[0-9 ][0-9])%\)")
+        self.path = path
+        self.opus = mutagen.oggopus.OggOpus(path)
+        self.tag = self.opus.tags
 
-    def run(self):
-        self.started = True
-        self.p = subprocess.Popen(
-            ["lame", "-t", "-b", self.bitrate, "--cbr", self.infile, self.outfile],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
+    def save(self):
+        """Save the tag."""
+        with atomic_update(self.path) as path:
+            self.opus.save(path)
+
+    def _set(self, key: str, value: str) -> None:
+        self.tag[key] = [value]
+
+    def set_title(self, title: str) -> None:
+        self._set("TITLE", title)
+
+    def set_artist(self, artist: str) -> None:
+        self._set("ARTIST", artist)
+
+    def set_album(self, album: str) -> None:
+        self._set("ALBUM", album)
+
+    def set_season(self, season: str) -> None:
+        self._set("DISCNUMBER", season)
+
+    def set_genre(self, genre: str) -> None:
+        self._set("GENRE", genre)
+
+    def set_composer(self, composer: str) -> None:
+        self._set("COMPOSER", composer)
+
+    def set_accompaniment(self, accompaniment: str) -> None:
+        self._set("ALBUMARTIST", accompaniment)
+
+    def set_cover_art(self, path: str):
+        """Set the cover art, as a FLAC picture block."""
+        mime, ignored = mimetypes.guess_type(path)
+        if mime is None:
+            raise PostShowError("Unable to guess MIME type of cover image.")
+        picture = mutagen.flac.Picture()
+        try:
+            with open(path, "rb") as fp:
+                picture.data = fp.read()
+        except IOError:
+            raise PostShowError("Unable to read cover image file.")
+        picture.type = mutagen.id3.PictureType.COVER_FRONT
+        picture.mime = mime
+        picture.desc = "podcast cover art"
+        self._set(
+            "METADATA_BLOCK_PICTURE", base64.b64encode(picture.write()).decode("ascii")
         )
-        for block in iter(lambda: self.p.stderr.read(1024), ""):
-            # Stop when the process terminates.
-            if self.p.poll() is not None:
-                break
-            text = block.decode("utf-8")
-            groups = self.matcher.findall(text)
-            if len(groups) < 1:
-                continue
-            percent = int(groups[-1])
-            self.percent = percent
-            if percent == 100 and self.p.poll() is not None:
-                break
-        self.finished = True
 
-    def request_stop(self):
-        if self.started and self.p is not None:
-            self.p.terminate()
+    def set_date(self, year: str) -> None:
+        self._set("DATE", year)
 
+    def set_trackno(self, trackno: str) -> None:
+        self._set("TRACKNUMBER", trackno)
 
-class EpisodeMetadata(object):
-    """Metadata about an episode."""
+    def set_language(self, language: str) -> None:
+        self._set("LANGUAGE", language)
 
-    def __init__(self, number: str, name: str):
-        self.number = number
-        self.name = name
-        self.lyrics = None
-        self.title = None
-        self.album = None
-        self.artist = None
-        self.season = None
-        self.genre = None
-        self.language = None
-        self.composer = None
-        self.accompaniment = None
-        self.date = None
-        self.comment = None
-        self.chapters = []
-        self.toc = []
+    def add_comment(self, lang: str, desc: str, comment: str) -> None:
+        if comment is not None:
+            self._set("COMMENT", comment)
 
+    def add_lyrics(self, lang: str, desc: str, lyrics: str) -> None:
+        if lyrics is not None:
+            self._set("LYRICS", lyrics)
 
-class MCS:
-    """Marker Conversion Space
+    def add_chapters(self, chapters: list):
+        """Add a whole list of chapters."""
+        for key in list(self.tag.keys()):
+            if re.match(r"^CHAPTER\d+", key, re.IGNORECASE):
+                del self.tag[key]
+        for i, chapter in enumerate(chapters):
+            prefix = "CHAPTER{:03d}".format(i)
+            self._set(prefix, self._timestamp(chapter.start))
+            if chapter.text is not None:
+                self._set(prefix + "NAME", chapter.text)
+            if chapter.url is not None:
+                self._set(prefix + "URL", chapter.url)
 
-    Load markers from a file into an internal representation, which can then
-    be output as other formats. Filetype detection for input files is done
-    based on the extension. If the extension is wrong, it may cause issues.
+    @staticmethod
+    def _timestamp(ms: int) -> str:
+        return "{:02d}:{:02d}:{:02d}.{:03d}".format(
+            ms // 3600000, (ms // 60000) % 60, (ms // 1000) % 60, ms % 1000
+        )
 
-    Supported input formats:
-    * Audacity labels
 
-    Supported output formats:
-    * CUE file
-    * LRC file
-    * Internal representation (for use in other parts of the program)
+class MP4Tagger:
+    """Tag an AAC (MP4) file, the same way ``MP3Tagger`` tags an MP3.
 
-    Create a new instance and call ``load('path/to/file.ext')`` on it to load
-    the markers, then ``save('path/to/file.ext', TYPE)``, where ``TYPE`` is
-    one of the constants on this class:
-    * LRC
-    * CUE
+    Mutagen can't write MP4 chapters, so when there are any, ``save`` first
+    has ffmpeg copy the audio into a new file with a chapter track built
+    from an FFMETADATA1 file, then writes the rest of the tags with mutagen.
     """
 
-    AUDACITY = 0
-    LRC = 10
-    CUE = 11
-    UMR = 12
-    SIMPLE = 13
-    FFMETADATA1 = 14
+    def __init__(self, path: str, length_ms=None):
+        """Create a new tagger.
 
-    def __init__(self, metadata=None, media_filename=None):
-        self.load_path = None
-        self.metadata = metadata
-        self.media_filename = (
-            media_filename
-            if media_filename is None
-            else os.path.basename(media_filename)
+        :param path: The MP4 file to tag.
+        :param length_ms: Ignored; MP4 files know their own length.
+        """
+        self.path = path
+        self.items = {}
+        self.chapters = None
+
+    def save(self):
+        """Save the chapters and tags."""
+        if self.chapters is not None:
+            self._write_chapters()
+        mp4 = mutagen.mp4.MP4(self.path)
+        if mp4.tags is None:
+            mp4.add_tags()
+        mp4.tags.update(self.items)
+        with atomic_update(self.path) as path:
+            mp4.save(path)
+
+    def _write_chapters(self) -> None:
+        mcs = MCS()
+        mcs.chapters = self.chapters
+        base = os.path.join(
+            os.path.dirname(self.path), "." + os.path.basename(self.path)
         )
-        self.chapters = []
+        meta_path = base + ".chapters.txt"
+        tmp_path = base + ".chapters.m4a"
+        mcs.save(meta_path, MCS.FFMETADATA1)
+        try:
+            result = subprocess.run(
+                ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error"]
+                + ["-i", self.path, "-i", meta_path]
+                + ["-map", "0:a", "-map_chapters", "1", "-c", "copy"]
+                + ["-f", "ipod", "-y", tmp_path],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                check=False,
+            )
+        except FileNotFoundError:
+            raise PostShowError("ffmpeg is needed to write MP4 chapters.")
+        finally:
+            os.remove(meta_path)
+        if result.returncode != 0:
+            raise PostShowError(
+                "Unable to write chapters to {}: {}".format(
+                    self.path, result.stderr.decode("utf-8", "replace").strip()
+                )
+            )
+        os.replace(tmp_path, self.path)
 
-    def _canonicalize(self) -> None:
-        """Set the element ID for each chapter."""
-        for i in range(0, len(self.chapters)):
-            self.chapters[i].elem_id = "chp{}".format(i)
+    def set_title(self, title: str) -> None:
+        self.items["\xa9nam"] = [title]
 
-    @staticmethod
-    def _get_time(seconds: float):
-        """Convert a number of seconds into the matching datetime.datetime.
+    def set_artist(self, artist: str) -> None:
+        self.items["\xa9ART"] = [artist]
 
-        This code accepts a count of seconds from the start of the show and
-        adds that time difference to midnight of the current day, returning a
-        datetime that can be printed as necessary.
+    def set_album(self, album: str) -> None:
+        self.items["\xa9alb"] = [album]
 
-        :param seconds: The number of seconds to create a delta for.
-        :param metadata: The metadata to use in the conversion.  If provided, it
-        will cause the output plugins to write relevant metadata to the head
-        of the file.
-        """
-        return datetime.datetime.combine(
-            datetime.datetime.today().date(), datetime.time(hour=0)
-        ) + datetime.timedelta(seconds=seconds)
+    def set_season(self, season: str) -> None:
+        # Disc numbers have to be numbers
+        if season.isdigit():
+            self.items["disk"] = [(int(season), 0)]
 
-    @staticmethod
-    def _split_url(text: str):
-        """Split text into a label and a URL. Return a (text, url) tuple.
+    def set_genre(self, genre: str) -> None:
+        self.items["\xa9gen"] = [genre]
 
-        The URL part of the tuple is None if there isn't a URL in the text.
-        """
-        url = None
-        # url_parsed = None
-        if "|" in text:
-            url = text[text.rindex("|") + 1 :]
-            text = text[: text.rindex("|")]
-            # url_parsed = urllib.parse.urlparse(url)
-        return text, url
+    def set_composer(self, composer: str) -> None:
+        self.items["\xa9wrt"] = [composer]
 
-    def load(self, path: str):
-        """Load a file.
+    def set_accompaniment(self, accompaniment: str) -> None:
+        self.items["aART"] = [accompaniment]
 
-        If the markers in the file are not already in chronological order,
-        this class will misbehave.
+    def set_cover_art(self, path: str):
+        mime, ignored = mimetypes.guess_type(path)
+        if mime not in ("image/jpeg", "image/png"):
+            raise PostShowError("MP4 cover art has to be a JPEG or PNG image.")
+        try:
+            with open(path, "rb") as fp:
+                data = fp.read()
+        except IOError:
+            raise PostShowError("Unable to read cover image file.")
+        image_format = (
+            mutagen.mp4.MP4Cover.FORMAT_PNG
+            if mime == "image/png"
+            else mutagen.mp4.MP4Cover.FORMAT_JPEG
+        )
+        self.items["covr"] = [mutagen.mp4.MP4Cover(data, imageformat=image_format)]
 
-        :param path: The name of the file to load.
-        """
-        type = path.split(".")[-1:][0]
-        if type == "txt":
-            # Decoding Audacity labels
-            self._load_audacity(path)
-        elif type == "lrc":
-            # Decoding an LRC file
-            self._load_lrc(path)
+    def set_date(self, year: str) -> None:
+        self.items["\xa9day"] = [year]
+
+    def set_trackno(self, trackno: str) -> None:
+        if trackno is not None and trackno.isdigit():
+            self.items["trkn"] = [(int(trackno), 0)]
+
+    def set_language(self, language: str) -> None:
+        self.items["----:com.apple.iTunes:LANGUAGE"] = [
+            mutagen.mp4.MP4FreeForm(language.encode("utf-8"))
+        ]
+
+    def add_comment(self, lang: str, desc: str, comment: str) -> None:
+        if comment is not None:
+            self.items["\xa9cmt"] = [comment]
+
+    def add_lyrics(self, lang: str, desc: str, lyrics: str) -> None:
+        if lyrics is not None:
+            self.items["\xa9lyr"] = [lyrics]
+
+    def add_chapters(self, chapters: list):
+        self.chapters = chapters
+
+
+class WAVFile:
+    """A memory-mapped WAV file.
+
+    Opening one only parses the chunk headers to find the format and the
+    audio data; the audio itself is read from the map as it is used. Plain
+    RIFF files, RF64 (or BW64) files, whose sizes are kept in a 64-bit
+    ``ds64`` chunk, and Sony Wave64 files can all be read, so recordings
+    over 4 GB work.
+
+    Nothing is rejected when the file is opened, as long as it has a format
+    and some audio. Call ``problems()`` to find out whether it can actually
+    be encoded.
+    """
+
+    PCM = 1
+    IEEE_FLOAT = 3
+    EXTENSIBLE = 0xFFFE
+    RIFF_IDS = (b"RIFF", b"RF64", b"BW64")
+    # Sizes in a RIFF header that mean "look in the ds64 chunk", or (in a
+    # plain RIFF file) that the recorder never went back to fill it in
+    UNSET_SIZES = (0, 0xFFFFFFFF)
+    # Wave64 chunk GUIDs are the chunk name followed by this
+    W64_SUFFIX = b"\xf3\xac\xd3\x11\x8c\xd1\x00\xc0\x4f\x8e\xdb\x8a"
+    W64_RIFF = b"riff\x2e\x91\xcf\x11\xa5\xd6\x28\xdb\x04\xc1\x00\x00"
+    W64_WAVE = b"wave" + W64_SUFFIX
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fp = open(path, "rb")
+        try:
+            self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.fp.close()
+            raise PostShowError("{} is empty".format(path))
+        self.container = None
+        self.chunks = []
+        self.format = None
+        self.channels = None
+        self.sample_rate = None
+        self.block_align = None
+        self.bits = None
+        self.data_offset = None
+        self.data_size = None
+        self.declared_size = None
+        self.unfinished = False
+        try:
+            self._parse()
+        except PostShowError:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self.mm.close()
+        self.fp.close()
+
+    def _parse(self) -> None:
+        mm = self.mm
+        if len(mm) >= 40 and mm[0:16] == self.W64_RIFF and mm[24:40] == self.W64_WAVE:
+            self.container = "W64"
+            self._parse_w64()
+        elif len(mm) >= 12 and mm[8:12] == b"WAVE" and mm[0:4] in self.RIFF_IDS:
+            self.container = mm[0:4].decode("ascii")
+            self._parse_riff()
         else:
-            raise PostShowError("Unsupported marker file: {}".format(type))
-        self._canonicalize()
+            raise PostShowError("{} is not a WAV file".format(self.path))
+        if self.format is None or self.data_offset is None:
+            raise PostShowError("{} has no audio in it".format(self.path))
+
+    def _parse_riff(self) -> None:
+        mm = self.mm
+        ds64_data_size = None
+        offset = 12
+        while offset + 8 <= len(mm):
+            chunk_id = mm[offset : offset + 4]
+            (size,) = struct.unpack_from("<I", mm, offset + 4)
+            body = offset + 8
+            if chunk_id == b"ds64" and size >= 24:
+                # RIFF size, data size, then the sample count
+                (ds64_data_size,) = struct.unpack_from("<Q", mm, body + 8)
+            elif chunk_id == b"data" and self.container != "RIFF":
+                if size == 0xFFFFFFFF and ds64_data_size is not None:
+                    size = ds64_data_size
+            self.chunks.append((chunk_id.decode("ascii", "replace"), offset, size))
+            if chunk_id == b"fmt ":
+                self._parse_format(body, size)
+            elif chunk_id == b"data":
+                self._set_data(body, size)
+                break
+            # Chunks are padded to an even length
+            offset = body + size + (size & 1)
 
-    def _load_audacity(self, path: str):
-        """Load an Audacity labels file.
+    def _parse_w64(self) -> None:
+        """Read a Sony Wave64 file.
 
-        This plugin also supports URLs, if they are appended to the end of
-        the marker with a pipe character:
-            Some Marker Name|https://example.com
+        Its chunks are named by GUIDs, have 64-bit sizes that count their own
+        24-byte header, and are padded to a multiple of 8 bytes.
         """
-        with open(path, "r", encoding="utf-8-sig") as fp:
-            reader = csv.reader(fp, delimiter="\t", quoting=csv.QUOTE_NONE)
-            for row in reader:
-                if not row:
-                    break
-                try:
-                    start = float(row[0]) * 1000
-                    end = float(row[1]) * 1000
-                except ValueError:
-                    continue
-                # Round start and end times to integer milliseconds.
-                start = int(round(start, 0))
-                end = int(round(end, 0))
-                # mark = row[2]
-                text = row[2]
-                text, url = self._split_url(text)
-                chap = Chapter(start, end, text=text, url=url)
-                self.chapters.append(chap)
+        mm = self.mm
+        offset = 40
+        while offset + 24 <= len(mm):
+            guid = mm[offset : offset + 16]
+            (size,) = struct.unpack_from("<Q", mm, offset + 16)
+            body = offset + 24
+            if size < 24:
+                break
+            size -= 24
+            self.chunks.append((guid[0:4].decode("ascii", "replace"), offset, size))
+            if guid == b"fmt " + self.W64_SUFFIX:
+                self._parse_format(body, size)
+            elif guid == b"data" + self.W64_SUFFIX:
+                self._set_data(body, size)
+                break
+            offset = body + size + (-size % 8)
+
+    def _set_data(self, body: int, size: int) -> None:
+        available = len(self.mm) - body
+        self.data_offset = body
+        self.declared_size = size
+        if self.container == "RIFF":
+            if size in self.UNSET_SIZES:
+                # The recording was cut off before its header was finished, so
+                # the audio runs to the end of the file.
+                self.unfinished = True
+                size = available
+            elif available > 0xFFFFFFFF and (available - size) % (1 << 32) == 0:
+                # Some recorders keep writing past 4 GB in a plain RIFF file,
+                # and the size wraps around. The audio is all still there.
+                self.unfinished = True
+                size = available
+        self.data_size = min(size, available)
+
+    def _parse_format(self, body: int, size: int) -> None:
+        (
+            self.format,
+            self.channels,
+            self.sample_rate,
+            byte_rate,
+            self.block_align,
+            self.bits,
+        ) = struct.unpack_from("<HHIIHH", self.mm, body)
+        if self.format == self.EXTENSIBLE and size >= 40:
+            # The real format is the start of the sub-format GUID
+            (self.format,) = struct.unpack_from("<H", self.mm, body + 24)
+
+    @property
+    def frames(self) -> int:
+        """The number of whole sample frames (one sample per channel)."""
+        return self.data_size // self.block_align if self.block_align else 0
+
+    @property
+    def duration_ms(self) -> int:
+        if not self.sample_rate:
+            return 0
+        return self.frames * 1000 // self.sample_rate
+
+    @property
+    def pcm_end(self) -> int:
+        """The offset just past the last whole frame of audio."""
+        return self.data_offset + self.frames * self.block_align
+
+    def offset_at(self, ms: int) -> int:
+        """The offset of the frame ``ms`` milliseconds in, within the audio."""
+        frame = min(self.frames, max(0, ms * self.sample_rate // 1000))
+        return self.data_offset + frame * self.block_align
+
+    @property
+    def truncated(self) -> bool:
+        """Whether the file ends before the data chunk says it should."""
+        return not self.unfinished and self.data_size < self.declared_size
+
+    @property
+    def needs_conversion(self) -> bool:
+        """Whether the audio has to be converted before LAME can read it."""
+        return self.format == self.IEEE_FLOAT
+
+    def sample_format(self) -> str:
+        if self.format == self.IEEE_FLOAT:
+            return "{}-bit float".format(self.bits)
+        if self.format == self.PCM:
+            return "{}-bit PCM".format(self.bits)
+        return "format 0x{:04x}".format(self.format)
+
+    def describe(self) -> str:
+        """Summarize the audio, e.g. "1:02:03, stereo, 48000 Hz, 24-bit PCM"."""
+        channels = {1: "mono", 2: "stereo"}.get(
+            self.channels, "{} channels".format(self.channels)
+        )
+        return "{}, {}, {} Hz, {}".format(
+            datetime.timedelta(seconds=self.duration_ms // 1000),
+            channels,
+            self.sample_rate,
+            self.sample_format(),
+        )
 
-    def _load_lrc(self, path: str):
-        """Load an LRC file.
+    def same_format(self, other) -> bool:
+        """Whether another WAVFile's audio can run on from this one's."""
+        return (self.format, self.channels, self.sample_rate, self.bits) == (
+            other.format,
+            other.channels,
+            other.sample_rate,
+            other.bits,
+        )
 
-        This plugin also supports URLs, if they are appended to the end of the
-        marker with a pipe character:
-            Some Marker Name|https://example.com
-        """
-        with open(path, "r", encoding="utf-8-sig") as fp:
-            previous = None
-            for line in fp:
-                if re.match(r"^\[(ti|ar|al):(.*)\]$", line) is not None:
-                    continue
-                result = re.match(r"^\[(\d+):(\d\d\.\d+)\](.*)$", line)
-                if result is None:
-                    continue
-                minutes = int(result.group(1))
-                seconds = float(result.group(2))
-                label = result.group(3)
-                millisec = (minutes * 60 * 1000) + int(round(seconds * 1000))
-                if previous is not None:
-                    self.chapters.append(
-                        Chapter(
-                            previous[0], millisec, text=previous[1], url=previous[2]
-                        )
-                    )
-                text, url = self._split_url(label)
-                previous = (millisec, text, url)
-            self.chapters.append(
-                Chapter(previous[0], previous[0], text=previous[1], url=previous[2])
+    def problems(self) -> list:
+        """List the reasons this file can't be encoded, if there are any."""
+        problems = []
+        if self.format == self.PCM:
+            if self.bits not in (8, 16, 24, 32):
+                problems.append("{}-bit PCM is not supported".format(self.bits))
+        elif self.format == self.IEEE_FLOAT:
+            if self.bits not in (32, 64):
+                problems.append("{}-bit float is not supported".format(self.bits))
+        else:
+            problems.append("{} is not supported".format(self.sample_format()))
+        if self.channels not in (1, 2):
+            problems.append("only mono and stereo audio can be encoded")
+        if not self.sample_rate:
+            problems.append("the sample rate is 0")
+        if self.block_align != self.channels * ((self.bits + 7) // 8):
+            problems.append("the frame size doesn't match the sample format")
+        elif self.frames == 0:
+            problems.append("there is no audio in the data chunk")
+        if self.truncated:
+            problems.append(
+                "it is truncated ({} of {} bytes of audio are there)".format(
+                    self.data_size, self.declared_size
+                )
             )
+        return ["{}: {}".format(self.path, problem) for problem in problems]
 
-    def save(self, path: str, type: int):
-        if type == self.LRC:
-            self._save_lrc(path)
-        elif type == self.CUE:
-            self._save_cue(path)
-        elif type == self.SIMPLE:
-            self._save_simple(path)
-        elif type == self.AUDACITY:
-            self._save_audacity(path)
-        elif type == self.FFMETADATA1:
-            self._save_ffmetadata1(path)
+    def view(self, start: int, end: int) -> memoryview:
+        """Get a zero-copy view of some bytes of the file."""
+        return memoryview(self.mm)[start:end]
 
-    def _save_lrc(self, path: str):
-        with open(path, "w") as fp:
-            if self.metadata is not None:
-                fp.write("[ti:{}]\n".format(self.metadata.title))
-                fp.write("[ar:{}]\n".format(self.metadata.artist))
-                fp.write("[al:{}]\n".format(self.metadata.album))
-            for chapter in self.chapters:
-                minutes = chapter.start // (60 * 1000)
-                seconds = (chapter.start % (60 * 1000)) // 1000
-                fraction = (chapter.start % 1000) // 10
-                fp.write(
-                    "[{:02d}:{:02d}.{:02d}]{}\n".format(
-                        minutes, seconds, fraction, chapter.text
-                    )
-                )
+    def to_float(self, block):
+        """Convert raw PCM bytes to a (frames, channels) array of floats.
 
-    def _save_cue(self, path: str):
-        if self.media_filename is None:
-            raise PostShowError(
-                "Writing CUE files is not possible without "
-                "the associated media file name. Pass "
-                "media_filename='path' when creating the MCS."
+        Samples are scaled to -1.0..1.0. Requires NumPy.
+        """
+        width = self.bits // 8
+        if self.format == self.IEEE_FLOAT:
+            samples = numpy.frombuffer(
+                block, dtype="<f4" if width == 4 else "<f8"
+            ).astype(numpy.float32)
+        elif width == 1:
+            # 8-bit WAV is unsigned
+            samples = (numpy.frombuffer(block, dtype=numpy.uint8) - 128.0) / 128.0
+        elif width == 3:
+            raw = numpy.frombuffer(block, dtype=numpy.uint8).reshape(-1, 3)
+            ints = (
+                raw[:, 0].astype(numpy.int32)
+                | (raw[:, 1].astype(numpy.int32) << 8)
+                | (raw[:, 2].astype(numpy.int8).astype(numpy.int32) << 16)
             )
-        with open(path, "w") as fp:
-            fp.write("\ufeff")  # UTF-8 BOM for foobar2000
-            fp.write(
-                'REM COMMENT "Generated by PostShow v2: '
-                'https://github.com/vladasbarisas/XBN"\n'
+            samples = ints / float(1 << 23)
+        else:
+            samples = numpy.frombuffer(block, dtype="<i{}".format(width)) / float(
+                1 << (self.bits - 1)
             )
-            fp.write('FILE "{}" MP3\n'.format(self.media_filename))
-            if self.metadata is not None:
-                fp.write("REM GENRE {}\n".format(self.metadata.genre))
-                fp.write('TITLE "{}"\n'.format(self.metadata.title))
-                fp.write('PERFORMER "{}"\n'.format(self.metadata.artist))
-            for i in range(0, len(self.chapters)):
-                chapter = self.chapters[i]
-                minutes = chapter.start // (60 * 1000)
-                seconds = (chapter.start % (60 * 1000)) // 1000
-                # Magic constant is 75/1000, or the number of CUE "frames" per
-                # millisecond:
-                # https://en.wikipedia.org/wiki/Cue_sheet_(computing)#Essential_commands
-                fraction = int(math.floor((chapter.start % 1000) * 0.075))
-                fp.write(
-                    "  TRACK {0:02d} AUDIO\n"
-                    '    TITLE "{1}"\n'
-                    "    INDEX 01 {2:02d}:{3:02d}:{4:02d}\n".format(
-                        i + 1,
-                        chapter.text.replace('"', "_"),
-                        minutes,
-                        seconds,
-                        fraction,
-                    )
-                )
+        return samples.astype(numpy.float32).reshape(-1, self.channels)
+
+    def to_int(self, block, bits: int):
+        """Convert raw PCM bytes to signed 16 or 32-bit little-endian samples.
+
+        Requires NumPy.
+        """
+        scale = float(1 << (bits - 1))
+        samples = self.to_float(block).astype(numpy.float64) * scale
+        return numpy.clip(samples, -scale, scale - 1).astype("<i{}".format(bits // 8))
+
+
+class LoudnessMeter:
+    """Measure loudness, true peak and clipping, following ITU-R BS.1770-4.
+
+    Call the meter with blocks of PCM from a ``WAVFile`` (it can be used as
+    an ``MP3Encoder`` observer), then call ``result()`` at the end. All of
+    the work is vectorized NumPy over whole blocks:
+    * K-weighting is applied as an FIR approximation of the two BS.1770
+      biquads, by FFT overlap-add, so the filter state carries across blocks
+    * Mean square is kept per 100 ms, so the gated 400 ms blocks (75%
+      overlap) can be built at the end
+    * True peak is the sample peak of a 4x polyphase oversampling
+    """
+
+    # Length of the K-weighting impulse response, in samples. Both biquads
+    # have died away long before this.
+    FIR_LENGTH = 4096
+    # Frames filtered per FFT; the rest of the FFT holds the filter's tail.
+    FFT_SIZE = 1 << 17
+    SEGMENT = FFT_SIZE - FIR_LENGTH + 1
+    OVERSAMPLE = 4
+    TAPS_PER_PHASE = 12
+    ABSOLUTE_GATE = -70.0
+    RELATIVE_GATE = -10.0
+
+    def __init__(self, wav: WAVFile):
+        if numpy is None:
+            raise PostShowError("Loudness analysis requires NumPy.")
+        self.wav = wav
+        self.channels = wav.channels
+        self.step = wav.sample_rate // 10
+        # Channel weights: surrounds count for more, and LFE not at all.
+        if self.channels == 6:
+            self.weights = numpy.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41])
+        else:
+            self.weights = numpy.ones(self.channels)
+        self.fir = self._k_weighting_response(wav.sample_rate, self.FIR_LENGTH)
+        self.fir_spectrum = numpy.fft.rfft(self.fir, self.FFT_SIZE).astype(
+            numpy.complex64
+        )
+        self.tail = numpy.zeros((self.FIR_LENGTH - 1, self.channels), numpy.float32)
+        self.leftover = numpy.zeros((0, self.channels), numpy.float32)
+        self.energies = []
+        self.phases = self._oversampling_phases()
+        self.history = numpy.zeros(
+            (self.TAPS_PER_PHASE - 1, self.channels), numpy.float32
+        )
+        self.sample_peak = 0.0
+        self.true_peak = 0.0
+        self.clipped = 0
+        if wav.format == WAVFile.IEEE_FLOAT:
+            self.clip_level = 1.0
+        else:
+            self.clip_level = 1.0 - 2.0 ** -(wav.bits - 1)
+        self._result = None
+
+    @staticmethod
+    def _k_weighting_response(rate: int, length: int):
+        """Run an impulse through the two K-weighting biquads.
+
+        The coefficients are worked out for any sample rate from the filter
+        parameters in BS.1770, the same way pyloudnorm does it.
+        """
+        filters = []
+        # High shelf
+        gain, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+        k = math.tan(math.pi * fc / rate)
+        vh = 10.0 ** (gain / 20.0)
+        vb = vh**0.4996667741545416
+        a0 = 1.0 + k / q + k * k
+        filters.append(
+            (
+                [
+                    (vh + vb * k / q + k * k) / a0,
+                    2.0 * (k * k - vh) / a0,
+                    (vh - vb * k / q + k * k) / a0,
+                ],
+                [1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0],
+            )
+        )
+        # High pass
+        q, fc = 0.5003270373238773, 38.13547087602444
+        k = math.tan(math.pi * fc / rate)
+        a0 = 1.0 + k / q + k * k
+        filters.append(
+            (
+                [1.0, -2.0, 1.0],
+                [1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0],
+            )
+        )
+        signal = [0.0] * length
+        signal[0] = 1.0
+        for b, a in filters:
+            out = []
+            x1 = x2 = y1 = y2 = 0.0
+            for x in signal:
+                y = b[0] * x + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+                x2, x1, y2, y1 = x1, x, y1, y
+                out.append(y)
+            signal = out
+        return numpy.array(signal)
+
+    def _oversampling_phases(self):
+        """Build a (taps, phases) windowed-sinc interpolation filter."""
+        taps = self.TAPS_PER_PHASE * self.OVERSAMPLE
+        n = numpy.arange(taps) - (taps - 1) / 2.0
+        kernel = numpy.sinc(n / self.OVERSAMPLE) * numpy.kaiser(taps, 8.0)
+        # Phase p uses every OVERSAMPLEth tap starting at p; reverse each
+        # phase so a sliding window can be multiplied straight through.
+        phases = kernel.reshape(self.TAPS_PER_PHASE, self.OVERSAMPLE)[::-1]
+        return (phases / phases.sum(axis=0)).astype(numpy.float32)
+
+    def __call__(self, block) -> None:
+        samples = self.wav.to_float(block)
+        for start in range(0, len(samples), self.SEGMENT):
+            self._measure(samples[start : start + self.SEGMENT])
+
+    def _measure(self, x) -> None:
+        n = len(x)
+        peak = numpy.abs(x)
+        self.sample_peak = max(self.sample_peak, float(peak.max(initial=0.0)))
+        self.clipped += int(numpy.count_nonzero(peak >= self.clip_level))
+        # True peak
+        extended = numpy.concatenate([self.history, x])
+        for ch in range(self.channels):
+            windows = numpy.lib.stride_tricks.sliding_window_view(
+                extended[:, ch], self.TAPS_PER_PHASE
+            )
+            upsampled = windows @ self.phases
+            self.true_peak = max(
+                self.true_peak, float(numpy.abs(upsampled).max(initial=0.0))
+            )
+        self.history = extended[-(self.TAPS_PER_PHASE - 1) :]
+        # K-weighting by overlap-add
+        spectrum = numpy.fft.rfft(x, self.FFT_SIZE, axis=0)
+        filtered = numpy.fft.irfft(
+            spectrum * self.fir_spectrum[:, None], self.FFT_SIZE, axis=0
+        )[: n + self.FIR_LENGTH - 1]
+        filtered[: self.FIR_LENGTH - 1] += self.tail
+        self.tail = filtered[n:].copy()
+        # Mean square per 100 ms
+        squares = numpy.concatenate([self.leftover, filtered[:n] ** 2])
+        whole = len(squares) // self.step
+        if whole:
+            sums = squares[: whole * self.step].reshape(whole, self.step, -1)
+            self.energies.append(sums.mean(axis=1))
+        self.leftover = squares[whole * self.step :]
+
+    def result(self) -> dict:
+        """Finish the measurement, and return its results."""
+        if self._result is not None:
+            return self._result
+        integrated = None
+        if self.energies:
+            energies = numpy.concatenate(self.energies)
+            if len(energies) >= 4:
+                # 400 ms blocks, every 100 ms
+                cumulative = numpy.cumsum(
+                    numpy.vstack([numpy.zeros(self.channels), energies]), axis=0
+                )
+                blocks = (cumulative[4:] - cumulative[:-4]) / 4.0
+                power = blocks @ self.weights
+                with numpy.errstate(divide="ignore"):
+                    loudness = -0.691 + 10.0 * numpy.log10(power)
+                gated = power[loudness > self.ABSOLUTE_GATE]
+                if len(gated):
+                    relative = (
+                        -0.691 + 10.0 * math.log10(gated.mean()) + self.RELATIVE_GATE
+                    )
+                    gated = power[
+                        (loudness > self.ABSOLUTE_GATE) & (loudness > relative)
+                    ]
+                    integrated = -0.691 + 10.0 * math.log10(gated.mean())
+        self._result = {
+            "integrated_lufs": self._round(integrated),
+            "true_peak_dbtp": self._round(
+                self._db(max(self.true_peak, self.sample_peak))
+            ),
+            "sample_peak_dbfs": self._round(self._db(self.sample_peak)),
+            "clipped_samples": self.clipped,
+        }
+        return self._result
+
+    @staticmethod
+    def _db(amplitude: float):
+        return None if amplitude <= 0.0 else 20.0 * math.log10(amplitude)
+
+    @staticmethod
+    def _round(value):
+        return None if value is None else round(value, 2)
+
+
+class WaveformPeaks:
+    """Work out the peaks of the audio for drawing its waveform, at several
+    zoom levels, in the formats used by BBC's audiowaveform (and so
+    peaks.js).
+
+    Call it with blocks of PCM from a ``WAVFile`` (it can be used as an
+    ``MP3Encoder`` observer, so it runs while the WAV is read for encoding),
+    then call ``save()`` at the end. The channels are mixed down, and each
+    block is reduced with NumPy to the minimum and maximum of every
+    ``samples_per_pixel`` frames at the finest level. Coarser levels are
+    reduced from those, so they're rounded to a multiple of the finest.
+    Peaks are stored as 8-bit values.
+    """
+
+    DAT_HEADER = struct.Struct("<iIiII")
+    DAT_VERSION = 1
+    DAT_8_BIT = 1
+    JSON_VERSION = 2
+    BLOCK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, wav: WAVFile, resolutions: list):
+        """
+        :param wav: The WAV the blocks will come from.
+        :param resolutions: Audio frames per pixel at each zoom level.
+        """
+        if numpy is None:
+            raise PostShowError("Waveform peaks require NumPy.")
+        self.wav = wav
+        self.sample_rate = wav.sample_rate
+        self.resolutions = sorted(set(resolutions))
+        self.base = self.resolutions[0]
+        self.leftover = numpy.zeros(0, numpy.float32)
+        self.mins = []
+        self.maxs = []
+        self._levels = None
+
+    @classmethod
+    def measure(cls, paths: list, resolutions: list):
+        """Work out the peaks of a WAV (or of the WAV parts of a recording,
+        one after the other) by reading it on its own."""
+        peaks = None
+        for path in paths:
+            with WAVFile(path) as wav:
+                if peaks is None:
+                    peaks = cls(wav, resolutions)
+                size = max(1, cls.BLOCK_SIZE // wav.block_align) * wav.block_align
+                for offset in range(wav.data_offset, wav.pcm_end, size):
+                    with wav.view(offset, min(offset + size, wav.pcm_end)) as block:
+                        peaks(block)
+        return peaks
+
+    def __call__(self, block) -> None:
+        mono = self.wav.to_float(block).mean(axis=1)
+        samples = numpy.concatenate([self.leftover, mono])
+        whole = len(samples) // self.base
+        if whole:
+            self._add(samples[: whole * self.base].reshape(whole, self.base))
+        self.leftover = samples[whole * self.base :]
+
+    def _add(self, pixels) -> None:
+        self.mins.append(self._quantize(pixels.min(axis=1)))
+        self.maxs.append(self._quantize(pixels.max(axis=1)))
+
+    @staticmethod
+    def _quantize(values):
+        return numpy.clip(numpy.round(values * 127.0), -128, 127).astype(numpy.int8)
+
+    def levels(self) -> dict:
+        """Finish up, and get {samples per pixel: (mins, maxs)} for each
+        zoom level."""
+        if self._levels is not None:
+            return self._levels
+        if len(self.leftover):
+            # The last pixel is only partly filled
+            self._add(self.leftover.reshape(1, -1))
+            self.leftover = self.leftover[:0]
+        mins = numpy.concatenate(self.mins or [numpy.zeros(0, numpy.int8)])
+        maxs = numpy.concatenate(self.maxs or [numpy.zeros(0, numpy.int8)])
+        self._levels = {}
+        for resolution in self.resolutions:
+            factor = max(1, round(resolution / self.base))
+            pad = -len(mins) % factor
+            self._levels[factor * self.base] = (
+                numpy.concatenate([mins, numpy.full(pad, 127, numpy.int8)])
+                .reshape(-1, factor)
+                .min(axis=1),
+                numpy.concatenate([maxs, numpy.full(pad, -128, numpy.int8)])
+                .reshape(-1, factor)
+                .max(axis=1),
+            )
+        return self._levels
+
+    def dat_bytes(self, samples_per_pixel: int) -> bytes:
+        """One level as an audiowaveform binary (.dat) file."""
+        mins, maxs = self.levels()[samples_per_pixel]
+        header = self.DAT_HEADER.pack(
+            self.DAT_VERSION,
+            self.DAT_8_BIT,
+            self.sample_rate,
+            samples_per_pixel,
+            len(mins),
+        )
+        return header + numpy.column_stack([mins, maxs]).tobytes()
+
+    def json_value(self, samples_per_pixel: int, chapters: list, files: dict) -> dict:
+        """One level in audiowaveform's JSON format, with the chapters and a
+        list of the .dat files for every level added.
+
+        :param files: {samples per pixel: file name} for the .dat files.
+        """
+        mins, maxs = self.levels()[samples_per_pixel]
+        return {
+            "version": self.JSON_VERSION,
+            "channels": 1,
+            "sample_rate": self.sample_rate,
+            "samples_per_pixel": samples_per_pixel,
+            "bits": 8,
+            "length": len(mins),
+            "data": numpy.column_stack([mins, maxs]).ravel().tolist(),
+            "chapters": [
+                {
+                    "start_ms": chapter.start,
+                    "end_ms": chapter.end,
+                    "text": chapter.text,
+                    "url": chapter.url,
+                }
+                for chapter in chapters
+            ],
+            "levels": [
+                {"samples_per_pixel": spp, "file": name}
+                for spp, name in sorted(files.items())
+            ],
+        }
+
+    def save(self, json_path: str, dat_paths: dict, chapters: list) -> None:
+        """Write a .dat file for each level, and a JSON file with the
+        coarsest level (for an overview), the chapters and the .dat files.
+
+        :param dat_paths: {samples per pixel: path} for each of ``levels()``.
+        """
+        for spp, path in dat_paths.items():
+            with atomic_write(path, "wb") as fp:
+                fp.write(self.dat_bytes(spp))
+        files = {spp: os.path.basename(path) for spp, path in dat_paths.items()}
+        with atomic_write(json_path, encoding="utf-8") as fp:
+            json.dump(self.json_value(max(files), chapters, files), fp)
+            fp.write("\n")
+
+
+class SilenceSnapper:
+    """Move chapter starts to the nearest silence in the WAV.
+
+    Markers placed by hand (or by Gelo) tend to be a second or two away from
+    where the segment actually changes. For each chapter, only the audio
+    within ``tolerance_ms`` of its start is read from the memory-mapped WAV,
+    cut into short windows, and measured with NumPy. If any windows are
+    quieter than ``threshold_db``, the chapter is moved to where the nearest
+    stretch of silence ends, which is where the next segment begins.
+    """
+
+    WINDOW_MS = 20
+
+    def __init__(self, wav: WAVFile, tolerance_ms: int, threshold_db: float = -45.0):
+        if numpy is None:
+            raise PostShowError("Snapping chapters to silence requires NumPy.")
+        self.wav = wav
+        self.tolerance_ms = tolerance_ms
+        self.threshold = 10.0 ** (threshold_db / 20.0)
+        self.window = max(1, wav.sample_rate * self.WINDOW_MS // 1000)
+
+    def _frame(self, ms: int) -> int:
+        return ms * self.wav.sample_rate // 1000
+
+    def _ms(self, frame: int) -> int:
+        return frame * 1000 // self.wav.sample_rate
+
+    def find(self, start_ms: int):
+        """Find where the nearest silence to ``start_ms`` ends, or None."""
+        first = max(0, self._frame(start_ms - self.tolerance_ms))
+        last = min(self.wav.frames, self._frame(start_ms + self.tolerance_ms))
+        windows = (last - first) // self.window
+        if windows < 1:
+            return None
+        align = self.wav.block_align
+        begin = self.wav.data_offset + first * align
+        with self.wav.view(begin, begin + windows * self.window * align) as block:
+            samples = self.wav.to_float(block)
+        rms = numpy.sqrt(
+            (samples.reshape(windows, self.window, -1) ** 2).mean(axis=(1, 2))
+        )
+        silent = rms < self.threshold
+        if not silent.any():
+            return None
+        # Each stretch of silence ends where a silent window is followed by a
+        # loud one (or by the end of what was read).
+        ends = numpy.flatnonzero(silent & ~numpy.append(silent[1:], False)) + 1
+        starts = numpy.flatnonzero(silent & ~numpy.insert(silent[:-1], 0, False))
+        marker = (self._frame(start_ms) - first) / self.window
+        # Distance from the marker to each stretch; zero if it's inside one.
+        distance = numpy.maximum(0, numpy.maximum(starts - marker, marker - ends))
+        nearest = int(numpy.argmin(distance))
+        return self._ms(first + int(ends[nearest]) * self.window)
+
+    def snap(self, chapters: list) -> None:
+        """Move the starts of ``chapters`` (in place), keeping them in order.
+
+        A chapter with an end isn't moved to (or past) its end; with a
+        tolerance longer than the chapter, the nearest silence can be there.
+        """
+        previous = None
+        for chapter in chapters:
+            snapped = self.find(chapter.start)
+            if (
+                snapped is not None
+                and (previous is None or snapped > previous.start)
+                and not chapter.start < chapter.end <= snapped
+            ):
+                if previous is not None and previous.end == chapter.start:
+                    previous.end = snapped
+                if chapter.end <= chapter.start:
+                    # Point labels stay points
+                    chapter.end = snapped
+                chapter.start = snapped
+            previous = chapter
+
+
+class EncoderBackend:
+    """A way of turning the WAV's PCM into a compressed audio file.
+
+    ``MP3Encoder`` reads the WAV and hands each block of whole frames to
+    ``write``, then calls ``finish`` at the end. Subclasses say which output
+    formats they can make, and how to tell whether they're installed.
+    """
+
+    name = None
+    FORMATS = ()
+    _versions = {}
+
+    def __init__(self, wav: WAVFile, fmt: str, bitrate: str, outfile: str):
+        if fmt not in self.FORMATS:
+            raise PostShowError(
+                "The {} encoder can't make {} files.".format(self.name, fmt)
+            )
+        self.wav = wav
+        self.fmt = fmt
+        self.bitrate = bitrate
+        self.outfile = outfile
+
+    @classmethod
+    def available(cls) -> bool:
+        return shutil.which(cls.name) is not None
+
+    @classmethod
+    def version(cls) -> str:
+        """Identify the encoder, so a new version's output isn't mistaken for
+        the old one's."""
+        if cls.name not in cls._versions:
+            cls._versions[cls.name] = cls._find_version()
+        return cls._versions[cls.name]
+
+    @classmethod
+    def _find_version(cls) -> str:
+        try:
+            output = subprocess.run(
+                cls.version_command(),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=False,
+            ).stdout
+        except FileNotFoundError:
+            raise PostShowError("{} is not installed.".format(cls.name))
+        return output.decode("utf-8", "replace").split("\n")[0]
+
+    @classmethod
+    def version_command(cls) -> list:
+        return [cls.name, "-version"]
+
+    @staticmethod
+    def settings(fmt: str, bitrate: str) -> list:
+        """The settings that affect the output, minus the files."""
+        raise NotImplementedError()
+
+    @classmethod
+    def problems(cls, wav: WAVFile) -> list:
+        """List the reasons this backend can't encode ``wav``."""
+        return []
+
+    def write(self, block) -> None:
+        """Encode a block of PCM. Raise BrokenPipeError if the encoder quit."""
+        raise NotImplementedError()
+
+    def finish(self, complete: bool) -> None:
+        """Finish the file. Raise PostShowError if the encoder failed."""
+        raise NotImplementedError()
+
+    def abort(self) -> None:
+        """Stop encoding as soon as possible, from another thread."""
+
+
+class SubprocessBackend(EncoderBackend):
+    """An encoder run as a separate program, which reads PCM on stdin."""
+
+    def __init__(self, wav: WAVFile, fmt: str, bitrate: str, outfile: str):
+        super().__init__(wav, fmt, bitrate, outfile)
+        # Errors go to a file, so a chatty encoder can't fill up a pipe
+        self.errors = tempfile.TemporaryFile()
+        self.p = subprocess.Popen(
+            self.command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self.errors,
+        )
+
+    def command(self) -> list:
+        raise NotImplementedError()
+
+    def write(self, block) -> None:
+        self.p.stdin.write(block)
+
+    def finish(self, complete: bool) -> None:
+        try:
+            self.p.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.p.wait()
+        self.errors.seek(0)
+        lines = self.errors.read().decode("utf-8", "replace").strip().split("\n")
+        self.errors.close()
+        if returncode != 0 and complete:
+            raise PostShowError(
+                "{} exited with status {}: {}".format(self.name, returncode, lines[-1])
+            )
+
+    def abort(self) -> None:
+        self.p.terminate()
+
+
+class LameBackend(SubprocessBackend):
+    """The ``lame`` program, reading raw PCM."""
+
+    name = "lame"
+    FORMATS = ("mp3",)
+
+    @classmethod
+    def version_command(cls) -> list:
+        return ["lame", "--version"]
+
+    @staticmethod
+    def settings(fmt: str, bitrate: str) -> list:
+        return ["-t", "-b", bitrate, "--cbr"]
+
+    @classmethod
+    def problems(cls, wav: WAVFile) -> list:
+        if wav.needs_conversion and numpy is None:
+            return ["{}: converting float audio requires NumPy".format(wav.path)]
+        return []
+
+    def command(self) -> list:
+        wav = self.wav
+        # LAME can't read float, so that gets converted to 32-bit integers.
+        bits = 32 if wav.needs_conversion else wav.bits
+        args = [
+            "lame",
+            "-r",
+            "-s",
+            "{:g}".format(wav.sample_rate / 1000),
+            "--bitwidth",
+            str(bits),
+            "--unsigned" if bits == 8 else "--signed",
+            "--little-endian",
+        ]
+        if wav.channels == 1:
+            args.extend(["-m", "m"])
+        return args + self.settings(self.fmt, self.bitrate) + ["-", self.outfile]
+
+    def write(self, block) -> None:
+        if self.wav.needs_conversion:
+            block = self.wav.to_int(block, 32)
+        self.p.stdin.write(block)
+
+
+class FFmpegBackend(SubprocessBackend):
+    """``ffmpeg``, which can also make Opus and AAC, and reads float as-is."""
+
+    name = "ffmpeg"
+    FORMATS = ("mp3", "opus", "aac")
+    # Codec and container for each output format
+    CODECS = {
+        "mp3": ("libmp3lame", "mp3"),
+        "opus": ("libopus", "opus"),
+        "aac": ("aac", "ipod"),
+    }
+
+    @staticmethod
+    def settings(fmt: str, bitrate: str) -> list:
+        codec, container = FFmpegBackend.CODECS[fmt]
+        args = ["-c:a", codec, "-b:a", "{}k".format(bitrate)]
+        if fmt == "opus":
+            # Opus only runs at a few sample rates
+            args.extend(["-ar", "48000"])
+        # Leave out the version string and random Ogg serial numbers, so the
+        # same audio always makes the same file
+        args.extend(["-fflags", "+bitexact", "-flags:a", "+bitexact"])
+        return args + ["-f", container]
+
+    def command(self) -> list:
+        wav = self.wav
+        if wav.format == WAVFile.IEEE_FLOAT:
+            sample_format = "f{}le".format(wav.bits)
+        elif wav.bits == 8:
+            sample_format = "u8"
+        else:
+            sample_format = "s{}le".format(wav.bits)
+        return (
+            ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error"]
+            + ["-f", sample_format, "-ar", str(wav.sample_rate)]
+            + ["-ac", str(wav.channels), "-i", "-"]
+            + self.settings(self.fmt, self.bitrate)
+            + ["-y", self.outfile]
+        )
+
+
+class LameencBackend(EncoderBackend):
+    """LAME in this process, through the ``lameenc`` module.
+
+    There's no program to start and no pipe to copy through, which makes a
+    difference on short clips where starting LAME takes most of the time.
+    """
+
+    name = "lameenc"
+    FORMATS = ("mp3",)
+
+    def __init__(self, wav: WAVFile, fmt: str, bitrate: str, outfile: str):
+        super().__init__(wav, fmt, bitrate, outfile)
+        self.encoder = lameenc.Encoder()
+        self.encoder.set_bit_rate(int(bitrate))
+        self.encoder.set_in_sample_rate(wav.sample_rate)
+        self.encoder.set_channels(wav.channels)
+        self.encoder.set_quality(2)
+        self.fp = open(outfile, "wb")
+        self.stop_requested = False
+
+    @classmethod
+    def available(cls) -> bool:
+        return lameenc is not None
+
+    @classmethod
+    def _find_version(cls) -> str:
+        if lameenc is None:
+            raise PostShowError("lameenc is not installed.")
+        try:
+            return "lameenc " + importlib.metadata.version("lameenc")
+        except importlib.metadata.PackageNotFoundError:
+            return "lameenc"
+
+    @staticmethod
+    def settings(fmt: str, bitrate: str) -> list:
+        return ["bitrate", bitrate, "quality", "2"]
+
+    @classmethod
+    def problems(cls, wav: WAVFile) -> list:
+        # lameenc only takes 16-bit samples
+        if (wav.format, wav.bits) != (WAVFile.PCM, 16) and numpy is None:
+            return [
+                "{}: converting {} audio requires NumPy".format(
+                    wav.path, wav.sample_format()
+                )
+            ]
+        return []
+
+    def write(self, block) -> None:
+        if self.stop_requested:
+            raise BrokenPipeError()
+        if (self.wav.format, self.wav.bits) != (WAVFile.PCM, 16):
+            block = self.wav.to_int(block, 16)
+        self.fp.write(self.encoder.encode(bytes(block)))
+
+    def finish(self, complete: bool) -> None:
+        try:
+            if complete:
+                self.fp.write(self.encoder.flush())
+        finally:
+            self.fp.close()
+
+    def abort(self) -> None:
+        self.stop_requested = True
+
+
+# Encoder backends, by the name used for them in the profile
+ENCODER_BACKENDS = {
+    backend.name: backend for backend in (LameBackend, FFmpegBackend, LameencBackend)
+}
+
+
+class MP3Encoder(threading.Thread):
+    """Feed the WAV file through an encoder backend (LAME, by default).
+
+    The WAV file is memory-mapped and handed to the backend in large blocks
+    by this thread, rather than handed to an encoder by name, so that its
+    content hash (and anything else passed to ``add_observer``) can be worked
+    out on the way through without reading the file a second time. Progress
+    is counted from the audio handed over, so no encoder's output has to be
+    parsed for it.
+    """
+
+    BLOCK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self):
+        super().__init__()
+        self.infile = None
+        self.infiles = []
+        self.outfile = None
+        self.bitrate = None
+        self.backend_class = LameBackend
+        self.fmt = "mp3"
+        self.backend = None
+        self.percent = 0
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.audio_ms = 0
+        self.start_time = None
+        self.end_time = None
+        self.started = False
+        self.finished = False
+        self.completed = False
+        self.error = None
+        self.stop_requested = False
+        self.hashing = True
+        self.sha256 = None
+        self.part_sha256 = []
+        self.observers = []
+        self.profiler = Profiler(enabled=False)
+        self.start_ms = 0
+        self.end_ms = None
+
+    def setup(
+        self,
+        infile,
+        outfile: str,
+        bitrate: str,
+        backend: str = "lame",
+        fmt: str = "mp3",
+        start_ms: int = 0,
+        end_ms=None,
+    ):
+        """Configure the input and output files, and the encoder settings.
+
+        :param infile: Path to WAV file, or a list of the WAV files a
+        recording was made in, to be encoded one after the other as if they
+        were one. They're read straight from each file, not joined on disk.
+        :param outfile: Path to create the encoded file at.
+        :param bitrate: CBR bitrate, in Kbps.
+        :param backend: Name of the encoder backend to use (see
+        ``ENCODER_BACKENDS``).
+        :param fmt: Output format: mp3, opus or aac.
+        :param start_ms: Where to start encoding, for a clip. With several
+        WAV files, times are from the start of the first.
+        :param end_ms: Where to stop encoding, for a clip, or None to go to
+        the end. Only the clip's part of the WAV is read, so clips aren't
+        hashed.
+        """
+        if backend not in ENCODER_BACKENDS:
+            raise PostShowError("Unknown encoder: {}".format(backend))
+        self.backend_class = ENCODER_BACKENDS[backend]
+        if fmt not in self.backend_class.FORMATS:
+            raise PostShowError(
+                "The {} encoder can't make {} files.".format(backend, fmt)
+            )
+        self.infiles = [infile] if isinstance(infile, str) else list(infile)
+        self.infile = self.infiles[0]
+        self.outfile = outfile
+        self.bitrate = bitrate
+        self.fmt = fmt
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        if start_ms or end_ms is not None:
+            self.hashing = False
+
+    def settings(self) -> list:
+        """The encoder settings, minus the input and output files."""
+        return self.backend_class.settings(self.fmt, self.bitrate)
+
+    def version(self) -> str:
+        return self.backend_class.version()
+
+    def progress(self) -> dict:
+        """Report how far the encode has got.
+
+        ``speed`` is how many seconds of audio are encoded per second.
+        """
+        end = self.end_time if self.end_time is not None else time.monotonic()
+        elapsed = 0.0 if self.start_time is None else end - self.start_time
+        done_ms = self.audio_ms * self.bytes_done // max(1, self.bytes_total)
+        return {
+            "backend": self.backend_class.name,
+            "format": self.fmt,
+            "percent": self.percent,
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.bytes_total,
+            "elapsed_seconds": round(elapsed, 3),
+            "speed": round(done_ms / 1000 / elapsed, 2) if elapsed else None,
+        }
+
+    def add_observer(self, observer) -> None:
+        """Call ``observer(block)`` with the audio as it is encoded.
+
+        Each block is a memoryview of raw PCM from the WAV's data chunk,
+        holding a whole number of sample frames. Observers run on the encoder
+        thread, and must not keep a reference to the block after returning.
+        """
+        self.observers.append(observer)
+
+    def run(self):
+        self.started = True
+        self.start_time = time.monotonic()
+        try:
+            # Open the WAVs before starting the encoder, so there's nothing to
+            # clean up if they can't be read.
+            with contextlib.ExitStack() as stack:
+                wavs = [stack.enter_context(WAVFile(path)) for path in self.infiles]
+                problems = []
+                for wav in wavs:
+                    problems += wav.problems() + self.backend_class.problems(wav)
+                    if not wav.same_format(wavs[0]):
+                        problems.append(
+                            "{} has a different sample format from {}".format(
+                                wav.path, wavs[0].path
+                            )
+                        )
+                if problems:
+                    raise PostShowError("; ".join(problems))
+                with self.profiler.span(
+                    "encode." + self.fmt, backend=self.backend_class.name
+                ) as span:
+                    self._feed(wavs)
+                    # The WAV is read through the map, which the I/O counters
+                    # don't see.
+                    span["bytes_read"] += (
+                        sum(len(wav.mm) for wav in wavs)
+                        if self.hashing
+                        else self.bytes_done
+                    )
+        except (OSError, ValueError, PostShowError) as e:
+            self.error = str(e)
+        finally:
+            self.end_time = time.monotonic()
+            self.finished = True
+
+    def _ranges(self, wavs: list) -> list:
+        """Work out (start, end) offsets of the audio to encode in each WAV,
+        from ``start_ms`` and ``end_ms``, which count across all of them."""
+        ranges = []
+        offset = 0
+        for wav in wavs:
+            pcm_start = wav.offset_at(self.start_ms - offset)
+            if self.end_ms is None:
+                pcm_end = wav.pcm_end
+            else:
+                pcm_end = max(pcm_start, wav.offset_at(self.end_ms - offset))
+            ranges.append((pcm_start, pcm_end))
+            offset += wav.duration_ms
+        return ranges
+
+    def _feed(self, wavs: list) -> None:
+        """Hand the mapped WAVs' audio to the backend, hashing the files too.
+
+        The backend is told the sample format up front and given nothing but
+        raw PCM, so it never has to make sense of the WAV's headers itself,
+        and the audio from several WAVs runs on from one to the next. Each
+        whole file still goes through its hash, in order, unless ``hashing``
+        has been turned off.
+        """
+        first = wavs[0]
+        digests = [hashlib.sha256() for wav in wavs]
+        self.backend = self.backend_class(first, self.fmt, self.bitrate, self.outfile)
+        complete = False
+        ranges = self._ranges(wavs)
+        self.bytes_total = sum(end - start for start, end in ranges)
+        self.audio_ms = (
+            self.bytes_total // first.block_align * 1000 // first.sample_rate
+            if first.sample_rate
+            else 0
+        )
+        block_size = max(1, self.BLOCK_SIZE // first.block_align) * first.block_align
+        try:
+            for wav, digest, (pcm_start, pcm_end) in zip(wavs, digests, ranges):
+                update = digest.update if self.hashing else (lambda data: None)
+                with wav.view(0, wav.data_offset) as header:
+                    update(header)
+                for offset in range(pcm_start, pcm_end, block_size):
+                    if self.stop_requested:
+                        break
+                    with wav.view(offset, min(offset + block_size, pcm_end)) as block:
+                        update(block)
+                        self.backend.write(block)
+                        for observer in self.observers:
+                            try:
+                                observer(block)
+                            except Exception as e:
+                                # Anything from NumPy and the like fails the
+                                # encode, rather than killing the thread
+                                raise PostShowError(
+                                    "Analysing the audio failed: {!r}".format(e)
+                                )
+                        self.bytes_done += len(block)
+                    # Hold back 100% until the encoder has flushed its output.
+                    self.percent = min(
+                        99, self.bytes_done * 100 // max(1, self.bytes_total)
+                    )
+                if self.stop_requested:
+                    break
+                with wav.view(pcm_end, len(wav.mm)) as trailer:
+                    update(trailer)
+            else:
+                complete = True
+        except BrokenPipeError:
+            # The encoder has gone away; finish() says why.
+            pass
+        finally:
+            self.backend.finish(complete)
+        if complete:
+            if self.hashing:
+                self.part_sha256 = [digest.hexdigest() for digest in digests]
+                self.sha256 = HashMemo.combine(self.part_sha256)
+            self.completed = True
+            self.percent = 100
+
+    def succeeded(self) -> bool:
+        """Return true if the encoder ran to completion without errors."""
+        return self.finished and self.completed
+
+    def failure(self) -> str:
+        """Explain why the encoder didn't succeed."""
+        if self.error is not None:
+            return "Unable to encode {}: {}".format(self.infile, self.error)
+        return "The encoder stopped before the end of {}".format(self.infile)
+
+    def request_stop(self):
+        self.stop_requested = True
+        if self.started and self.backend is not None:
+            self.backend.abort()
+
+
+class MP3FrameIndex:
+    """Find where the MPEG audio frames in an MP3 start, so it can be cut
+    into pieces between frames without decoding (and re-encoding) it.
+
+    When the frames are all the same size, as in a CBR file at a bitrate
+    and sample rate that need no padding, frame offsets are worked out
+    arithmetically. Otherwise the frame headers are read once, in one
+    pass, skipping over the audio between them. The encoder delay in LAME's
+    Info frame is allowed for, so times line up with the WAV's.
+
+    A piece cut out this way starts with a frame that may refer back to the
+    frame before it (the bit reservoir), so its first 26 ms or so can decode
+    imperfectly. Nothing else is lost.
+    """
+
+    # Kbps by bitrate index, for MPEG-1 and for MPEG-2 and 2.5, Layer III
+    BITRATES = {
+        True: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+        False: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    }
+    # Sample rates by version bits (3 is MPEG-1, 2 is MPEG-2, 0 is MPEG-2.5)
+    SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000]}
+    SAMPLE_RATES[0] = [11025, 12000, 8000]
+    # Samples of silence LAME adds at the start, plus the decoder's delay,
+    # for files without a LAME tag saying. Every encoder here is LAME.
+    LAME_DELAY = 576 + 529
+    COPY_CHUNK = 64 * 1024 * 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as fp:
+            # An empty file can't be mapped
+            if os.fstat(fp.fileno()).st_size == 0:
+                raise PostShowError("{} is empty".format(path))
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.audio_start = self.id3_size(self.mm[:10])
+        self.audio_end = len(self.mm)
+        if self.audio_end - self.audio_start >= 128 and (
+            self.mm[self.audio_end - 128 : self.audio_end - 125] == b"TAG"
+        ):
+            self.audio_end -= 128
+        first = self._header(self.audio_start)
+        if first is None:
+            self.close()
+            raise PostShowError("{} doesn't start with an MP3 frame".format(path))
+        self.frame_size, self.sample_rate, self.samples_per_frame = first[:3]
+        self.delay = self.LAME_DELAY
+        info = self._info_frame(self.audio_start, first)
+        if info is not None:
+            # The Info (or Xing) frame holds no audio
+            self.delay = info
+            self.audio_start += self.frame_size
+            first = self._header(self.audio_start) or first
+            self.frame_size = first[0]
+        self.offsets = None
+        if not self._fixed_size(first):
+            self._scan()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self.mm.close()
+
+    @staticmethod
+    def id3_size(head: bytes) -> int:
+        """The size of the ID3v2 tag at the start of a file, if any, from the
+        file's first 10 bytes."""
+        if head[:3] != b"ID3" or len(head) < 10:
+            return 0
+        size = 0
+        for byte in head[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        footer = 10 if head[5] & 0x10 else 0
+        return 10 + size + footer
+
+    def _header(self, offset: int):
+        """Parse the Layer III frame header at ``offset``.
+
+        :return: (frame size, sample rate, samples per frame, bits per
+        second, whether it's mono, offset of the Xing/Info header from the
+        frame's start), or None if there's no valid frame there.
+        """
+        if offset + 4 > self.audio_end or self.mm[offset] != 0xFF:
+            return None
+        b1, b2, b3 = self.mm[offset + 1], self.mm[offset + 2], self.mm[offset + 3]
+        version = (b1 >> 3) & 3
+        if b1 & 0xE0 != 0xE0 or version == 1 or (b1 >> 1) & 3 != 1:
+            return None
+        bitrate_index = b2 >> 4
+        rate_index = (b2 >> 2) & 3
+        if bitrate_index in [0, 15] or rate_index == 3:
+            return None
+        mpeg1 = version == 3
+        bitrate = self.BITRATES[mpeg1][bitrate_index] * 1000
+        sample_rate = self.SAMPLE_RATES[version][rate_index]
+        samples = 1152 if mpeg1 else 576
+        size = samples // 8 * bitrate // sample_rate + ((b2 >> 1) & 1)
+        mono = b3 >> 6 == 3
+        side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+        return size, sample_rate, samples, bitrate, mono, 4 + side_info
+
+    def _info_frame(self, offset: int, header: tuple):
+        """Read the encoder delay from a Xing/Info frame at ``offset``.
+
+        :return: The delay in samples, or None if the frame is ordinary
+        audio.
+        """
+        xing = offset + header[5]
+        if self.mm[xing : xing + 4] not in [b"Xing", b"Info"]:
+            return None
+        flags = struct.unpack(">I", self.mm[xing + 4 : xing + 8])[0]
+        lame = xing + 8
+        for flag, size in [(1, 4), (2, 4), (4, 100), (8, 4)]:
+            if flags & flag:
+                lame += size
+        if self.mm[lame : lame + 4] != b"LAME":
+            return self.LAME_DELAY
+        delay = self.mm[lame + 21 : lame + 24]
+        # Plus the decoder's own delay
+        return ((delay[0] << 4) | (delay[1] >> 4)) + 529
+
+    def _fixed_size(self, first: tuple) -> bool:
+        """Whether every frame is the size of the first.
+
+        That's so for CBR at a bitrate and sample rate that need no padding,
+        which is checked for by looking at frames across the file.
+        """
+        samples, sample_rate, bitrate = first[2], first[1], first[3]
+        if samples // 8 * bitrate % sample_rate:
+            return False
+        size = self.audio_end - self.audio_start
+        if size % self.frame_size:
+            return False
+        frames = size // self.frame_size
+        for frame in [1, frames // 2, frames - 1]:
+            header = self._header(self.audio_start + frame * self.frame_size)
+            if header is None or header[:4] != first[:4]:
+                return False
+        return True
+
+    def _scan(self) -> None:
+        """Find every frame, reading only the headers."""
+        offsets = []
+        offset = self.audio_start
+        while True:
+            header = self._header(offset)
+            if header is None:
+                break
+            offsets.append(offset)
+            offset += header[0]
+        offsets.append(offset)
+        self.offsets = offsets
+
+    @property
+    def frames(self) -> int:
+        if self.offsets is not None:
+            return len(self.offsets) - 1
+        return (self.audio_end - self.audio_start) // self.frame_size
+
+    def offset(self, frame: int) -> int:
+        """Where frame number ``frame`` starts (``frames`` for the end)."""
+        frame = min(max(0, frame), self.frames)
+        if self.offsets is not None:
+            return self.offsets[frame]
+        return self.audio_start + frame * self.frame_size
+
+    def frame_at(self, ms: int) -> int:
+        """The number of the frame holding the audio ``ms`` milliseconds in."""
+        sample = ms * self.sample_rate // 1000 + self.delay
+        return min(self.frames, sample // self.samples_per_frame)
+
+    def duration_ms(self, first: int, last: int) -> int:
+        """How long frames ``first`` up to (not including) ``last`` play."""
+        return (last - first) * self.samples_per_frame * 1000 // self.sample_rate
+
+    def copy(self, start_ms: int, end_ms: int, dest: str) -> int:
+        """Copy the frames from ``start_ms`` to ``end_ms`` into a new file.
+
+        The bytes are copied by the kernel where it can.
+
+        :return: The length of the copy, in milliseconds.
+        """
+        first = self.frame_at(start_ms)
+        last = max(first, self.frame_at(end_ms))
+        start, end = self.offset(first), self.offset(last)
+        with open(self.path, "rb") as src, open(dest, "wb") as out:
+            copy_range(src, out, start, end - start)
+        return self.duration_ms(first, last)
+
+
+class SeekIndex:
+    """A small binary map from times in an MP3 to byte offsets, so a player
+    (or a CDN edge) can make a range request for the right bytes instead of
+    guessing from the bitrate.
+
+    It holds a point every ``interval_ms``, and one for each chapter start.
+    Each gives the offset of the frame holding that time, counting from the
+    start of the file (ID3 tag and all), so it has to be built after tagging.
+
+    The file is little-endian: a header (``HEADER``) of the magic number,
+    version, sample rate, samples per frame, encoder delay in samples,
+    interval and duration in milliseconds, the offsets where the audio
+    starts and ends, and the numbers of points and chapters; then each
+    point, and each chapter start, as (milliseconds, offset) (``ENTRY``).
+    """
+
+    MAGIC = b"PSSK"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHxxIIIIIQQII")
+    ENTRY = struct.Struct("<IQ")
+
+    def __init__(self, info: dict, points: list, chapters: list):
+        """
+        :param info: The header fields, besides the magic number and counts.
+        :param points: (milliseconds, offset) every ``info["interval_ms"]``.
+        :param chapters: (milliseconds, offset) for each chapter start.
+        """
+        self.info = info
+        self.points = points
+        self.chapters = chapters
+
+    @classmethod
+    def build(cls, frames: MP3FrameIndex, interval_ms: int, starts: list):
+        """Build the index for an MP3 from its frames.
+
+        :param starts: The chapter start times, in milliseconds.
+        """
+        samples = frames.frames * frames.samples_per_frame - frames.delay
+        info = {
+            "version": cls.VERSION,
+            "sample_rate": frames.sample_rate,
+            "samples_per_frame": frames.samples_per_frame,
+            "delay": frames.delay,
+            "interval_ms": interval_ms,
+            "duration_ms": max(0, samples) * 1000 // frames.sample_rate,
+            "audio_start": frames.offset(0),
+            "audio_end": frames.offset(frames.frames),
+        }
+        points = [
+            (ms, frames.offset(frames.frame_at(ms)))
+            for ms in range(0, info["duration_ms"], interval_ms)
+        ]
+        chapters = [(ms, frames.offset(frames.frame_at(ms))) for ms in starts]
+        return cls(info, points, chapters)
+
+    def offset_at(self, ms: int) -> int:
+        """The offset to start reading from to play from ``ms``.
+
+        That's the latest point or chapter start at or before ``ms``.
+        """
+        entries = sorted(self.points + self.chapters)
+        i = bisect.bisect_right(entries, (ms, float("inf")))
+        return entries[i - 1][1] if i else self.info["audio_start"]
+
+    def to_bytes(self) -> bytes:
+        info = self.info
+        parts = [
+            self.HEADER.pack(
+                self.MAGIC,
+                info["version"],
+                info["sample_rate"],
+                info["samples_per_frame"],
+                info["delay"],
+                info["interval_ms"],
+                info["duration_ms"],
+                info["audio_start"],
+                info["audio_end"],
+                len(self.points),
+                len(self.chapters),
+            )
+        ]
+        parts.extend(self.ENTRY.pack(*entry) for entry in self.points + self.chapters)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        if data[:4] != cls.MAGIC:
+            raise PostShowError("This isn't a seek index")
+        fields = cls.HEADER.unpack_from(data)
+        if fields[1] != cls.VERSION:
+            raise PostShowError(
+                "Seek index version {} isn't supported".format(fields[1])
+            )
+        names = ["version", "sample_rate", "samples_per_frame", "delay"]
+        names += ["interval_ms", "duration_ms", "audio_start", "audio_end"]
+        info = dict(zip(names, fields[1:9]))
+        entries = [
+            cls.ENTRY.unpack_from(data, cls.HEADER.size + i * cls.ENTRY.size)
+            for i in range(fields[9] + fields[10])
+        ]
+        return cls(info, entries[: fields[9]], entries[fields[9] :])
+
+    def save(self, path: str) -> None:
+        with atomic_write(path, "wb") as fp:
+            fp.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "rb") as fp:
+            return cls.from_bytes(fp.read())
+
+
+def copy_range(src, dest, offset: int, count: int) -> None:
+    """Copy ``count`` bytes from ``offset`` in one open file to another.
+
+    Uses ``copy_file_range`` (which can share blocks instead of copying them)
+    or ``sendfile`` where the system has them, and plain reads otherwise.
+    """
+    done = 0
+    try:
+        while done < count:
+            if hasattr(os, "copy_file_range"):
+                sent = os.copy_file_range(
+                    src.fileno(), dest.fileno(), count - done, offset + done
+                )
+            else:
+                sent = os.sendfile(
+                    dest.fileno(), src.fileno(), offset + done, count - done
+                )
+            if sent == 0:
+                break
+            done += sent
+    except OSError:
+        # Not supported between these files; fall back to reading them
+        src.seek(offset + done)
+        while done < count:
+            data = src.read(min(MP3FrameIndex.COPY_CHUNK, count - done))
+            if not data:
+                break
+            dest.write(data)
+            done += len(data)
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = "w", **kwargs):
+    """Open a file to replace ``path``, for a ``with`` statement.
+
+    The file is written under a temporary name in the same directory, synced
+    to disk, and only then renamed over ``path``, so ``path`` is always
+    either the old file or the whole new one, even after a crash. If the body
+    of the ``with`` fails, ``path`` is left alone. Arguments after ``path``
+    are passed on to ``open``.
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, ".{}.tmp".format(name))
+    try:
+        with open(tmp_path, mode, **kwargs) as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_update(path: str):
+    """Change a copy of a file, then put it in place like ``atomic_write``.
+
+    For libraries that change a file in place by name (like mutagen saving
+    tags): the ``with`` statement gives the path of the copy to change.
+    """
+    with atomic_write(path, "wb") as fp, open(path, "rb") as src:
+        copy_range(src, fp, 0, os.fstat(src.fileno()).st_size)
+        fp.flush()
+        yield fp.name
+
+
+class EncodeCache:
+    """Keep copies of encoded MP3s, so the same audio isn't encoded twice.
+
+    Entries are named after the encode stage's journal key (the WAV's hash,
+    the encoder's version and its settings) and hold the MP3 as it came out of
+    the encoder, before tagging. The hash of each WAV stored is remembered against
+    its size and modification time, so it can be looked up again without
+    reading it. Once the entries add up to more than ``max_bytes``, the ones
+    used least recently are deleted.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self.index_path = os.path.join(path, "hashes.json")
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as fp:
+                entries = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            entries = {}
+        self.hashes = HashMemo(entries)
+
+    def remember_hash(self, path: str, sha256: str) -> None:
+        """Remember a WAV's hash, and save the index."""
+        self.hashes.remember(path, sha256)
+        with atomic_write(self.index_path, encoding="utf-8") as fp:
+            json.dump(self.hashes.entries, fp, indent=2, sort_keys=True)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key + ".mp3")
+
+    def fetch(self, key: str, dest: str) -> bool:
+        """Copy a cached MP3 to ``dest``. Return False if it isn't cached."""
+        try:
+            shutil.copyfile(self._entry_path(key), dest)
+        except FileNotFoundError:
+            return False
+        # Mark it as recently used
+        os.utime(self._entry_path(key))
+        return True
+
+    def data(self, key: str):
+        """Get the data stored along with an MP3, or None."""
+        try:
+            with open(self._entry_path(key)[:-4] + ".json", encoding="utf-8") as fp:
+                return json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def store(self, key: str, src: str, data=None) -> None:
+        """Add an MP3 to the cache. It is copied, since it will be tagged.
+
+        :param data: Anything JSON-serializable to keep with the MP3, like
+        the loudness measured while encoding it.
+        """
+        if os.path.getsize(src) > self.max_bytes:
+            return
+        if data is not None:
+            with atomic_write(
+                self._entry_path(key)[:-4] + ".json", encoding="utf-8"
+            ) as fp:
+                json.dump(data, fp)
+        with atomic_write(self._entry_path(key), "wb") as fp, open(src, "rb") as mp3:
+            copy_range(mp3, fp, 0, os.fstat(mp3.fileno()).st_size)
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used entries until under the limit."""
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".mp3"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            try:
+                os.remove(path[:-4] + ".json")
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class Profile:
+    """One profile from the configuration file, with its values typed.
+
+    Build it once from a config that ``Main.check_config`` has already
+    checked, rather than looking values up (and converting them) every time
+    they're needed.
+    """
+
+    def __init__(self, config: configparser.ConfigParser, name: str):
+        if not config.has_section(name):
+            raise PostShowError(
+                'There is no profile named "{}" in the configuration file'.format(name)
+            )
+        section = config[name]
+        self.name = name
+        self.slug = section["slug"]
+        self.filename = section["filename"]
+        self.bitrate = section["bitrate"]
+        self.title = section["title"]
+        self.album = section["album"]
+        self.artist = section["artist"]
+        self.season = section["season"]
+        self.genre = section["genre"]
+        self.language = section["language"]
+        self.composer = section.get("composer")
+        self.accompaniment = section.get("accompaniment")
+        self.write_date = section.getboolean("write_date")
+        self.write_trackno = section.getboolean("write_trackno")
+        self.lyrics_equals_comment = section.getboolean("lyrics_equals_comment")
+        # Paths, with variables already expanded
+        self.cover_art = section.get("cover_art")
+        self.catalog = section.get("catalog")
+        self.chapter_index = section.get("chapter_index")
+        self.publish = section.get("publish")
+        self.encoder = section.get("encoder", "lame")
+        self.formats = [fmt.strip() for fmt in section.get("formats", "mp3").split(",")]
+        # Bitrates for the formats other than MP3, where they're set
+        self.format_bitrates = {
+            key[: -len("_bitrate")]: value
+            for key, value in section.items()
+            if key.endswith("_bitrate")
+        }
+        self.loudness_limits = {
+            key: section.getfloat(key) for key in LOUDNESS_LIMIT_KEYS if key in section
+        }
+        self.snap_tolerance = section.getfloat("snap_tolerance", 0.0)
+        self.silence_threshold = section.getfloat("silence_threshold", -45.0)
+        self.seek_interval = section.getfloat("seek_interval", 0.0)
+        self.waveform_resolutions = [
+            int(value)
+            for value in section.get("waveform_resolutions", "").split(",")
+            if value.strip()
+        ]
+
+    def output_name(self, epnum: str, ext: str) -> str:
+        """The name of an output file with the given extension."""
+        return self.filename.format(slug=self.slug.lower(), epnum=epnum, ext=ext)
+
+
+class EpisodeMetadata(object):
+    """Metadata about an episode."""
+
+    def __init__(self, number: str, name: str):
+        self.number = number
+        self.name = name
+        self.lyrics = None
+        self.title = None
+        self.album = None
+        self.artist = None
+        self.season = None
+        self.genre = None
+        self.language = None
+        self.composer = None
+        self.accompaniment = None
+        self.date = None
+        self.comment = None
+        self.chapters = []
+        self.toc = []
+
+
+class HashMemo:
+    """Remember the SHA-256 of files, against their size and modification time.
+
+    As long as a file's size and modification time don't change, its hash is
+    reused instead of reading the whole file again. ``entries`` is a plain
+    dict, so that the owner can save it however it likes.
+    """
+
+    HASH_BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, entries=None):
+        self.entries = {} if entries is None else entries
+
+    @staticmethod
+    def stat(path: str):
+        """Get ``[size, mtime_ns]`` for a file, or None if it doesn't exist."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    @staticmethod
+    def combine(hashes: list) -> str:
+        """One hash for several files, from their hashes in order. For a
+        single file, that's its own hash."""
+        if len(hashes) == 1:
+            return hashes[0]
+        return hashlib.sha256("\n".join(hashes).encode("ascii")).hexdigest()
+
+    def known(self, path: str):
+        """Get the remembered hash of a file, or None if it has changed."""
+        known = self.entries.get(os.path.abspath(path))
+        if known is not None and known["stat"] == self.stat(path):
+            return known["sha256"]
+        return None
+
+    def remember(self, path: str, sha256: str) -> None:
+        """Record a hash of a file computed somewhere else."""
+        self.entries[os.path.abspath(path)] = {
+            "stat": self.stat(path),
+            "sha256": sha256,
+        }
+
+    def hash_file(self, path: str) -> str:
+        """Get the hash of a file, reading it only if it isn't remembered."""
+        known = self.known(path)
+        if known is not None:
+            return known
+        digest = hashlib.sha256()
+        with open(path, "rb") as fp:
+            for block in iter(lambda: fp.read(self.HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        self.remember(path, digest.hexdigest())
+        return digest.hexdigest()
+
+
+class Profiler:
+    """Time the stages of a run, and how much each one reads and writes.
+
+    Wrap each stage in ``with profiler.span("name"):``. Spans can run on any
+    thread, and can be nested. Bytes read and written come from the
+    thread's I/O counters in /proc (Linux only), so they count what the
+    stage itself read, whether or not it came from the page cache. Reads
+    from a memory-mapped file don't show up there, so the body of a span can
+    add those to the ``bytes_read`` in the dict that ``with`` gives it.
+
+    A disabled profiler does nothing, so code can use one unconditionally.
+    """
+
+    IO_PATHS = ["/proc/thread-self/io", "/proc/self/io"]
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args):
+        """Time the body of a ``with`` statement as one span."""
+        extra = {"bytes_read": 0, "bytes_written": 0}
+        if not self.enabled:
+            yield extra
+            return
+        start = time.perf_counter()
+        io_start = self._io()
+        try:
+            yield extra
+        finally:
+            end = time.perf_counter()
+            io_end = self._io()
+            record = {
+                "name": name,
+                "thread": threading.current_thread().name,
+                "start_ms": round((start - self.origin) * 1000, 3),
+                "duration_ms": round((end - start) * 1000, 3),
+                "bytes_read": extra["bytes_read"],
+                "bytes_written": extra["bytes_written"],
+                "peak_rss_kb": self._peak_rss(),
+                "args": args,
+            }
+            if io_start is not None and io_end is not None:
+                record["bytes_read"] += io_end["rchar"] - io_start["rchar"]
+                record["bytes_written"] += io_end["wchar"] - io_start["wchar"]
+            with self.lock:
+                self.spans.append(record)
+
+    @classmethod
+    def _io(cls):
+        for path in cls.IO_PATHS:
+            try:
+                with open(path, "r") as fp:
+                    fields = dict(line.split(": ") for line in fp.read().splitlines())
+                return {key: int(value) for key, value in fields.items()}
+            except (OSError, ValueError):
+                continue
+        return None
+
+    @staticmethod
+    def _peak_rss() -> int:
+        """Peak resident memory of this process so far, in KiB."""
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def report(self) -> dict:
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        return {
+            "version": 1,
+            "total_ms": round((time.perf_counter() - self.origin) * 1000, 3),
+            "peak_rss_kb": self._peak_rss(),
+            "spans": spans,
+        }
+
+    def chrome_trace(self) -> dict:
+        """The spans, as a Chrome trace (for chrome://tracing or Perfetto)."""
+        report = self.report()
+        threads = {}
+        events = []
+        for span in report["spans"]:
+            tid = threads.setdefault(span["thread"], len(threads) + 1)
+            args = dict(span["args"])
+            args.update(
+                bytes_read=span["bytes_read"],
+                bytes_written=span["bytes_written"],
+                peak_rss_kb=span["peak_rss_kb"],
+            )
+            events.append(
+                {
+                    "name": span["name"],
+                    "ph": "X",
+                    "ts": int(span["start_ms"] * 1000),
+                    "dur": int(span["duration_ms"] * 1000),
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+        for name, tid in threads.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path: str, chrome: bool = False) -> None:
+        """Write the report (or a Chrome trace) to ``path`` as JSON."""
+        with atomic_write(path, encoding="utf-8") as fp:
+            json.dump(self.chrome_trace() if chrome else self.report(), fp, indent=2)
+
+
+class EpisodeJournal:
+    """Remember which stages of a run have finished, so a re-run can skip them.
+
+    The journal is a JSON file in the output directory, named after the WAV
+    file. Each finished stage is stored with a key built from the content
+    hashes of its inputs, and with the size and modification time of the files
+    it produced. A stage only counts as done if the key still matches and its
+    outputs haven't been touched since.
+
+    The episode number and name are kept too, so a re-run can fill them in
+    for the user.
+    """
+
+    ENCODE = "encode"
+    RENDITIONS = "renditions"
+    ANALYSIS = "analysis"
+    SIDECARS = "sidecars"
+    TAG = "tag"
+    SEEK_INDEX = "seek_index"
+    WAVEFORM = "waveform"
+    CLIPS = "clips"
+    PUBLISH = "publish"
+    # The stages, in the order they run
+    STAGES = [
+        ENCODE,
+        RENDITIONS,
+        ANALYSIS,
+        SIDECARS,
+        TAG,
+        SEEK_INDEX,
+        WAVEFORM,
+        CLIPS,
+        PUBLISH,
+    ]
+    VERSION = 1
+
+    def __init__(self, outdir: str, wav: str, fresh=False):
+        """Open (or start) the journal for a WAV file.
+
+        :param outdir: The output directory, where the journal is kept.
+        :param wav: The WAV file being processed.
+        :param fresh: Ignore anything recorded by previous runs.
+        """
+        self.outdir = outdir
+        self.wav_name = os.path.basename(wav)
+        self.path = os.path.join(outdir, self.wav_name + ".postshow.json")
+        self.data = {"version": self.VERSION, "hashes": {}, "metadata": None}
+        self.data["stages"] = {}
+        if not fresh:
+            self._load()
+        self.hashes = HashMemo(self.data["hashes"])
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get("version") == self.VERSION:
+            self.data = data
+
+    def save(self) -> None:
+        """Write the journal out, replacing the old one in a single step."""
+        with atomic_write(self.path, encoding="utf-8") as fp:
+            json.dump(self.data, fp, indent=2, sort_keys=True)
+
+    def work_path(self, ext: str) -> str:
+        """Path in the output directory for an in-progress file."""
+        return os.path.join(self.outdir, ".{}.encoding.{}".format(self.wav_name, ext))
+
+    @staticmethod
+    def hash_value(*parts) -> str:
+        """Build a stage key out of some JSON-serializable values."""
+        encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def has(self, stage: str) -> bool:
+        return stage in self.data["stages"]
+
+    def is_done(self, stage: str, key: str) -> bool:
+        """Check whether a stage finished with the same inputs as now."""
+        record = self.data["stages"].get(stage)
+        if record is None or record["key"] != key:
+            return False
+        for path, stat in record["outputs"].items():
+            if HashMemo.stat(path) != stat:
+                return False
+        return True
+
+    def outputs(self, stage: str) -> list:
+        record = self.data["stages"].get(stage)
+        return [] if record is None else list(record["outputs"].keys())
+
+    def stage_data(self, stage: str):
+        """Get the data stored with a finished stage, or None."""
+        record = self.data["stages"].get(stage)
+        return None if record is None else record.get("data")
+
+    def mark_done(self, stage: str, key: str, outputs: list, data=None) -> None:
+        """Record that a stage finished, and save the journal.
+
+        :param stage: One of the stage constants on this class.
+        :param key: The key built from the stage's inputs.
+        :param outputs: Paths of the files the stage wrote.
+        :param data: Anything JSON-serializable to keep with the stage, like
+        its results.
+        """
+        stats = {}
+        for path in outputs:
+            stats[os.path.abspath(path)] = HashMemo.stat(path)
+        order = self.STAGES.index(stage)
+        for other in list(self.data["stages"].keys()):
+            record = self.data["stages"][other]
+            shared = [path for path in record["outputs"] if path in stats]
+            if other == stage or not shared:
+                continue
+            if self.STAGES.index(other) > order:
+                # A later stage's work on these files (say, the tags on an
+                # MP3 that was just encoded again) is gone.
+                del self.data["stages"][other]
+            else:
+                # An earlier stage's files were changed by this one (the MP3
+                # was tagged), which shouldn't make the earlier one look stale.
+                for path in shared:
+                    record["outputs"][path] = stats[path]
+        self.data["stages"][stage] = {"key": key, "outputs": stats, "data": data}
+        self.save()
+
+    def invalidate(self, stage: str) -> None:
+        self.data["stages"].pop(stage, None)
+        self.save()
+
+    def load_metadata(self):
+        """Get the basic metadata entered during a previous run, or None."""
+        saved = self.data["metadata"]
+        if saved is None:
+            return None
+        return EpisodeMetadata(saved["number"], saved["name"])
+
+    def save_metadata(self, metadata: EpisodeMetadata) -> None:
+        self.data["metadata"] = {"number": metadata.number, "name": metadata.name}
+        self.save()
+
+
+class BlockManifest:
+    """SHA-256 hashes of a file's regions, to find which parts of it changed.
+
+    Files are hashed in fixed-size blocks. An MP3's ID3v2 tag (and ID3v1 tag)
+    are regions of their own, and its blocks are counted from where the audio
+    starts: retagging usually changes the size of the tag, which moves the
+    audio along in the file, but its blocks still hash the same, so only the
+    tag shows up as changed.
+    """
+
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, regions: list):
+        """:param regions: [length, sha256] for each region, in file order."""
+        self.regions = regions
+
+    @classmethod
+    def build(cls, path: str, block_size: int = BLOCK_SIZE) -> "BlockManifest":
+        size = os.path.getsize(path)
+        head = tail = 0
+        with open(path, "rb") as fp:
+            if path.lower().endswith(".mp3"):
+                head = min(MP3FrameIndex.id3_size(fp.read(10)), size)
+                if size - head >= 128:
+                    fp.seek(size - 128)
+                    if fp.read(3) == b"TAG":
+                        tail = 128
+            lengths = [head] if head else []
+            body = size - head - tail
+            lengths += [min(block_size, body - i) for i in range(0, body, block_size)]
+            lengths += [tail] if tail else []
+            fp.seek(0)
+            regions = []
+            for length in lengths:
+                regions.append([length, hashlib.sha256(fp.read(length)).hexdigest()])
+        return cls(regions)
+
+    def size(self) -> int:
+        return sum(length for length, sha256 in self.regions)
+
+    def delta(self, old) -> list:
+        """Work out how to make this file out of an older version of it.
+
+        :param old: The older version's ``BlockManifest``, or None if there
+        isn't one.
+        :return: A list of (source, offset, length), to be written one after
+        the other: byte ranges of the old file ("old"), for regions it already
+        has, and of this one ("new"), for the rest. Neighbouring ranges are
+        joined.
+        """
+        have = {}
+        offset = 0
+        for length, sha256 in old.regions if old is not None else []:
+            have.setdefault((length, sha256), offset)
+            offset += length
+        ops = []
+        offset = 0
+        for length, sha256 in self.regions:
+            source, start = "new", offset
+            if (length, sha256) in have:
+                source, start = "old", have[(length, sha256)]
+            if ops and ops[-1][0] == source and sum(ops[-1][1:]) == start:
+                ops[-1] = (source, ops[-1][1], ops[-1][2] + length)
+            else:
+                ops.append((source, start, length))
+            offset += length
+        return ops
+
+
+class DirectoryRemote:
+    """Publish files to a directory, sending only the parts that changed.
+
+    The directory can be a mount of the real destination, or a staging
+    directory that is synced onwards. The ``BlockManifest`` of each file
+    published to it is kept there too (in MANIFEST), along with the size and
+    modification time the file had afterwards, so it isn't read again to see
+    what it holds. A file changed by something else since then is sent whole.
+    """
+
+    MANIFEST = ".postshow-manifest.json"
+    VERSION = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest_path = os.path.join(path, self.MANIFEST)
+        self.files = {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("version") == self.VERSION:
+                self.files = data["files"]
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def manifest(self, name: str):
+        """The manifest of the published file, or None if it isn't known."""
+        record = self.files.get(name)
+        if record is None or record["stat"] != HashMemo.stat(
+            os.path.join(self.path, name)
+        ):
+            return None
+        return BlockManifest(record["regions"])
+
+    def put(self, name: str, path: str, manifest: BlockManifest, ops: list) -> None:
+        """Replace a published file with ``path``, built from ``ops`` (see
+        ``BlockManifest.delta``)."""
+        dest = os.path.join(self.path, name)
+        with contextlib.ExitStack() as stack:
+            sources = {"new": stack.enter_context(open(path, "rb"))}
+            if any(source == "old" for source, offset, length in ops):
+                sources["old"] = stack.enter_context(open(dest, "rb"))
+            out = stack.enter_context(atomic_write(dest, "wb"))
+            for source, offset, length in ops:
+                copy_range(sources[source], out, offset, length)
+        self.files[name] = {"stat": HashMemo.stat(dest), "regions": manifest.regions}
+        self.save()
+
+    def save(self) -> None:
+        with atomic_write(self.manifest_path, encoding="utf-8") as fp:
+            json.dump({"version": self.VERSION, "files": self.files}, fp, indent=2)
+
+
+class Catalog:
+    """An SQLite index of tagged episodes, so they can be searched and retagged
+    without opening every MP3.
+
+    Each MP3 gets a row with the metadata and chapters in its ID3 tag, a hash
+    of that tag, a hash of the cover art, and the file's size and modification
+    time. ``scan`` only reads the tags of files whose size or modification
+    time changed since they were last recorded, and never reads the audio.
+    """
+
+    VERSION = 1
+    # Metadata columns, with the ID3 frame each is read from
+    FRAMES = {
+        "title": "TIT2",
+        "album": "TALB",
+        "artist": "TPE1",
+        "season": "TPOS",
+        "genre": "TCON",
+        "language": "TLAN",
+        "composer": "TCOM",
+        "accompaniment": "TPE2",
+        "date": "TDRC",
+        "track": "TRCK",
+    }
+    # Columns that ``find`` can filter on
+    COLUMNS = ["path", "profile", "number", "name", "duration_ms", "cover_hash"]
+    COLUMNS += list(FRAMES)
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS episodes (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            profile TEXT,
+            number TEXT,
+            name TEXT,
+            {frames},
+            duration_ms INTEGER,
+            tag_hash TEXT NOT NULL,
+            cover_hash TEXT
+        );
+        CREATE TABLE IF NOT EXISTS chapters (
+            path TEXT NOT NULL REFERENCES episodes(path) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            start_ms INTEGER NOT NULL,
+            end_ms INTEGER NOT NULL,
+            text TEXT,
+            url TEXT,
+            PRIMARY KEY (path, position)
+        );
+        CREATE INDEX IF NOT EXISTS episodes_album ON episodes(album, number);
+    """.format(frames=",\n".join(name + " TEXT" for name in FRAMES))
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in [0, self.VERSION]:
+            raise PostShowError(
+                "{} is a catalog from a newer version of PostShowV2".format(path)
+            )
+        with self.db:
+            self.db.executescript(self.SCHEMA)
+            self.db.execute("PRAGMA user_version = {}".format(self.VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self.db.close()
+
+    @classmethod
+    def read_tags(cls, path: str) -> dict:
+        """Read an MP3's ID3 tag into a catalog row, with its chapters.
+
+        Only the tag at the start of the file is read. The duration comes
+        from the TLEN frame that ``MP3Tagger`` writes.
+        """
+        try:
+            tag = mutagen.id3.ID3(path)
+        except mutagen.id3.ID3NoHeaderError:
+            tag = mutagen.id3.ID3()
+        row = {}
+        for column, frame in cls.FRAMES.items():
+            row[column] = str(tag[frame].text[0]) if frame in tag else None
+        row["duration_ms"] = int(tag["TLEN"].text[0]) if "TLEN" in tag else None
+        pictures = tag.getall("APIC")
+        row["cover_hash"] = (
+            hashlib.sha256(pictures[0].data).hexdigest() if pictures else None
+        )
+        chapters = []
+        for chap in sorted(tag.getall("CHAP"), key=lambda c: c.start_time):
+            text = chap.sub_frames.get("TIT2")
+            urls = chap.sub_frames.getall("WXXX")
+            chapters.append(
+                {
+                    "start_ms": chap.start_time,
+                    "end_ms": chap.end_time,
+                    "text": None if text is None else str(text.text[0]),
+                    "url": urls[0].url if urls else None,
+                }
+            )
+        encoded = json.dumps([row, chapters], sort_keys=True, ensure_ascii=False)
+        row["tag_hash"] = hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+        return {"row": row, "chapters": chapters}
+
+    def record(self, path: str, profile=None, number=None, name=None) -> None:
+        """Read an MP3's tags into the catalog, replacing what was there.
+
+        The profile, episode number and name aren't in the tag, so they are
+        only known when PostShowV2 records a file it just tagged. A later
+        ``scan`` keeps them.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        tags = self.read_tags(path)
+        row = dict(tags["row"], path=path, size=st.st_size, mtime_ns=st.st_mtime_ns)
+        row.update(profile=profile, number=number, name=name)
+        columns = list(row)
+        with self.db:
+            self.db.execute(
+                "INSERT INTO episodes ({columns}) VALUES ({values}) "
+                "ON CONFLICT(path) DO UPDATE SET {updates}".format(
+                    columns=", ".join(columns),
+                    values=", ".join("?" * len(columns)),
+                    updates=", ".join(
+                        (
+                            "{0} = COALESCE(excluded.{0}, {0})".format(column)
+                            if column in ["profile", "number", "name"]
+                            else "{0} = excluded.{0}".format(column)
+                        )
+                        for column in columns
+                        if column != "path"
+                    ),
+                ),
+                [row[column] for column in columns],
+            )
+            self.db.execute("DELETE FROM chapters WHERE path = ?", [path])
+            self.db.executemany(
+                "INSERT INTO chapters (path, position, start_ms, end_ms, text, url) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (path, i, c["start_ms"], c["end_ms"], c["text"], c["url"])
+                    for i, c in enumerate(tags["chapters"])
+                ],
+            )
+
+    def scan(self, paths: list) -> dict:
+        """Bring the catalog up to date with the MP3s in some directories.
+
+        Files whose size and modification time match the catalog are skipped,
+        and rows for files that are gone from the directories are removed.
+
+        :param paths: Directories to search (recursively), or single MP3s.
+        :return: How many files were added, updated, unchanged and removed.
+        """
+        counts = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        known = {
+            row["path"]: (row["size"], row["mtime_ns"])
+            for row in self.db.execute("SELECT path, size, mtime_ns FROM episodes")
+        }
+        seen = set()
+        for path in self._mp3s(paths):
+            seen.add(path)
+            st = os.stat(path)
+            if known.get(path) == (st.st_size, st.st_mtime_ns):
+                counts["unchanged"] += 1
+                continue
+            counts["updated" if path in known else "added"] += 1
+            self.record(path)
+        dirs = tuple(os.path.abspath(p) + os.sep for p in paths if os.path.isdir(p))
+        singles = {os.path.abspath(p) for p in paths if not os.path.isdir(p)}
+        gone = [
+            path
+            for path in known
+            if path not in seen and (path in singles or path.startswith(dirs))
+        ]
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM episodes WHERE path = ?", [(path,) for path in gone]
+            )
+        counts["removed"] = len(gone)
+        return counts
+
+    @staticmethod
+    def _mp3s(paths: list):
+        for path in paths:
+            if not os.path.isdir(path):
+                if os.path.isfile(path):
+                    yield os.path.abspath(path)
+                continue
+            for root, dirs, files in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                for name in files:
+                    if name.lower().endswith(".mp3") and not name.startswith("."):
+                        yield os.path.abspath(os.path.join(root, name))
+
+    def find(self, **where) -> list:
+        """Get the rows of the episodes matching every filter, as dicts.
+
+        Filters are column names. Values containing ``%`` are matched with
+        ``LIKE``; anything else has to match exactly.
+        """
+        clauses = []
+        values = []
+        for column, value in where.items():
+            if column not in self.COLUMNS:
+                raise PostShowError('The catalog has no "{}" column'.format(column))
+            op = "LIKE" if "%" in str(value) else "="
+            clauses.append("{} {} ?".format(column, op))
+            values.append(value)
+        sql = "SELECT * FROM episodes"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY album, CAST(number AS INTEGER), path"
+        return [dict(row) for row in self.db.execute(sql, values)]
+
+    def chapters(self, path: str) -> list:
+        """Get an episode's chapters, in order."""
+        return [
+            Chapter(row["start_ms"], row["end_ms"], url=row["url"], text=row["text"])
+            for row in self.db.execute(
+                "SELECT * FROM chapters WHERE path = ? ORDER BY position",
+                [os.path.abspath(path)],
+            )
+        ]
+
+    def retag(self, rows: list, changes: dict, cover_art=None) -> None:
+        """Change some tags on the given episodes, and record the result.
+
+        :param rows: Rows from ``find``.
+        :param changes: New values, keyed by ``FRAMES`` column.
+        :param cover_art: Path to new cover art, if it should change.
+        """
+        for column in changes:
+            if column not in self.FRAMES:
+                raise PostShowError('"{}" is not a tag that can be set'.format(column))
+        for row in rows:
+            tagger = MP3Tagger(row["path"], row["duration_ms"])
+            for column, value in changes.items():
+                setter = {"track": "set_trackno"}.get(column, "set_" + column)
+                getattr(tagger, setter)(value)
+            if cover_art is not None:
+                tagger.set_cover_art(cover_art)
+            tagger.save()
+            self.record(row["path"])
+
+
+class ChapterIndex:
+    """A full-text index of the chapters of every episode, in SQLite FTS5.
+
+    Chapters are read from each episode's sidecars or MP3 tag: the files for
+    one episode share a name apart from the extension, and the one with the
+    most exact times that has any chapters is used (``SOURCES`` is in order of
+    preference). Each source's size and modification time are kept, so
+    ``update`` only reads episodes that changed.
+    """
+
+    VERSION = 1
+    SOURCES = ["json", "mp3", "lrc", "cue", "txt"]
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS episodes (
+            episode TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS chapters (
+            id INTEGER PRIMARY KEY,
+            episode TEXT NOT NULL REFERENCES episodes(episode) ON DELETE CASCADE,
+            start_ms INTEGER NOT NULL,
+            end_ms INTEGER NOT NULL,
+            text TEXT,
+            url TEXT
+        );
+        CREATE INDEX IF NOT EXISTS chapters_episode ON chapters(episode);
+        CREATE VIRTUAL TABLE IF NOT EXISTS chapter_text USING fts5(
+            text, url, content='chapters', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS chapters_insert AFTER INSERT ON chapters BEGIN
+            INSERT INTO chapter_text (rowid, text, url)
+            VALUES (new.id, new.text, new.url);
+        END;
+        CREATE TRIGGER IF NOT EXISTS chapters_delete AFTER DELETE ON chapters BEGIN
+            INSERT INTO chapter_text (chapter_text, rowid, text, url)
+            VALUES ('delete', old.id, old.text, old.url);
+        END;
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in [0, self.VERSION]:
+            raise PostShowError(
+                "{} is a chapter index from a newer version of PostShowV2".format(path)
+            )
+        with self.db:
+            self.db.executescript(self.SCHEMA)
+            self.db.execute("PRAGMA user_version = {}".format(self.VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self.db.close()
+
+    @classmethod
+    def _episodes(cls, paths: list) -> dict:
+        """Group the chapter sources in ``paths`` by episode.
+
+        :return: {episode: source paths, best first}, where the episode is
+        the path without its extension.
+        """
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                    dirs[:] = [d for d in dirs if not d.startswith(".")]
+                    files.extend(
+                        os.path.join(root, name)
+                        for name in names
+                        if not name.startswith(".")
+                    )
+            elif os.path.isfile(path):
+                files.append(path)
+        found = {}
+        for path in files:
+            episode, ext = os.path.splitext(os.path.abspath(path))
+            ext = ext[1:].lower()
+            if ext in cls.SOURCES:
+                found.setdefault(episode, []).append((cls.SOURCES.index(ext), path))
+        return {
+            episode: [path for rank, path in sorted(sources)]
+            for episode, sources in found.items()
+        }
+
+    @staticmethod
+    def read_chapters(path: str) -> list:
+        """Read the chapters from a sidecar or MP3, or None if it has none."""
+        if path.lower().endswith(".mp3"):
+            return [
+                Chapter(c["start_ms"], c["end_ms"], url=c["url"], text=c["text"])
+                for c in Catalog.read_tags(path)["chapters"]
+            ]
+        mcs = MCS()
+        try:
+            mcs.load(path)
+        except (ValueError, KeyError, TypeError, IndexError, UnicodeDecodeError):
+            # Not a chapter list, like the loudness report's JSON
+            return None
+        return mcs.get()
+
+    def update(self, paths: list) -> dict:
+        """Index the episodes in some directories or files that changed.
+
+        Episodes whose files are gone from the directories (or files) given
+        are dropped from the index.
+
+        :return: How many episodes were indexed, unchanged and removed.
+        """
+        counts = {"indexed": 0, "unchanged": 0, "removed": 0}
+        known = {
+            row["episode"]: (row["source"], row["size"], row["mtime_ns"])
+            for row in self.db.execute("SELECT * FROM episodes")
+        }
+        found = self._episodes(paths)
+        with self.db:
+            for episode, sources in found.items():
+                # Fall back to the next source when one has no chapters (like
+                # show notes in a .txt), until reaching the one indexed last time
+                for path in sources:
+                    st = os.stat(path)
+                    source = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+                    if known.get(episode) == source:
+                        counts["unchanged"] += 1
+                        break
+                    chapters = self.read_chapters(path)
+                    if chapters:
+                        self._index(episode, source, chapters)
+                        counts["indexed"] += 1
+                        break
+                else:
+                    self.db.execute("DELETE FROM episodes WHERE episode = ?", [episode])
+            dirs = tuple(os.path.abspath(p) + os.sep for p in paths if os.path.isdir(p))
+            singles = {
+                os.path.splitext(os.path.abspath(p))[0]
+                for p in paths
+                if not os.path.isdir(p)
+            }
+            for episode in known:
+                if episode not in found and (
+                    episode in singles or episode.startswith(dirs)
+                ):
+                    self.db.execute("DELETE FROM episodes WHERE episode = ?", [episode])
+                    counts["removed"] += 1
+        return counts
+
+    def _index(self, episode: str, source: tuple, chapters: list) -> None:
+        """Replace an episode's chapters, read from ``source`` (its path, size
+        and modification time)."""
+        self.db.execute("DELETE FROM episodes WHERE episode = ?", [episode])
+        self.db.execute("INSERT INTO episodes VALUES (?, ?, ?, ?)", (episode,) + source)
+        self.db.executemany(
+            "INSERT INTO chapters (episode, start_ms, end_ms, text, url) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(episode, c.start, c.end, c.text, c.url) for c in chapters],
+        )
+
+    def search(self, query: str, limit: int = 20, raw: bool = False) -> list:
+        """Find the chapters matching a query, best matches first.
+
+        :param query: Words that must all appear in the chapter's text or
+        URL. With ``raw``, an FTS5 query instead, like ``"two words" OR
+        prefix*``.
+        :return: Dicts with the episode's name and path (without an
+        extension), and the chapter's start and end in milliseconds, text and
+        URL.
+        """
+        if not raw:
+            query = " ".join(
+                '"{}"'.format(word.replace('"', '""')) for word in query.split()
+            )
+        try:
+            rows = self.db.execute(
+                "SELECT chapters.* FROM chapter_text "
+                "JOIN chapters ON chapters.id = chapter_text.rowid "
+                "WHERE chapter_text MATCH ? ORDER BY rank, episode, start_ms "
+                "LIMIT ?",
+                [query, limit],
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            raise PostShowError("Bad search query: {}".format(e))
+        return [
+            {
+                "episode": os.path.basename(row["episode"]),
+                "path": row["episode"],
+                "start_ms": row["start_ms"],
+                "end_ms": row["end_ms"],
+                "text": row["text"],
+                "url": row["url"],
+            }
+            for row in rows
+        ]
+
+
+class MCS:
+    """Marker Conversion Space
+
+    Load markers from a file into an internal representation, which can then
+    be output as other formats. Filetype detection for input files is done
+    based on the extension. If the extension is wrong, it may cause issues.
+
+    Supported input formats:
+    * Audacity labels
+    * LRC file
+    * CUE file
+    * Simple timestamp list (as written by ``save(path, MCS.SIMPLE)``)
+    * JSON chapter list
+
+    Supported output formats:
+    * CUE file
+    * LRC file
+    * JSON chapter list
+    * Internal representation (for use in other parts of the program)
+
+    Create a new instance and call ``load('path/to/file.ext')`` on it to load
+    the markers, then ``save('path/to/file.ext', TYPE)``, where ``TYPE`` is
+    one of the constants on this class:
+    * LRC
+    * CUE
+    * JSON
+
+    For a recording made in several parts, with a marker file for each,
+    ``merge([(path, offset), ...])`` loads them all as one list of chapters.
+
+    Chapters can also be built up while the show is still running: call
+    ``begin_live({TYPE: 'path/to/file.ext', ...})``, then ``append(chapter)``
+    for each new chapter, and ``end_live()`` when the show is over. Every
+    append adds to the end of the sidecar files instead of rewriting them.
+    """
+
+    AUDACITY = 0
+    LRC = 10
+    CUE = 11
+    UMR = 12
+    SIMPLE = 13
+    FFMETADATA1 = 14
+    JSON = 15
+
+    # Output formats that can be appended to one chapter at a time
+    LIVE_TYPES = (LRC, CUE, SIMPLE, JSON)
+
+    def __init__(self, metadata=None, media_filename=None):
+        self.load_path = None
+        self.metadata = metadata
+        self.media_filename = (
+            media_filename
+            if media_filename is None
+            else os.path.basename(media_filename)
+        )
+        self.chapters = []
+        self.live_files = {}
+        # Problems found by validate(), as dicts
+        self.diagnostics = []
+
+    def _canonicalize(self) -> None:
+        """Set the element ID for each chapter."""
+        for i in range(0, len(self.chapters)):
+            self.chapters[i].elem_id = "chp{}".format(i)
+
+    @staticmethod
+    def clock(ms: int) -> str:
+        """Format a time in milliseconds for people, like 1:02:03.456."""
+        return "{}.{:03d}".format(datetime.timedelta(seconds=ms // 1000), ms % 1000)
+
+    @staticmethod
+    def _split_url(text: str):
+        """Split text into a label and a URL. Return a (text, url) tuple.
+
+        The URL part of the tuple is None if there isn't a URL in the text.
+        """
+        url = None
+        # url_parsed = None
+        if "|" in text:
+            url = text[text.rindex("|") + 1 :]
+            text = text[: text.rindex("|")]
+            # url_parsed = urllib.parse.urlparse(url)
+        return text, url
+
+    def load(self, path: str):
+        """Load a file, and ``validate()`` the markers in it.
+
+        :param path: The name of the file to load.
+        """
+        self._load(path)
+        self.validate()
+
+    def merge(self, parts: list):
+        """Load the marker files for a recording made in several parts (say,
+        a pre-show, the show and an after-show) as one list of chapters, and
+        ``validate()`` it.
+
+        :param parts: A (path, offset) tuple for each part, in order, where
+        offset is where the part starts in the whole recording, in
+        milliseconds (the length of the parts before it). Parts without a
+        marker file have None for the path.
+        """
+        for path, offset in parts:
+            if path is None:
+                continue
+            first = len(self.chapters)
+            self._load(path)
+            for chapter in self.chapters[first:]:
+                chapter.start += offset
+                chapter.end += offset
+        self.validate()
+
+    def _load(self, path: str):
+        """Add the markers in a file to the end of the chapters."""
+        type = path.split(".")[-1:][0]
+        if type == "txt" and self._is_simple(path):
+            # Decoding a simple timestamp list
+            self._load_simple(path)
+        elif type == "txt":
+            # Decoding Audacity labels
+            self._load_audacity(path)
+        elif type == "lrc":
+            # Decoding an LRC file
+            self._load_lrc(path)
+        elif type == "cue":
+            # Decoding a CUE file
+            self._load_cue(path)
+        elif type == "json":
+            # Decoding a JSON chapter list
+            self._load_json(path)
+        else:
+            raise PostShowError("Unsupported marker file: {}".format(type))
+
+    def validate(self, duration_ms=None) -> list:
+        """Check the chapters, and repair the problems that can be repaired.
+
+        * Chapters out of order are sorted by start time, after a linear
+          check so chapters that are in order aren't sorted again
+        * A chapter with the same start and text as the one before it is
+          merged into that one
+        * A chapter that ends before it starts, or after the next one starts,
+          ends where the next one starts instead. So does one from a point
+          label, which ends where it starts.
+        * Given ``duration_ms``, chapters starting after the audio ends are
+          dropped, and chapters are made to end by the end of the audio. The
+          last one runs to the end of the audio if it has no length.
+
+        Two different chapters starting at the same time are only reported.
+
+        :param duration_ms: The length of the audio, if it's known.
+        :return: A dict for each problem found, with its ``code``, the
+        ``start`` and ``text`` of the chapter it's about (None for the whole
+        list), and a ``message`` to show. They're added to ``diagnostics``
+        too.
+        """
+        problems = []
+
+        def report(code: str, chapter, message: str) -> None:
+            problems.append(
+                {
+                    "code": code,
+                    "start": chapter.start,
+                    "text": chapter.text,
+                    "message": '"{}" at {}: {}'.format(
+                        chapter.text, self.clock(chapter.start), message
+                    ),
+                }
+            )
+
+        for chapter in self.chapters:
+            if chapter.start < 0:
+                report("negative_start", chapter, "starts before the audio; moved to 0")
+                chapter.start = 0
+        if any(b.start < a.start for a, b in zip(self.chapters, self.chapters[1:])):
+            self.chapters.sort(key=lambda chapter: chapter.start)
+            problems.append(
+                {
+                    "code": "unsorted",
+                    "start": None,
+                    "text": None,
+                    "message": "The markers were out of order; sorted them",
+                }
+            )
+        chapters = []
+        for chapter in self.chapters:
+            if duration_ms is not None and chapter.start >= duration_ms > 0:
+                report(
+                    "past_end", chapter, "is at or past the end of the audio; dropped"
+                )
+                if chapters and chapters[-1].end == chapter.start:
+                    # It ran up to the dropped one, so now it runs to the end
+                    chapters[-1].end = duration_ms
+                continue
+            previous = chapters[-1] if chapters else None
+            if previous is not None and previous.start == chapter.start:
+                if previous.text == chapter.text:
+                    report("duplicate", chapter, "is a duplicate; merged")
+                    previous.end = max(previous.end, chapter.end)
+                    if previous.url is None:
+                        previous.url = chapter.url
+                    continue
+                report(
+                    "same_start",
+                    previous,
+                    "is empty, as the next chapter starts at the same time",
+                )
+            chapters.append(chapter)
+        for i, chapter in enumerate(chapters):
+            following = chapters[i + 1].start if i + 1 < len(chapters) else None
+            limit = following if following is not None else duration_ms
+            if chapter.end < chapter.start:
+                report("negative_length", chapter, "ends before it starts")
+                chapter.end = chapter.start if limit is None else limit
+            elif following is not None and chapter.end > following:
+                report("overlap", chapter, "runs into the next chapter")
+                chapter.end = following
+            elif chapter.end == chapter.start and limit is not None:
+                chapter.end = limit
+            if duration_ms is not None and chapter.end > duration_ms:
+                report("clamped", chapter, "ends after the audio; moved to its end")
+                chapter.end = duration_ms
+        self.chapters = chapters
+        self._canonicalize()
+        self.diagnostics.extend(problems)
+        return problems
+
+    def _load_audacity(self, path: str):
+        """Load an Audacity labels file.
+
+        This plugin also supports URLs, if they are appended to the end of
+        the marker with a pipe character:
+            Some Marker Name|https://example.com
+        """
+        with open(path, "r", encoding="utf-8-sig") as fp:
+            reader = csv.reader(fp, delimiter="\t", quoting=csv.QUOTE_NONE)
+            for row in reader:
+                if not row:
+                    continue
+                chap = self._parse_audacity_row(row)
+                if chap is not None:
+                    self.chapters.append(chap)
+
+    @classmethod
+    def _parse_audacity_row(cls, row: list):
+        """Turn one row of an Audacity labels file into a Chapter.
+
+        Return None if the row doesn't contain a label.
+        """
+        try:
+            start = float(row[0]) * 1000
+            end = float(row[1]) * 1000
+        except ValueError:
+            return None
+        # Round start and end times to integer milliseconds.
+        start = int(round(start, 0))
+        end = int(round(end, 0))
+        # mark = row[2]
+        text = row[2]
+        text, url = cls._split_url(text)
+        return Chapter(start, end, text=text, url=url)
+
+    def _load_lrc(self, path: str):
+        """Load an LRC file.
+
+        This plugin also supports URLs, if they are appended to the end of the
+        marker with a pipe character:
+            Some Marker Name|https://example.com
+        """
+        starts = []
+        with open(path, "r", encoding="utf-8-sig") as fp:
+            for line in fp:
+                result = self._parse_lrc_line(line)
+                if result is not None:
+                    starts.append(result)
+        self._append_starts(starts)
+
+    @classmethod
+    def _parse_lrc_line(cls, line: str):
+        """Turn one line of an LRC file into a (millisec, text, url) tuple.
+
+        Return None if the line isn't a timestamped lyric.
+        """
+        if re.match(r"^\[(ti|ar|al):(.*)\]$", line) is not None:
+            return None
+        result = re.match(r"^\[(\d+):(\d\d\.\d+)\](.*)$", line)
+        if result is None:
+            return None
+        minutes = int(result.group(1))
+        seconds = float(result.group(2))
+        label = result.group(3)
+        millisec = (minutes * 60 * 1000) + int(round(seconds * 1000))
+        text, url = cls._split_url(label)
+        return millisec, text, url
+
+    def _append_starts(self, starts: list) -> None:
+        """Add chapters from (millisec, text, url) tuples.
+
+        Each chapter ends where the next one starts, and the last one ends
+        where it starts, until ``validate()`` is told how long the audio is.
+        """
+        for i, (millisec, text, url) in enumerate(starts):
+            end = starts[i + 1][0] if i + 1 < len(starts) else millisec
+            self.chapters.append(Chapter(millisec, end, text=text, url=url))
+
+    def _load_cue(self, path: str):
+        """Load a CUE file, as written by ``save(path, MCS.CUE)``.
+
+        Each TRACK's TITLE is the chapter text, and its INDEX 01 the start.
+        """
+        starts = []
+        title = None
+        with open(path, "r", encoding="utf-8-sig") as fp:
+            for line in fp:
+                line = line.strip()
+                if line.startswith("TRACK "):
+                    title = ""
+                elif line.startswith("TITLE ") and title is not None:
+                    title = line[len("TITLE ") :].strip('"')
+                else:
+                    result = re.match(r"^INDEX 01 (\d+):(\d\d):(\d\d)$", line)
+                    if result is not None and title is not None:
+                        minutes, seconds, frames = map(int, result.groups())
+                        # 75 CUE frames to the second
+                        millisec = (minutes * 60 + seconds) * 1000 + frames * 1000 // 75
+                        starts.append((millisec, title, None))
+        self._append_starts(starts)
+
+    @staticmethod
+    def _is_simple(path: str) -> bool:
+        """Check whether a .txt file is a simple timestamp list."""
+        with open(path, "r", encoding="utf-8-sig") as fp:
+            for line in fp:
+                if line.strip():
+                    return re.match(r"^\d+:\d\d:\d\d - ", line) is not None
+        return False
+
+    def _load_simple(self, path: str):
+        """Load a simple timestamp list, as written by ``save(path, MCS.SIMPLE)``.
+
+        These only have whole seconds, and no URLs.
+        """
+        starts = []
+        with open(path, "r", encoding="utf-8-sig") as fp:
+            for line in fp:
+                result = re.match(r"^(\d+):(\d\d):(\d\d) - (.*)$", line.rstrip("\n"))
+                if result is not None:
+                    hours, minutes, seconds = map(int, result.groups()[:3])
+                    millisec = ((hours * 60 + minutes) * 60 + seconds) * 1000
+                    starts.append((millisec, result.group(4), None))
+        self._append_starts(starts)
+
+    def _load_json(self, path: str):
+        """Load a JSON chapter list, as written by ``save(path, MCS.JSON)``."""
+        with open(path, "r", encoding="utf-8-sig") as fp:
+            entries = json.load(fp)
+        for entry in entries:
+            self.chapters.append(
+                Chapter(
+                    entry["start"],
+                    entry["end"],
+                    text=entry.get("text"),
+                    url=entry.get("url"),
+                )
+            )
+
+    def save(self, path: str, type: int):
+        if type == self.LRC:
+            self._save_lrc(path)
+        elif type == self.CUE:
+            self._save_cue(path)
+        elif type == self.SIMPLE:
+            self._save_simple(path)
+        elif type == self.AUDACITY:
+            self._save_audacity(path)
+        elif type == self.FFMETADATA1:
+            self._save_ffmetadata1(path)
+        elif type == self.JSON:
+            self._save_json(path)
+
+    def _lrc_header(self) -> str:
+        if self.metadata is None:
+            return ""
+        return "[ti:{}]\n[ar:{}]\n[al:{}]\n".format(
+            self.metadata.title, self.metadata.artist, self.metadata.album
+        )
+
+    @staticmethod
+    def _lrc_entry(chapter: Chapter) -> str:
+        # LRC has no hours field, so long shows just keep counting minutes
+        # (e.g. [1439:59.00] near the end of a 24-hour stream).
+        minutes = chapter.start // (60 * 1000)
+        seconds = (chapter.start % (60 * 1000)) // 1000
+        fraction = (chapter.start % 1000) // 10
+        return "[{:02d}:{:02d}.{:02d}]{}\n".format(
+            minutes, seconds, fraction, chapter.text
+        )
+
+    def _save_lrc(self, path: str):
+        with atomic_write(path, encoding="utf-8", newline="\n") as fp:
+            fp.write(self._lrc_header())
+            for chapter in self.chapters:
+                fp.write(self._lrc_entry(chapter))
+
+    def _cue_header(self) -> str:
+        if self.media_filename is None:
+            raise PostShowError(
+                "Writing CUE files is not possible without "
+                "the associated media file name. Pass "
+                "media_filename='path' when creating the MCS."
+            )
+        header = (
+            "\ufeff"  # UTF-8 BOM for foobar2000
+            'REM COMMENT "Generated by PostShow v2: '
+            'https://github.com/vladasbarisas/XBN"\n'
+            'FILE "{}" MP3\n'.format(self.media_filename)
+        )
+        if self.metadata is not None:
+            header += "REM GENRE {}\n".format(self.metadata.genre)
+            header += 'TITLE "{}"\n'.format(self.metadata.title)
+            header += 'PERFORMER "{}"\n'.format(self.metadata.artist)
+        return header
+
+    @staticmethod
+    def _cue_entry(index: int, chapter: Chapter) -> str:
+        # CUE has no hours field either, so minutes past 99 get a third digit
+        # rather than wrapping around.
+        minutes = chapter.start // (60 * 1000)
+        seconds = (chapter.start % (60 * 1000)) // 1000
+        # Magic constant is 75/1000, or the number of CUE "frames" per
+        # millisecond:
+        # https://en.wikipedia.org/wiki/Cue_sheet_(computing)#Essential_commands
+        fraction = int(math.floor((chapter.start % 1000) * 0.075))
+        return (
+            "  TRACK {0:02d} AUDIO\n"
+            '    TITLE "{1}"\n'
+            "    INDEX 01 {2:02d}:{3:02d}:{4:02d}\n".format(
+                index + 1,
+                chapter.text.replace('"', "_"),
+                minutes,
+                seconds,
+                fraction,
+            )
+        )
+
+    def _save_cue(self, path: str):
+        header = self._cue_header()
+        with atomic_write(path, encoding="utf-8", newline="\n") as fp:
+            fp.write(header)
+            for i in range(0, len(self.chapters)):
+                fp.write(self._cue_entry(i, self.chapters[i]))
+
+    @classmethod
+    def _simple_entry(cls, chapter: Chapter) -> str:
+        # Hours keep counting past 23 rather than wrapping around, for
+        # streams that run over a day.
+        seconds = chapter.start // 1000
+        start = "{:02d}:{:02d}:{:02d}".format(
+            seconds // 3600, (seconds % 3600) // 60, seconds % 60
+        )
+        return "{0} - {1}\n".format(start, chapter.text)
+
+    def _save_simple(self, path: str):
+        with atomic_write(path, encoding="utf-8", newline="\n") as fp:
+            for chapter in self.chapters:
+                fp.write(self._simple_entry(chapter))
+
+    @staticmethod
+    def _json_entry(chapter: Chapter) -> str:
+        return json.dumps(
+            {
+                "start": chapter.start,
+                "end": chapter.end,
+                "text": chapter.text,
+                "url": chapter.url,
+            },
+            ensure_ascii=False,
+        )
+
+    def _save_json(self, path: str):
+        with atomic_write(path, encoding="utf-8", newline="\n") as fp:
+            fp.write("[\n")
+            fp.write(",\n".join(self._json_entry(c) for c in self.chapters))
+            fp.write("\n]\n" if self.chapters else "]\n")
+
+    def _save_audacity(self, path: str):
+        with atomic_write(path, encoding="utf-8", newline="\n") as fp:
+            for chapter in self.chapters:
+                text = chapter.text
+                if chapter.url is not None:
+                    text += "|" + chapter.url
+                fp.write(
+                    "{0}\t{1}\t{2}".format(
+                        chapter.start / 1000, chapter.end / 1000, text
+                    )
+                )
+
+    def _save_ffmetadata1(self, path: str):
+        """This function doesn't support chapters with URLs, because I don't know how to
+        make `FFMPEG` write them"""
+        escape = self._ffmetadata_escape
+        with atomic_write(path, encoding="utf-8", newline="\n") as fp:
+            fp.write(";FFMETADATA1\n")
+            if self.metadata is not None:
+                fp.write("title={}\n".format(escape(self.metadata.title)))
+                fp.write("artist={}\n".format(escape(self.metadata.artist)))
+            for chapter in self.chapters:
+                fp.write(
+                    "\n[CHAPTER]\nTIMEBASE=1/1000\n"
+                    "START={start}\nEND={end}\ntitle={text}\n".format(
+                        start=chapter.start, end=chapter.end, text=escape(chapter.text)
+                    )
+                )
+            if self.metadata is not None:
+                fp.write("\n[STREAM]\ntitle={}".format(escape(self.metadata.title)))
+
+    @staticmethod
+    def _ffmetadata_escape(text) -> str:
+        """Backslash the characters that mean something in FFMETADATA1."""
+        return re.sub(r"([=;#\\\n])", r"\\\1", str(text))
+
+    def begin_live(self, outputs: dict) -> None:
+        """Open sidecar files so that chapters can be appended to them.
+
+        :param outputs: A dict mapping output types (one of ``LIVE_TYPES``)
+        to the paths to write them at. Existing files are replaced.
+        """
+        for type, path in outputs.items():
+            if type not in self.LIVE_TYPES:
+                raise PostShowError(
+                    "Output type {} can't be written incrementally".format(type)
+                )
+            # Binary mode, so that the JSON writer can seek backwards
+            fp = open(path, "wb+")
+            self.live_files[type] = fp
+            if type == self.LRC:
+                fp.write(self._lrc_header().encode("utf-8"))
+            elif type == self.CUE:
+                fp.write(self._cue_header().encode("utf-8"))
+            elif type == self.JSON:
+                fp.write(b"[\n]\n")
+            fp.flush()
+        for i in range(0, len(self.chapters)):
+            self._append_live(i, self.chapters[i])
+
+    def append(self, chapter: Chapter) -> None:
+        """Add a chapter to the end of the list, and to any live sidecars.
+
+        Chapters must be appended in chronological order.
+        """
+        chapter.elem_id = "chp{}".format(len(self.chapters))
+        self.chapters.append(chapter)
+        self._append_live(len(self.chapters) - 1, chapter)
+
+    def _append_live(self, index: int, chapter: Chapter) -> None:
+        for type, fp in self.live_files.items():
+            if type == self.LRC:
+                fp.write(self._lrc_entry(chapter).encode("utf-8"))
+            elif type == self.CUE:
+                fp.write(self._cue_entry(index, chapter).encode("utf-8"))
+            elif type == self.SIMPLE:
+                fp.write(self._simple_entry(chapter).encode("utf-8"))
+            elif type == self.JSON:
+                # Step back over the closing bracket (and the newline before
+                # it, if there's already an entry), so the file stays valid
+                # JSON after every append.
+                entry = self._json_entry(chapter).encode("utf-8")
+                if index == 0:
+                    fp.seek(-2, os.SEEK_END)
+                    fp.write(entry + b"\n]\n")
+                else:
+                    fp.seek(-3, os.SEEK_END)
+                    fp.write(b",\n" + entry + b"\n]\n")
+            fp.flush()
+
+    def end_live(self) -> None:
+        """Close the sidecar files opened by ``begin_live``."""
+        for fp in self.live_files.values():
+            fp.close()
+        self.live_files = {}
+
+    def get(self):
+        return self.chapters
+
+
+class FileWatcher:
+    """Wait for files or directories to change.
+
+    Uses inotify when the C library provides it, and falls back to checking
+    the size and modification time of every path each ``interval`` seconds
+    otherwise. Files are watched through their parent directory, so they
+    don't have to exist yet, and being replaced by a rename is noticed.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, paths: list, interval: float = 3.0, use_inotify=True):
+        """Start watching some paths.
+
+        :param paths: Paths of files or directories to watch. For a
+        directory, a change to anything inside it counts.
+        :param interval: How often to check the paths, in seconds, when
+        inotify isn't available.
+        :param use_inotify: Set to False to always poll.
+        """
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.interval = interval
+        self.fd = None
+        self.snapshot = self._stat_all()
+        if use_inotify:
+            self._init_inotify()
+
+    @property
+    def using_inotify(self) -> bool:
+        return self.fd is not None
+
+    def _init_inotify(self) -> None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        dirs = set()
+        for path in self.paths:
+            dirs.add(path if os.path.isdir(path) else os.path.dirname(path))
+        for path in dirs:
+            if libc.inotify_add_watch(fd, path.encode(), self.WATCH_MASK) < 0:
+                os.close(fd)
+                return
+        self.fd = fd
+
+    def _stat_all(self) -> list:
+        """Collect the size and modification time of every watched path."""
+        snapshot = []
+        for path in self.paths:
+            if os.path.isdir(path):
+                for entry in sorted(os.scandir(path), key=lambda e: e.name):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    snapshot.append((entry.path, st.st_size, st.st_mtime_ns))
+            else:
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    snapshot.append((path, None, None))
+                    continue
+                snapshot.append((path, st.st_size, st.st_mtime_ns))
+        return snapshot
 
-    def _save_simple(self, path: str):
-        with open(path, "w") as fp:
-            for chapter in self.chapters:
-                start = self._get_time(chapter.start / 1000).strftime("%H:%M:%S")
-                fp.write("{0} - {1}\n".format(start, chapter.text))
+    def _matches(self, name: str) -> bool:
+        for path in self.paths:
+            if os.path.basename(path) == name or os.path.isdir(path):
+                return True
+        return False
 
-    def _save_audacity(self, path: str):
-        with open(path, "w") as fp:
-            for chapter in self.chapters:
-                text = chapter.text
-                if chapter.url is not None:
-                    text += "|" + chapter.url
-                fp.write(
-                    "{0}\t{1}\t{2}".format(
-                        chapter.start / 1000, chapter.end / 1000, text
-                    )
-                )
+    def wait(self, timeout=None) -> bool:
+        """Block until a watched path changes, or ``timeout`` seconds pass.
 
-    def _save_ffmetadata1(self, path: str):
-        """This function doesn't support chapters with URLs, because I don't know how to
-        make `FFMPEG` write them"""
-        with open(path, "w") as fp:
-            fp.write(";FFMETADATA1\n")
-            if self.metadata is not None:
-                fp.write("title={}\n".format(self.metadata.title))
-                fp.write("artist={}\n".format(self.metadata.artist))
-            for chapter in self.chapters:
-                fp.write(
-                    "\n[CHAPTER]\nTIMEBASE=1/1000\n"
-                    "START={start}\nEND={end}\ntitle={text}\n".format(
-                        start=chapter.start, end=chapter.end, text=chapter.text
-                    )
+        :return: True if something changed, False if the time ran out.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0.0, deadline - time.monotonic())
+            if self.fd is not None:
+                readable, _, _ = select.select([self.fd], [], [], remaining)
+                if readable and self._read_events():
+                    return True
+            else:
+                time.sleep(
+                    self.interval
+                    if remaining is None
+                    else min(self.interval, remaining)
                 )
-            if self.metadata is not None:
-                fp.write("\n[STREAM]\ntitle={}".format(self.metadata.title))
+                snapshot = self._stat_all()
+                if snapshot != self.snapshot:
+                    self.snapshot = snapshot
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def _read_events(self) -> bool:
+        """Drain the inotify queue, returning True if a watched path changed."""
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0").decode()
+                offset += length
+                if self._matches(name):
+                    changed = True
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class MarkerFollower(threading.Thread):
+    """Follow a marker file while it is being written, feeding an MCS.
+
+    Three kinds of file can be followed:
+    * Audacity labels, which are appended to one line at a time
+    * LRC files, which are appended to one line at a time
+    * Now-playing files, which are rewritten with the name of the current
+      segment each time it changes (what Gelo and the old livescript use)
+
+    Since a line in an LRC or now-playing file only says where a chapter
+    starts, each of those chapters is held back until the next one starts, or
+    until the follower is stopped.
+    """
 
-    def get(self):
-        return self.chapters
+    NOW_PLAYING = 20
+
+    def __init__(
+        self,
+        path: str,
+        mcs: MCS,
+        kind=None,
+        origin=None,
+        interval: float = 3.0,
+        use_inotify=True,
+    ):
+        """Create a new follower.
+
+        :param path: The marker file to follow. It doesn't have to exist yet.
+        :param mcs: The MCS to append chapters to.
+        :param kind: ``MCS.AUDACITY``, ``MCS.LRC`` or
+        ``MarkerFollower.NOW_PLAYING``. Guessed from the extension if None.
+        :param origin: For now-playing files, the ``time.time()`` at which
+        the recording started. Defaults to now.
+        :param interval: Polling interval, in seconds, if inotify can't be
+        used.
+        :param use_inotify: Set to False to always poll.
+        """
+        super().__init__()
+        self.path = path
+        self.mcs = mcs
+        if kind is None:
+            extension = path.split(".")[-1:][0]
+            kind = {"txt": MCS.AUDACITY, "lrc": MCS.LRC}.get(
+                extension, self.NOW_PLAYING
+            )
+        self.kind = kind
+        self.origin = time.time() if origin is None else origin
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.offset = 0
+        self.buffer = b""
+        self.pending = None
+        self.last_text = None
+        self.stop_requested = False
+
+    def run(self):
+        watcher = FileWatcher([self.path], self.interval, self.use_inotify)
+        try:
+            self._check()
+            while not self.stop_requested:
+                if watcher.wait(self.interval):
+                    self._check()
+            self._check()
+            self._flush_pending()
+        finally:
+            watcher.close()
+
+    def request_stop(self):
+        self.stop_requested = True
+
+    def _check(self) -> None:
+        if self.kind == self.NOW_PLAYING:
+            self._check_now_playing()
+        else:
+            self._check_log()
+
+    def _check_log(self) -> None:
+        """Read whatever has been appended to the file since the last check."""
+        try:
+            with open(self.path, "rb") as fp:
+                fp.seek(0, os.SEEK_END)
+                if fp.tell() < self.offset:
+                    # The file was truncated or replaced; start over.
+                    self.offset = 0
+                    self.buffer = b""
+                fp.seek(self.offset)
+                data = fp.read()
+        except FileNotFoundError:
+            return
+        self.offset += len(data)
+        lines = (self.buffer + data).split(b"\n")
+        # The last piece is an incomplete line (or empty), keep it for later.
+        self.buffer = lines.pop()
+        for line in lines:
+            self._handle_line(line.decode("utf-8-sig").rstrip("\r"))
+
+    def _handle_line(self, line: str) -> None:
+        if self.kind == MCS.AUDACITY:
+            row = line.split("\t")
+            if len(row) < 3:
+                return
+            chapter = MCS._parse_audacity_row(row)
+            if chapter is not None:
+                self.mcs.append(chapter)
+        else:
+            result = MCS._parse_lrc_line(line)
+            if result is not None:
+                self._start_chapter(*result)
+
+    def _check_now_playing(self) -> None:
+        """Start a new chapter if the now-playing text has changed."""
+        try:
+            with open(self.path, "r", encoding="utf-8-sig") as fp:
+                text = fp.read().strip()
+        except FileNotFoundError:
+            return
+        if text == "" or text == self.last_text:
+            return
+        self.last_text = text
+        self._start_chapter(self._elapsed(), *MCS._split_url(text))
+
+    def _elapsed(self) -> int:
+        return int(round((time.time() - self.origin) * 1000, 0))
+
+    def _start_chapter(self, start: int, text: str, url) -> None:
+        if self.pending is not None:
+            self.mcs.append(
+                Chapter(
+                    self.pending[0], start, text=self.pending[1], url=self.pending[2]
+                )
+            )
+        self.pending = (start, text, url)
+
+    def _flush_pending(self) -> None:
+        """Write out the chapter that was still running."""
+        if self.pending is None:
+            return
+        if self.kind == self.NOW_PLAYING:
+            end = self._elapsed()
+        else:
+            # Same as MCS._load_lrc: the last chapter ends where it starts.
+            end = self.pending[0]
+        self.mcs.append(
+            Chapter(self.pending[0], end, text=self.pending[1], url=self.pending[2])
+        )
+        self.pending = None
 
 
 class PostShowError(Exception):
@@ -692,10 +4173,14 @@ class EnterBasics:
     TITLE_TEXT = "Show Title:"
     LYRICS_TEXT = "Lyrics:"
 
-    def __init__(self, controller):
+    def __init__(self, controller, metadata=None):
+        """Create the view, pre-filled from ``metadata`` if it's given."""
         self.controller = controller
-        self.number_box = urwid.Edit("", "", multiline=False)
-        self.title_box = urwid.Edit("", "", multiline=True)
+        number, name = (
+            ("", "") if metadata is None else (metadata.number, metadata.name)
+        )
+        self.number_box = urwid.Edit("", number, multiline=False)
+        self.title_box = urwid.Edit("", name, multiline=True)
 
     @ViewUtil.window_wrap
     def get_view(self) -> urwid.Widget:
@@ -749,9 +4234,25 @@ class EnterBasics:
 class ConfirmMetadata:
     """Check with the user to ensure everything is OK before writing."""
 
+    UPDATE_INTERVAL_SECONDS = 1
+
     def __init__(self, controller):
         self.controller = controller
         self.metadata = controller.metadata
+        self.loudness_text = urwid.Text(controller.loudness_summary())
+        if controller.loudness() is None and controller.encoder.started:
+            # The measurement finishes with the encoder
+            controller.set_alarm_in(
+                ConfirmMetadata.UPDATE_INTERVAL_SECONDS, self.update_loudness
+            )
+
+    def update_loudness(self, loop, user_data):
+        if self.controller.encoder_finished():
+            self.loudness_text.set_text(self.controller.loudness_summary())
+        else:
+            loop.set_alarm_in(
+                ConfirmMetadata.UPDATE_INTERVAL_SECONDS, self.update_loudness
+            )
 
     @staticmethod
     def build_row(label: str, width: int, value: str):
@@ -808,6 +4309,30 @@ class ConfirmMetadata:
             controls.append(self.build_row("Lyrics:", 14, self.metadata.lyrics))
         if self.metadata.comment is not None:
             controls.append(self.build_row("Comment:", 14, self.metadata.comment))
+        controls.append(
+            urwid.Columns(
+                [
+                    ("fixed", 14, urwid.Text("Audio:")),
+                    urwid.Text(self.controller.audio_summary),
+                ],
+                dividechars=1,
+            )
+        )
+        controls.append(
+            urwid.Columns(
+                [("fixed", 14, urwid.Text("Loudness:")), self.loudness_text],
+                dividechars=1,
+            )
+        )
+        controls.append(
+            urwid.Columns(
+                [
+                    ("fixed", 14, urwid.Text("Chapters:")),
+                    urwid.Text(self.controller.chapter_summary()),
+                ],
+                dividechars=1,
+            )
+        )
         controls.extend(
             [
                 urwid.Divider(),
@@ -908,8 +4433,22 @@ class Controller:
     6. Display the ``TaggerProgress`` view
     7. Save the tags to the file, which will lock up the UI ( threading :( )
     8. Exit
+
+    Every finished stage is recorded in an ``EpisodeJournal``, so if the
+    program is stopped partway through, running it again with the same
+    inputs skips anything that was already done, and step 2 is pre-filled
+    with what was entered last time.
+
+    ``run_headless`` does the same steps with no UI, for scripts.
     """
 
+    # Formats that can be made as well as MP3, with their file extension,
+    # tagger and default bitrate
+    RENDITIONS = {
+        "opus": ("opus", OpusTagger, "96"),
+        "aac": ("m4a", MP4Tagger, "128"),
+    }
+
     def __init__(self, args, config):
         self.loop = urwid.MainLoop(
             None,
@@ -922,13 +4461,31 @@ class Controller:
         def exit_handler(sig, frame):
             self.encoder.request_stop()
 
-        signal.signal(signal.SIGINT, exit_handler)
+        # Signal handlers can only be set from the main thread, and a
+        # JobQueue runs Controllers on others
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, exit_handler)
         self.args = args
         self.config = config
+        self.profile = Profile(config, args.profile)
         self.metadata = None
         self.mp3_path = None
         self.chapters = None
-        self.tmp_path = None
+        self.journal = None
+        self.encode_path = None
+        self.encode_reused = False
+        self.wav_hash = None
+        self.cache = None
+        self.meter = None
+        self.loudness_result = None
+        self.peaks = None
+        self.chapter_problems = []
+        self.audio_summary = None
+        self.renditions = {}
+        self.renditions_reused = False
+        self.profiler = Profiler(enabled=args.profile_report is not None)
+        self.encoder.profiler = self.profiler
+        self.headless = False
 
     @staticmethod
     def get_palette():
@@ -953,22 +4510,262 @@ class Controller:
         1. Start the encoder in a separate thread
         2. Display the ``EnterBasics`` view
         """
-        # Encode the mp3 to a temp file first, then move it later
-        self.tmp_path = tempfile.TemporaryDirectory()
-        if not self.args.no_encode:
-            self.mp3_path = self.build_output_file_path(
-                "mp3", parent=self.tmp_path.name
+        with self.profiler.span("journal.load"):
+            self.journal = EpisodeJournal(
+                self.args.outdir, self.args.wav, fresh=self.args.fresh
             )
+        summaries = []
+        for path in self.wav_paths():
+            with WAVFile(path) as wav:
+                summaries.append(wav.describe())
+        self.audio_summary = "\n".join(summaries)
+        if not self.args.no_encode:
+            # Encode the mp3 to a hidden file in the output directory first,
+            # then move it later
+            self.encode_path = self.journal.work_path("mp3")
             self.encoder.setup(
-                self.args.wav,
-                self.mp3_path,
-                self.config.get(self.args.profile, "bitrate"),
+                self.wav_paths(),
+                self.encode_path,
+                self.profile.bitrate,
+                self.profile.encoder,
             )
-            # Start the encoder on its own thread
-            self.encoder.start()
-        basics_view = EnterBasics(self)
+            if self.args.cache_dir is not None:
+                self.cache = EncodeCache(
+                    self.args.cache_dir, int(self.args.cache_size * 1024**3)
+                )
+            self.start_analysis()
+            self.start_waveform()
+            # Only a WAV seen by an earlier run has a hash yet; a new one gets
+            # hashed by the encoder as it reads it.
+            self.wav_hash = self.known_wav_hash(self.journal.hashes)
+            if self.wav_hash is None and self.cache is not None:
+                self.wav_hash = self.known_wav_hash(self.cache.hashes)
+            if self.wav_hash is not None and self.journal.is_done(
+                EpisodeJournal.ENCODE, self.encode_key()
+            ):
+                self.encode_reused = True
+            elif (
+                self.wav_hash is None
+                or self.cache is None
+                or not self.fetch_from_cache()
+            ):
+                # Start the encoder on its own thread
+                self.encoder.start()
+            else:
+                self.loudness_result = self.cache.data(self.encode_key())
+            # Without an encode to measure it on, use the earlier measurement
+            if (
+                not self.encoder.started
+                and self.loudness_result is None
+                and self.journal.is_done(EpisodeJournal.ANALYSIS, self.analysis_key())
+            ):
+                self.loudness_result = self.journal.stage_data(EpisodeJournal.ANALYSIS)
+            self.start_renditions()
+        if self.headless:
+            return
+        basics_view = EnterBasics(self, self.journal.load_metadata())
         self.loop.widget = basics_view.get_view()
 
+    def start_analysis(self) -> None:
+        """Have the encoder measure loudness as it reads the WAV.
+
+        Only possible when NumPy is installed. Loudness limits in the profile
+        can't be checked without it.
+        """
+        if numpy is None:
+            if self.profile.loudness_limits:
+                raise PostShowError(
+                    "The profile sets loudness limits, but NumPy (which is "
+                    "needed to measure loudness) is not installed."
+                )
+            return
+        with WAVFile(self.args.wav) as wav:
+            self.meter = LoudnessMeter(wav)
+        self.encoder.add_observer(self.meter)
+
+    def start_waveform(self) -> None:
+        """Have the encoder work out waveform peaks as it reads the WAV, if
+        the profile sets ``waveform_resolutions``."""
+        if not self.profile.waveform_resolutions:
+            return
+        with WAVFile(self.args.wav) as wav:
+            self.peaks = WaveformPeaks(wav, self.profile.waveform_resolutions)
+        self.encoder.add_observer(self.peaks)
+
+    def rendition_formats(self) -> list:
+        """The formats the profile wants made as well as MP3."""
+        return [fmt for fmt in self.profile.formats if fmt in self.RENDITIONS]
+
+    def start_renditions(self) -> None:
+        """Start encoding the other formats, each on its own thread.
+
+        They read the same memory-mapped WAV as the MP3 encoder, at the same
+        time, so the audio only comes off the disk once. Formats the profile's
+        encoder can't make are made by ffmpeg.
+        """
+        for fmt in self.rendition_formats():
+            ext, tagger, bitrate = self.RENDITIONS[fmt]
+            backend = self.profile.encoder
+            if fmt not in ENCODER_BACKENDS[backend].FORMATS:
+                backend = "ffmpeg"
+            encoder = MP3Encoder()
+            encoder.profiler = self.profiler
+            # The MP3 encoder hashes the WAV already
+            encoder.hashing = False
+            encoder.setup(
+                self.wav_paths(),
+                self.journal.work_path(ext),
+                self.profile.format_bitrates.get(fmt, bitrate),
+                backend,
+                fmt,
+            )
+            self.renditions[fmt] = encoder
+        if not self.renditions:
+            return
+        if self.wav_hash is not None and self.journal.is_done(
+            EpisodeJournal.RENDITIONS, self.renditions_key()
+        ):
+            self.renditions_reused = True
+            return
+        for encoder in self.renditions.values():
+            encoder.start()
+
+    def renditions_key(self) -> str:
+        """Build the journal key for the other formats."""
+        return EpisodeJournal.hash_value(
+            self.wav_hash,
+            [
+                [fmt, encoder.version(), encoder.settings()]
+                for fmt, encoder in sorted(self.renditions.items())
+            ],
+        )
+
+    def finish_renditions(self) -> None:
+        """Wait for the other formats, and move them into place."""
+        if not self.renditions:
+            return
+        paths = {
+            fmt: os.path.abspath(self.build_output_file_path(self.RENDITIONS[fmt][0]))
+            for fmt in self.renditions
+        }
+        if self.renditions_reused:
+            # Encoded by a previous run, but maybe under other names
+            for fmt, previous in self.journal.stage_data(
+                EpisodeJournal.RENDITIONS
+            ).items():
+                if previous != paths[fmt]:
+                    os.replace(previous, paths[fmt])
+        else:
+            for encoder in self.renditions.values():
+                encoder.join()
+                if not encoder.succeeded():
+                    raise PostShowError(encoder.failure())
+            for fmt, encoder in self.renditions.items():
+                os.replace(encoder.outfile, paths[fmt])
+        self.journal.mark_done(
+            EpisodeJournal.RENDITIONS,
+            self.renditions_key(),
+            list(paths.values()),
+            paths,
+        )
+
+    def analysis_key(self) -> str:
+        """Build the journal key for the loudness analysis."""
+        return EpisodeJournal.hash_value(self.wav_hash, "loudness")
+
+    def loudness(self):
+        """Get the loudness measurements, or None if they aren't ready."""
+        if self.loudness_result is None and self.meter is not None:
+            if self.encoder.succeeded():
+                self.loudness_result = self.meter.result()
+        return self.loudness_result
+
+    def loudness_violations(self) -> list:
+        """List the ways the audio is outside the profile's loudness limits."""
+        result = self.loudness()
+        if result is None:
+            return []
+        checks = [
+            ("loudness_min", "integrated_lufs", "{} LUFS is below {} LUFS", -1),
+            ("loudness_max", "integrated_lufs", "{} LUFS is above {} LUFS", 1),
+            ("true_peak_max", "true_peak_dbtp", "{} dBTP is above {} dBTP", 1),
+            ("clips_max", "clipped_samples", "{} clipped samples is more than {}", 1),
+        ]
+        violations = []
+        for key, measure, message, sign in checks:
+            limit = self.profile.loudness_limits.get(key)
+            if limit is None or result[measure] is None:
+                continue
+            if (result[measure] - limit) * sign > 0:
+                violations.append(message.format(result[measure], "{:g}".format(limit)))
+        return violations
+
+    def loudness_summary(self) -> str:
+        """Describe the loudness measurements for the ``ConfirmMetadata`` view."""
+        result = self.loudness()
+        if result is None:
+            if self.meter is not None and not self.encoder.finished:
+                return "(measuring while encoding)"
+            return "(not measured)"
+        summary = "{} LUFS, {} dBTP, {} clipped".format(
+            result["integrated_lufs"],
+            result["true_peak_dbtp"],
+            result["clipped_samples"],
+        )
+        violations = self.loudness_violations()
+        if violations:
+            summary += "\nOUTSIDE PROFILE LIMITS: " + "; ".join(violations)
+        return summary
+
+    def chapter_summary(self) -> str:
+        """Describe the chapters for the ``ConfirmMetadata`` view, with any
+        problems found in them."""
+        if self.chapters is None:
+            return "(no markers)"
+        lines = ["{} chapters".format(len(self.chapters))]
+        lines.extend("* " + problem["message"] for problem in self.chapter_problems)
+        return "\n".join(lines)
+
+    def write_loudness_report(self) -> None:
+        """Write the loudness report next to the sidecars, and enforce limits."""
+        result = self.loudness()
+        if result is None:
+            return
+        path = self.build_output_file_path("loudness.json")
+        report = dict(result)
+        report["limits"] = dict(self.profile.loudness_limits)
+        report["violations"] = self.loudness_violations()
+        with self.profiler.span("loudness.report"), atomic_write(
+            path, encoding="utf-8"
+        ) as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+            fp.write("\n")
+        self.journal.mark_done(
+            EpisodeJournal.ANALYSIS, self.analysis_key(), [path], data=result
+        )
+        if report["violations"]:
+            raise PostShowError(
+                "Loudness is outside the profile's limits: "
+                + "; ".join(report["violations"])
+            )
+
+    def fetch_from_cache(self) -> bool:
+        with self.profiler.span("cache.fetch"):
+            return self.cache.fetch(self.encode_key(), self.encode_path)
+
+    def save_profile_report(self) -> None:
+        """Write out the profile, if ``--profile-report`` asked for one."""
+        if self.args.profile_report is not None:
+            self.profiler.save(
+                self.args.profile_report, self.args.profile_format == "chrome"
+            )
+
+    def encode_key(self) -> str:
+        """Build the journal key for the encode stage."""
+        return EpisodeJournal.hash_value(
+            self.wav_hash, self.encoder.version(), self.encoder.settings()
+        )
+
     def set_metadata(self, metadata: EpisodeMetadata):
         """Do steps 3 and 4.
 
@@ -977,10 +4774,13 @@ class Controller:
         4. Display the ``ConfirmMetadata`` view
         """
         self.metadata = metadata
+        self.journal.save_metadata(metadata)
         # Metadata conversion
         self.complete_metadata()
-        if self.args.markers is not None:
+        if any(path is not None for path in self.marker_paths()):
             self.build_chapters()
+        if self.headless:
+            return
         confirm_view = ConfirmMetadata(self)
         self.loop.widget = confirm_view.get_view()
 
@@ -990,55 +4790,252 @@ class Controller:
         5. Display the ``EncoderProgress`` view
         """
         self.metadata = metadata
-        if not self.args.no_encode:
+        if not self.headless and any(e.started for e in self.encoders()):
             progress_view = EncoderProgress(self)
             self.loop.widget = progress_view.get_view()
         else:
             self.progress_view_finished()
 
     def exit(self):
-        if self.encoder is not None and self.encoder.started:
-            print("Waiting for the encoder to stop...")
-            self.encoder.request_stop()
-            self.encoder.join()
+        self.stop_encoders()
         raise urwid.ExitMainLoop()
 
-    def build_output_file_path(self, ext: str, parent=None):
+    def stop_encoders(self) -> None:
+        running = [e for e in self.encoders() if e.started and not e.finished]
+        if running:
+            print("Waiting for the encoder to stop...")
+            for encoder in running:
+                encoder.request_stop()
+            for encoder in running:
+                encoder.join()
+
+    def run_headless(self, number: str, name: str) -> None:
+        """Do every step without the UI, for scripts.
+
+        This is the same as entering ``number`` and ``name`` in the
+        ``EnterBasics`` view and accepting the metadata as it is. Errors are
+        raised as usual, once any encoders still running have been stopped.
+        """
+        self.headless = True
+        try:
+            self.start()
+            self.set_metadata(EpisodeMetadata(number, name))
+            self.finalize_metadata(self.metadata)
+        except BaseException:
+            self.stop_encoders()
+            raise
+
+    def wav_paths(self) -> list:
+        """The WAV, followed by any more parts of the recording."""
+        return [self.args.wav] + [wav for wav, markers in self.args.parts]
+
+    def marker_paths(self) -> list:
+        """The marker file for each of ``wav_paths()``, or None for parts
+        without one."""
+        return [self.args.markers] + [
+            None if markers == "-" else markers for wav, markers in self.args.parts
+        ]
+
+    def part_durations(self) -> list:
+        """The length of each of ``wav_paths()``, in milliseconds."""
+        durations = []
+        for path in self.wav_paths():
+            with WAVFile(path) as wav:
+                durations.append(wav.duration_ms)
+        return durations
+
+    def known_wav_hash(self, hashes: HashMemo):
+        """The hash of the WAV (or of all its parts), if ``hashes`` has it."""
+        known = [hashes.known(path) for path in self.wav_paths()]
+        return None if None in known else HashMemo.combine(known)
+
+    def hash_wavs(self) -> str:
+        """Hash the WAV (or all its parts), reading them only if needed."""
+        return HashMemo.combine(
+            [self.journal.hashes.hash_file(path) for path in self.wav_paths()]
+        )
+
+    def build_output_file_path(self, ext: str):
         """Create the path for an output file with the given extension.
 
         This requires a bunch of code, which would be better in its own
         function.
         """
-        if parent is None:
-            return os.path.join(
-                self.args.outdir,
-                self.config.get(self.args.profile, "filename").format(
-                    slug=self.config.get(self.args.profile, "slug").lower(),
-                    epnum=self.metadata.number,
-                    ext=ext,
-                ),
-            )
-        else:
-            return os.path.join(parent, "encoding." + ext)
+        return os.path.join(
+            self.args.outdir, self.profile.output_name(self.metadata.number, ext)
+        )
 
     def build_chapters(self):
         """Create a chapter list"""
         mcs = MCS(
             metadata=self.metadata, media_filename=self.build_output_file_path("mp3")
         )
-        mcs.load(self.args.markers)
+        durations = self.part_durations()
+        offsets = [sum(durations[:i]) for i in range(len(durations))]
+        with self.profiler.span("markers.load"):
+            mcs.merge(list(zip(self.marker_paths(), offsets)))
+        self.snap_chapters(mcs.get(), offsets)
+        mcs.validate(sum(durations))
         self.chapters = mcs.get()
-        mcs.save(self.build_output_file_path("lrc"), MCS.LRC)
-        mcs.save(self.build_output_file_path("cue"), MCS.CUE)
-        mcs.save(self.build_output_file_path("txt"), MCS.SIMPLE)
+        self.chapter_problems = mcs.diagnostics
         self.metadata.lyrics = "\n".join([chapter.text for chapter in self.chapters])
+        outputs = [
+            (self.build_output_file_path("lrc"), MCS.LRC),
+            (self.build_output_file_path("cue"), MCS.CUE),
+            (self.build_output_file_path("txt"), MCS.SIMPLE),
+        ]
+        key = EpisodeJournal.hash_value(
+            [
+                self.journal.hashes.hash_file(path)
+                for path in self.marker_paths()
+                if path is not None
+            ],
+            [repr(chapter) for chapter in self.chapters],
+            [self.metadata.title, self.metadata.artist, self.metadata.album],
+            self.metadata.genre,
+            mcs.media_filename,
+        )
+        if self.journal.is_done(EpisodeJournal.SIDECARS, key):
+            return
+        with concurrent.futures.ThreadPoolExecutor(len(outputs)) as pool:
+            jobs = [
+                pool.submit(self.save_sidecar, mcs, path, type)
+                for path, type in outputs
+            ]
+            for job in jobs:
+                job.result()
+        self.journal.mark_done(
+            EpisodeJournal.SIDECARS, key, [path for path, type in outputs]
+        )
+
+    def save_sidecar(self, mcs: MCS, path: str, type: int) -> None:
+        with self.profiler.span("sidecar.save", file=os.path.basename(path)):
+            mcs.save(path, type)
+
+    def snap_chapters(self, chapters: list, offsets: list) -> None:
+        """Move chapter starts to the nearest silence, if snapping is on.
+
+        Each chapter is snapped in the WAV part it starts in.
+
+        :param offsets: Where each WAV part starts, in milliseconds.
+        """
+        tolerance = self.snap_tolerance()
+        if not tolerance:
+            return
+        # Chapters that ran up to the next one should still do so, even when
+        # the next one is in another part
+        joined = [a.end == b.start for a, b in zip(chapters, chapters[1:])]
+        with self.profiler.span("markers.snap"):
+            for path, offset in zip(self.wav_paths(), offsets):
+                with WAVFile(path) as wav:
+                    part = [
+                        chapter
+                        for chapter in chapters
+                        if offset <= chapter.start < offset + wav.duration_ms
+                    ]
+                    for chapter in part:
+                        chapter.start -= offset
+                        chapter.end -= offset
+                    SilenceSnapper(
+                        wav, int(tolerance * 1000), self.profile.silence_threshold
+                    ).snap(part)
+                    for chapter in part:
+                        chapter.start += offset
+                        chapter.end += offset
+        for i, chapter in enumerate(chapters[:-1]):
+            if joined[i]:
+                chapter.end = chapters[i + 1].start
+
+    def snap_tolerance(self) -> float:
+        """How far, in seconds, chapter starts may be moved to find silence."""
+        if self.args.snap is not None:
+            return self.args.snap
+        return self.profile.snap_tolerance
+
+    def tag_key(self) -> str:
+        """Build the journal key for the tag stage."""
+        cover_art = None
+        if self.profile.cover_art is not None:
+            cover_art = self.journal.hashes.hash_file(self.profile.cover_art)
+        return EpisodeJournal.hash_value(
+            {k: v for k, v in vars(self.metadata).items() if k != "chapters"},
+            [repr(chapter) for chapter in self.chapters or []],
+            cover_art,
+            [path for path, tagger in self.tag_targets()],
+        )
+
+    def tag_targets(self) -> list:
+        """List (path, tagger class) for every output file to be tagged."""
+        targets = [(self.mp3_path, MP3Tagger)]
+        for fmt in self.rendition_formats():
+            ext, tagger, bitrate = self.RENDITIONS[fmt]
+            path = self.build_output_file_path(ext)
+            if os.path.exists(path):
+                targets.append((path, tagger))
+        return targets
 
     def do_tag(self, loop, user_data):
-        """Tag the file, and do step 8.
+        """Tag the files, and do step 8.
 
         8. Exit
         """
-        t = MP3Tagger(self.mp3_path)
+        self.tag_files()
+        self.write_seek_index()
+        self.write_waveform()
+        self.export_clips()
+        self.publish()
+        raise urwid.ExitMainLoop()
+
+    def tag_files(self) -> None:
+        """Tag every output file, unless a previous run already did.
+
+        Each file is tagged on its own thread, so extra formats don't make
+        this take any longer than tagging the MP3 does.
+        """
+        key = self.tag_key()
+        if self.journal.is_done(EpisodeJournal.TAG, key):
+            self.update_indexes()
+            return
+        targets = self.tag_targets()
+        # The WAV's header gives the exact length, without scanning the MP3
+        length = sum(self.part_durations())
+        with self.profiler.span("tag"), concurrent.futures.ThreadPoolExecutor(
+            len(targets)
+        ) as pool:
+            jobs = [
+                pool.submit(self.tag_file, tagger, path, length)
+                for path, tagger in targets
+            ]
+            for job in jobs:
+                job.result()
+        self.journal.mark_done(
+            EpisodeJournal.TAG, key, [path for path, tagger in targets]
+        )
+        self.update_indexes()
+
+    def update_indexes(self) -> None:
+        """Add the tagged MP3 to the profile's catalog and chapter index."""
+        if self.profile.catalog is not None:
+            with self.profiler.span("catalog.record"), Catalog(
+                self.profile.catalog
+            ) as catalog:
+                catalog.record(
+                    self.mp3_path,
+                    profile=self.args.profile,
+                    number=self.metadata.number,
+                    name=self.metadata.name,
+                )
+        if self.profile.chapter_index is not None and self.chapters:
+            with self.profiler.span("chapter_index.update"), ChapterIndex(
+                self.profile.chapter_index
+            ) as index:
+                index.update([self.mp3_path])
+
+    def tag_file(self, tagger_class, path: str, length_ms: int) -> None:
+        """Write the episode's metadata and chapters to one file."""
+        name = os.path.basename(path)
+        with self.profiler.span("tag.open", file=name):
+            t = tagger_class(path, length_ms)
         t.set_title(self.metadata.title)
         t.set_album(self.metadata.album)
         t.set_artist(self.metadata.artist)
@@ -1053,16 +5050,218 @@ class Controller:
             t.add_comment(self.metadata.language, "track list", self.metadata.comment)
             if self.metadata.comment is not None:
                 t.add_lyrics(self.metadata.language, "track list", self.metadata.lyrics)
-        if self.config.getboolean(self.args.profile, "write_date"):
-            t.set_date(datetime.datetime.now().strftime("%Y"))
-        if self.config.getboolean(self.args.profile, "write_trackno"):
+        if self.profile.write_date:
+            t.set_date(self.metadata.date)
+        if self.profile.write_trackno:
             t.set_trackno(self.metadata.track)
         if self.chapters is not None:
             t.add_chapters(self.chapters)
-        if "cover_art" in self.config[self.args.profile].keys():
-            t.set_cover_art(self.config.get(self.args.profile, "cover_art"))
+        if self.profile.cover_art is not None:
+            with self.profiler.span("tag.cover_art", file=name):
+                t.set_cover_art(self.profile.cover_art)
+        with self.profiler.span("tag.save", file=name):
+            t.save()
+
+    def write_seek_index(self) -> None:
+        """Write the tagged MP3's seek index, if the profile sets
+        ``seek_interval``."""
+        if not self.profile.seek_interval:
+            return
+        path = self.build_output_file_path("seek")
+        interval_ms = max(1, int(self.profile.seek_interval * 1000))
+        starts = [chapter.start for chapter in self.chapters]
+        key = EpisodeJournal.hash_value(
+            self.journal.hashes.hash_file(self.mp3_path), interval_ms, starts
+        )
+        if self.journal.is_done(EpisodeJournal.SEEK_INDEX, key):
+            return
+        with self.profiler.span("seek_index"), MP3FrameIndex(self.mp3_path) as frames:
+            SeekIndex.build(frames, interval_ms, starts).save(path)
+        self.journal.mark_done(EpisodeJournal.SEEK_INDEX, key, [path])
+
+    def write_waveform(self) -> None:
+        """Write the waveform peaks and chapters for the web player, if the
+        profile sets ``waveform_resolutions``."""
+        resolutions = self.profile.waveform_resolutions
+        if not resolutions:
+            return
+        key = EpisodeJournal.hash_value(
+            self.wav_hash or self.hash_wavs(),
+            resolutions,
+            [repr(chapter) for chapter in self.chapters],
+        )
+        if self.journal.is_done(EpisodeJournal.WAVEFORM, key):
+            return
+        with self.profiler.span("waveform"):
+            peaks = self.peaks
+            if peaks is None or not self.encoder.succeeded():
+                # The encode was reused (or skipped), so nothing has read the
+                # WAV this time
+                peaks = WaveformPeaks.measure(self.wav_paths(), resolutions)
+            dat_paths = {
+                spp: self.build_output_file_path("peaks-{}.dat".format(spp))
+                for spp in peaks.levels()
+            }
+            json_path = self.build_output_file_path("peaks.json")
+            peaks.save(json_path, dat_paths, self.chapters)
+        self.journal.mark_done(
+            EpisodeJournal.WAVEFORM, key, [json_path] + list(dat_paths.values())
+        )
+
+    def clip_ranges(self) -> list:
+        """List (start, end) in milliseconds for each chapter's clip.
+
+        Chapters from point labels end where they start, so those run until
+        the next chapter starts (or the audio ends) instead.
+        """
+        length = sum(self.part_durations())
+        ranges = []
+        for i, chapter in enumerate(self.chapters):
+            end = chapter.end
+            if end <= chapter.start:
+                end = (
+                    self.chapters[i + 1].start if i + 1 < len(self.chapters) else length
+                )
+            ranges.append((chapter.start, min(end, length)))
+        return ranges
+
+    def export_clips(self) -> None:
+        """Make and tag an MP3 of each chapter on its own, with ``--clips``.
+
+        With ``--clips encode``, the clips are encoded at the same time, as
+        many as there are CPUs, and each one only reads its chapter's part of
+        the WAV. With ``--clips split``, they're cut from the episode's MP3
+        between frames instead, without encoding anything.
+        """
+        if not self.args.clips or not self.chapters:
+            return
+        # Chapters with no audio (say, two markers at the same time) are left
+        # out, but the rest keep their chapter numbers.
+        clips = [
+            (i, start, end, self.build_output_file_path("clip{:02d}.mp3".format(i + 1)))
+            for i, (start, end) in enumerate(self.clip_ranges())
+            if end > start
+        ]
+        if self.args.clips == "split":
+            source = [self.journal.hashes.hash_file(self.mp3_path)]
+        else:
+            source = [
+                self.wav_hash or self.hash_wavs(),
+                self.encoder.version(),
+                self.encoder.settings(),
+            ]
+        key = EpisodeJournal.hash_value(self.args.clips, *source, clips, self.tag_key())
+        if self.journal.is_done(EpisodeJournal.CLIPS, key):
+            return
+        if self.args.clips == "split":
+            with self.profiler.span("clips"), MP3FrameIndex(self.mp3_path) as frames:
+                for clip in clips:
+                    self.export_clip(*clip, frames=frames)
+        else:
+            with self.profiler.span("clips"), concurrent.futures.ThreadPoolExecutor(
+                os.cpu_count()
+            ) as pool:
+                jobs = [pool.submit(self.export_clip, *clip) for clip in clips]
+                for job in jobs:
+                    job.result()
+        self.journal.mark_done(
+            EpisodeJournal.CLIPS, key, [path for i, start, end, path in clips]
+        )
+
+    def export_clip(
+        self, index: int, start: int, end: int, path: str, frames=None
+    ) -> None:
+        """Make one chapter's clip, and tag it as that chapter.
+
+        :param frames: The episode MP3's ``MP3FrameIndex``, to cut the clip
+        from. Without it, the clip is encoded from the WAV.
+        """
+        chapter = self.chapters[index]
+        work_path = self.journal.work_path("clip{:02d}.mp3".format(index + 1))
+        if frames is not None:
+            length = frames.copy(start, end, work_path)
+        else:
+            encoder = MP3Encoder()
+            encoder.profiler = self.profiler
+            encoder.setup(
+                self.wav_paths(),
+                work_path,
+                self.profile.bitrate,
+                self.profile.encoder,
+                start_ms=start,
+                end_ms=end,
+            )
+            encoder.start()
+            encoder.join()
+            if not encoder.succeeded():
+                raise PostShowError(encoder.failure())
+            length = end - start
+        t = MP3Tagger(work_path, length)
+        t.set_title(chapter.text)
+        if chapter.url is not None:
+            t.set_url(chapter.url)
+        t.set_album(self.metadata.title)
+        t.set_artist(self.metadata.artist)
+        t.set_season(self.metadata.season)
+        t.set_genre(self.metadata.genre)
+        t.set_language(self.metadata.language)
+        t.set_trackno("{}/{}".format(index + 1, len(self.chapters)))
+        if self.profile.cover_art is not None:
+            t.set_cover_art(self.profile.cover_art)
         t.save()
-        raise urwid.ExitMainLoop()
+        os.replace(work_path, path)
+
+    def published_paths(self) -> list:
+        """Every file this episode's stages wrote that still exists."""
+        paths = set()
+        for stage in EpisodeJournal.STAGES:
+            if stage != EpisodeJournal.PUBLISH:
+                paths.update(self.journal.outputs(stage))
+        return sorted(path for path in paths if os.path.isfile(path))
+
+    def publish(self) -> None:
+        """Send the episode's files to the profile's ``publish`` directory.
+
+        Only the regions of each file that changed since it was last published
+        there are copied from it (see ``BlockManifest``); the rest is copied
+        from the published version. The names of the files that changed are
+        written to ``<slug>-<epnum>.publish.txt``, relative to the output
+        directory, for ``rsync --files-from``.
+        """
+        if self.profile.publish is None:
+            return
+        paths = self.published_paths()
+        key = EpisodeJournal.hash_value(
+            os.path.abspath(self.profile.publish),
+            [[path, HashMemo.stat(path)] for path in paths],
+        )
+        if self.journal.is_done(EpisodeJournal.PUBLISH, key):
+            return
+        list_path = self.build_output_file_path("publish.txt")
+        changed = []
+        sent = 0
+        with self.profiler.span("publish"):
+            remote = DirectoryRemote(self.profile.publish)
+            for path in paths:
+                name = os.path.basename(path)
+                with self.profiler.span("publish.manifest", file=name):
+                    manifest = BlockManifest.build(path)
+                old = remote.manifest(name)
+                if old is not None and old.regions == manifest.regions:
+                    continue
+                ops = manifest.delta(old)
+                with self.profiler.span("publish.put", file=name):
+                    remote.put(name, path, manifest, ops)
+                changed.append(os.path.relpath(path, self.args.outdir))
+                sent += sum(length for source, offset, length in ops if source == "new")
+        with atomic_write(list_path, encoding="utf-8", newline="\n") as fp:
+            fp.writelines(name + "\n" for name in changed)
+        self.journal.mark_done(
+            EpisodeJournal.PUBLISH,
+            key,
+            [list_path],
+            {"changed": changed, "bytes_sent": sent},
+        )
 
     def set_alarm_in(self, *args, **kwargs):
         """Pass the call to the event loop."""
@@ -1081,24 +5280,59 @@ class Controller:
         self.mp3_path = self.build_output_file_path("mp3")
         # Join the encoder thread, since tagging can't occur until it is
         # done
-        if not self.args.no_encode:
-            self.encoder.join()
-            os.rename(
-                self.build_output_file_path("mp3", parent=self.tmp_path.name),
-                self.mp3_path,
+        if self.encode_reused:
+            # Encoded by a previous run, but maybe under another name
+            previous = self.journal.outputs(EpisodeJournal.ENCODE)[0]
+            if previous != os.path.abspath(self.mp3_path):
+                os.replace(previous, self.mp3_path)
+                self.journal.mark_done(
+                    EpisodeJournal.ENCODE, self.encode_key(), [self.mp3_path]
+                )
+        elif not self.args.no_encode:
+            if self.encoder.started:
+                self.encoder.join()
+                if not self.encoder.succeeded():
+                    raise PostShowError(self.encoder.failure())
+                self.wav_hash = self.encoder.sha256
+                parts = list(zip(self.wav_paths(), self.encoder.part_sha256))
+                for path, sha256 in parts:
+                    self.journal.hashes.remember(path, sha256)
+                if self.cache is not None:
+                    with self.profiler.span("cache.store"):
+                        for path, sha256 in parts:
+                            self.cache.remember_hash(path, sha256)
+                        self.cache.store(
+                            self.encode_key(), self.encode_path, self.loudness()
+                        )
+            # Otherwise, it came out of the cache
+            os.replace(self.encode_path, self.mp3_path)
+            self.journal.mark_done(
+                EpisodeJournal.ENCODE, self.encode_key(), [self.mp3_path]
             )
-            self.tmp_path.cleanup()
+        self.finish_renditions()
+        self.write_loudness_report()
+        if self.headless:
+            self.tag_files()
+            self.write_seek_index()
+            self.write_waveform()
+            self.export_clips()
+            self.publish()
+            return
         tag_progress_view = TaggerProgress(self)
         self.loop.widget = tag_progress_view.get_view()
         # Do async so that this function returns immediately
         self.loop.set_alarm_in(0.1, self.do_tag)
 
+    def encoders(self) -> list:
+        """The MP3 encoder, and one for each of the other formats."""
+        return [self.encoder] + list(self.renditions.values())
+
     def encoder_finished(self) -> bool:
-        """Return true if the encoder is finished."""
-        return self.encoder.finished
+        """Return true if all of the encoders are finished."""
+        return all(e.finished for e in self.encoders() if e.started)
 
     def get_encoder_percent(self) -> int:
-        return self.encoder.percent
+        return min([e.percent for e in self.encoders() if e.started] or [100])
 
     def complete_metadata(self) -> None:
         """Complete the metadata using the config file.
@@ -1107,28 +5341,256 @@ class Controller:
         the user and combine them into the complete information for this
         episode.
         """
-        self.metadata.title = self.config.get(self.args.profile, "title").format(
-            slug=self.config.get(self.args.profile, "slug"),
-            epnum=self.metadata.number,
-            name=self.metadata.name,
+        self.fill_metadata(
+            self.metadata, self.profile, self.source_date(self.args.source_date)
         )
-        self.metadata.album = self.config.get(self.args.profile, "album")
-        self.metadata.artist = self.config.get(self.args.profile, "artist")
-        self.metadata.season = self.config.get(self.args.profile, "season")
-        self.metadata.genre = self.config.get(self.args.profile, "genre")
-        self.metadata.language = self.config.get(self.args.profile, "language")
-        self.metadata.composer = self.config.get(
-            self.args.profile, "composer", fallback=None
-        )
-        self.metadata.accompaniment = self.config.get(
-            self.args.profile, "accompaniment", fallback=None
+
+    @staticmethod
+    def source_date(value=None) -> datetime.datetime:
+        """The date to write wherever the current date would go.
+
+        :param value: A date like 2024-05-31, or a Unix timestamp, as given
+        to ``--source-date``. Without it, $SOURCE_DATE_EPOCH is used if it's
+        set, so that builds are reproducible, and otherwise the current date.
+        """
+        if value is None:
+            value = os.environ.get("SOURCE_DATE_EPOCH")
+        if value is None:
+            return datetime.datetime.now()
+        if value.strip().isdigit():
+            return datetime.datetime.fromtimestamp(int(value), datetime.timezone.utc)
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise PostShowError(
+                '"{}" is not a date (like 2024-05-31) or a Unix timestamp'.format(value)
+            )
+
+    @staticmethod
+    def fill_metadata(metadata: EpisodeMetadata, profile: Profile, date=None) -> None:
+        """Fill out ``metadata`` from a profile.
+
+        This is ``complete_metadata`` without the need for a whole Controller,
+        for the scripts that reuse it.
+
+        :param date: The ``datetime`` to take the year from, if not
+        ``source_date()``.
+        """
+        metadata.title = profile.title.format(
+            slug=profile.slug,
+            epnum=metadata.number,
+            name=metadata.name,
         )
-        if self.config.getboolean(self.args.profile, "write_date"):
-            self.metadata.date = datetime.datetime.now().strftime("%Y")
-        if self.config.getboolean(self.args.profile, "write_trackno"):
-            self.metadata.track = self.metadata.number
-        if self.config.getboolean(self.args.profile, "lyrics_equals_comment"):
-            self.metadata.comment = self.metadata.lyrics
+        metadata.album = profile.album
+        metadata.artist = profile.artist
+        metadata.season = profile.season
+        metadata.genre = profile.genre
+        metadata.language = profile.language
+        metadata.composer = profile.composer
+        metadata.accompaniment = profile.accompaniment
+        if profile.write_date:
+            if date is None:
+                date = Controller.source_date()
+            metadata.date = date.strftime("%Y")
+        if profile.write_trackno:
+            metadata.track = metadata.number
+        if profile.lyrics_equals_comment:
+            metadata.comment = metadata.lyrics
+
+
+class JobQueue:
+    """Run PostShowV2 headlessly on queued recordings, a few at a time.
+
+    Each job is a recording plus what would otherwise be typed in: the
+    output directory, profile, markers, and episode number and name. Jobs
+    are kept in a JSON file, so the queue survives restarts; anything that
+    was running when the last process stopped is queued again, and picks up
+    where it left off thanks to the ``EpisodeJournal``.
+
+    ``watch`` follows a job's progress as it changes, without polling.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    VERSION = 1
+
+    def __init__(self, path: str, config_path: str, workers: int = 2):
+        """Load the queue, and start any jobs still waiting in it.
+
+        :param path: The JSON file the queue is kept in.
+        :param config_path: The configuration file the jobs use.
+        :param workers: How many jobs can run at once.
+        """
+        self.path = path
+        self.config_path = config_path
+        self.lock = threading.Lock()
+        # Notified, with the generation bumped, whenever any job changes
+        self.changed = threading.Condition(self.lock)
+        self.generation = 0
+        self.data = {"version": self.VERSION, "next_id": 1, "jobs": []}
+        try:
+            with open(path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("version") == self.VERSION:
+                self.data = data
+        except (FileNotFoundError, ValueError):
+            pass
+        self.controllers = {}
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        for job in self.data["jobs"]:
+            if job["state"] in [self.QUEUED, self.RUNNING]:
+                job["state"] = self.QUEUED
+                self.pool.submit(self._run, job["id"])
+        self._save()
+
+    def _save(self) -> None:
+        with atomic_write(self.path, encoding="utf-8") as fp:
+            json.dump(self.data, fp, indent=2, sort_keys=True)
+
+    def submit(
+        self,
+        wav: str,
+        outdir: str,
+        number: str,
+        name: str,
+        profile: str = "default",
+        markers=None,
+    ) -> dict:
+        """Queue a recording. Returns a copy of the new job."""
+        wav = os.path.abspath(wav)
+        job = {
+            "wav": wav,
+            "stat": HashMemo.stat(wav),
+            "outdir": os.path.abspath(outdir),
+            "number": number,
+            "name": name,
+            "profile": profile,
+            "markers": None if markers is None else os.path.abspath(markers),
+            "state": self.QUEUED,
+            "error": None,
+            "submitted": time.time(),
+            "started": None,
+            "finished": None,
+        }
+        with self.lock:
+            job["id"] = str(self.data["next_id"])
+            self.data["next_id"] += 1
+            self.data["jobs"].append(job)
+            self._save()
+            self._changed()
+        self.pool.submit(self._run, job["id"])
+        return dict(job)
+
+    def jobs(self) -> list:
+        """Copies of every job, oldest first."""
+        with self.lock:
+            return [dict(job) for job in self.data["jobs"]]
+
+    def get(self, job_id: str):
+        """A copy of a job, or None if there isn't one with that ID."""
+        with self.lock:
+            job = self._find(job_id)
+            return None if job is None else dict(job)
+
+    def latest(self, wav: str):
+        """A copy of the newest job for a recording, or None."""
+        wav = os.path.abspath(wav)
+        with self.lock:
+            for job in reversed(self.data["jobs"]):
+                if job["wav"] == wav:
+                    return dict(job)
+        return None
+
+    def _find(self, job_id: str):
+        for job in self.data["jobs"]:
+            if job["id"] == job_id:
+                return job
+        return None
+
+    def _update(self, job_id: str, **changes) -> None:
+        with self.lock:
+            self._find(job_id).update(changes)
+            self._save()
+            self._changed()
+
+    def _changed(self) -> None:
+        """Wake up ``watch``. Call with the lock held."""
+        self.generation += 1
+        self.changed.notify_all()
+
+    def _encoded_block(self, block) -> None:
+        """Encoder observer, so ``watch`` hears about progress."""
+        with self.lock:
+            self._changed()
+
+    def progress(self, job_id: str):
+        """A job's state, and how far its encoders have got (0 to 100)."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        controller = self.controllers.get(job_id)
+        if job["state"] == self.DONE:
+            percent = 100
+        elif controller is None or not any(e.started for e in controller.encoders()):
+            percent = 0
+        else:
+            percent = controller.get_encoder_percent()
+        return {"id": job_id, "state": job["state"], "percent": percent}
+
+    def watch(self, job_id: str, keepalive: float = 15.0):
+        """Yield a job's progress each time it changes, until it finishes.
+
+        Yields None if nothing has changed for ``keepalive`` seconds, so a
+        caller streaming it somewhere can check the other end is still there.
+        """
+        last = None
+        while True:
+            with self.lock:
+                generation = self.generation
+            progress = self.progress(job_id)
+            if progress is None:
+                return
+            if progress != last:
+                yield progress
+                last = progress
+            if progress["state"] in [self.DONE, self.FAILED]:
+                return
+            with self.changed:
+                if not self.changed.wait_for(
+                    lambda: self.generation != generation, keepalive
+                ):
+                    yield None
+
+    def _run(self, job_id: str) -> None:
+        job = self.get(job_id)
+        if job is None or job["state"] != self.QUEUED:
+            return
+        self._update(job_id, state=self.RUNNING, started=time.time())
+        argv = [job["wav"], job["outdir"], "-c", self.config_path]
+        argv += ["-p", job["profile"]]
+        if job["markers"] is not None:
+            argv += ["-m", job["markers"]]
+        try:
+            args = Main.parse_args(argv)
+            controller = Controller(args, Main.check_config(self.config_path))
+            controller.encoder.add_observer(self._encoded_block)
+            self.controllers[job_id] = controller
+            controller.run_headless(job["number"], job["name"])
+        except Exception as e:
+            self._update(job_id, state=self.FAILED, error=str(e), finished=time.time())
+        else:
+            self._update(job_id, state=self.DONE, finished=time.time())
+        finally:
+            self.controllers.pop(job_id, None)
+
+    def shutdown(self) -> None:
+        """Stop starting jobs, and wait for the running ones to finish.
+
+        Jobs that haven't started stay queued in the file for next time.
+        """
+        self.pool.shutdown(wait=True, cancel_futures=True)
 
 
 class Main:
@@ -1140,8 +5602,8 @@ class Main:
         self.config = self.check_config(self.args.config)
 
     @staticmethod
-    def parse_args() -> argparse.Namespace:
-        """Parse arguments to this program."""
+    def parse_args(argv=None) -> argparse.Namespace:
+        """Parse arguments to this program (``sys.argv``, unless ``argv``)."""
         parser = argparse.ArgumentParser(
             description="Convert and tag WAVs and chapter metadata for podcasts."
         )
@@ -1160,8 +5622,19 @@ class Main:
         parser.add_argument(
             "-m",
             "--markers",
-            help="marker file to convert/use. Only Audacity "
-            "labels are currently supported",
+            help="marker file to convert/use. Audacity labels, LRC "
+            "and JSON chapter lists are supported",
+        )
+        parser.add_argument(
+            "--part",
+            nargs=2,
+            action="append",
+            default=[],
+            dest="parts",
+            metavar=("WAV", "MARKERS"),
+            help="another part of the recording, and its marker file (or - for "
+            "none), to follow the first WAV. Repeat for each part; their "
+            "markers are moved to where each part starts in the episode",
         )
         parser.add_argument(
             "-p",
@@ -1169,20 +5642,82 @@ class Main:
             default="default",
             help="the configuration profile on which to base default values",
         )
+        parser.add_argument(
+            "--snap",
+            type=float,
+            metavar="SECONDS",
+            help="move each chapter start to the nearest silence within this "
+            "many seconds. Overrides snap_tolerance in the profile; 0 turns "
+            "snapping off",
+        )
+        parser.add_argument(
+            "--clips",
+            nargs="?",
+            const="encode",
+            choices=["encode", "split"],
+            help="also make an MP3 of each chapter on its own, tagged with the "
+            "chapter's title and URL. They're encoded from the WAV, or with "
+            "split, cut from the episode's MP3 without encoding",
+        )
+        parser.add_argument(
+            "--source-date",
+            metavar="DATE",
+            help="the date (like 2024-05-31, or a Unix timestamp) to use "
+            "instead of today's in the tags, so that running again makes the "
+            "same files. Defaults to $SOURCE_DATE_EPOCH, if it's set",
+        )
         parser.add_argument(
             "--no-encode",
             default=False,
             action="store_true",
             help="the MP3 file already exists, don't encode the WAV file.",
         )
-        args = parser.parse_args()
+        parser.add_argument(
+            "--cache-dir",
+            help="keep a copy of each encoded MP3 in this directory, and reuse "
+            "it instead of encoding the same WAV with the same settings again",
+        )
+        parser.add_argument(
+            "--cache-size",
+            type=float,
+            default=10,
+            help="size limit for --cache-dir in GiB; the least recently used "
+            "MP3s are deleted past it (default: 10)",
+        )
+        parser.add_argument(
+            "--fresh",
+            default=False,
+            action="store_true",
+            help="ignore the state saved by previous runs and redo everything.",
+        )
+        parser.add_argument(
+            "--profile-report",
+            metavar="PATH",
+            default=None,
+            help="write how long each stage took, how much it read and wrote, "
+            "and the peak memory use to this file, as JSON",
+        )
+        parser.add_argument(
+            "--profile-format",
+            choices=["json", "chrome"],
+            default="json",
+            help="format for --profile-report: a plain JSON report, or a "
+            "Chrome trace for chrome://tracing or Perfetto (default: json)",
+        )
+        args = parser.parse_args(argv)
         errors = []
         if not os.path.exists(args.config):
             errors.append("Configuration file ({}) does not exist".format(args.config))
-        if not os.path.exists(args.wav):
-            errors.append("Source WAV file ({}) does not exist".format(args.wav))
-        if args.markers is not None and not os.path.exists(args.markers):
-            errors.append("Markers file ({}) does not exist".format(args.markers))
+        for wav in [args.wav] + [wav for wav, markers in args.parts]:
+            if not os.path.exists(wav):
+                errors.append("Source WAV file ({}) does not exist".format(wav))
+        for markers in [args.markers] + [markers for wav, markers in args.parts]:
+            if markers not in [None, "-"] and not os.path.exists(markers):
+                errors.append("Markers file ({}) does not exist".format(markers))
+        try:
+            Controller.source_date(args.source_date)
+        except PostShowError as e:
+            errors.append(str(e))
         try:
             os.mkdir(args.outdir)
         except FileExistsError:
@@ -1192,20 +5727,130 @@ class Main:
             errors.append(str(e))
         if len(errors) > 0:
             raise PostShowError(";\n".join(errors))
+        # Check the audio now, rather than after the user has typed in the
+        # metadata. Markers past its end are dropped (and listed) later, by
+        # MCS.validate.
+        if not args.no_encode:
+            with WAVFile(args.wav) as first:
+                for path in [args.wav] + [part for part, markers in args.parts]:
+                    with WAVFile(path) as wav:
+                        errors.extend(wav.problems())
+                        if not wav.same_format(first):
+                            errors.append(
+                                "{} has a different sample format from {}".format(
+                                    path, args.wav
+                                )
+                            )
+        if len(errors) > 0:
+            raise PostShowError(";\n".join(errors))
         return args
 
     @staticmethod
     def check_config(path: str) -> configparser.ConfigParser:
-        """Load the config file and check it for correctness."""
+        """Load the config file and check it for correctness.
+
+        Profiles can build on another with ``inherits = <profile>``, and only
+        set the keys that differ. The checked file, with inheritance resolved,
+        is cached (see ``CONFIG_CACHE_DIR``) until the file changes, so it
+        only has to be checked once. Paths are expanded after loading it.
+        """
+        stat = HashMemo.stat(path)
+        cache_path = os.path.join(
+            os.path.expanduser(CONFIG_CACHE_DIR),
+            hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+            + ".json",
+        )
+        try:
+            with open(cache_path, "r", encoding="utf-8") as fp:
+                cached = json.load(fp)
+        except (OSError, ValueError):
+            cached = {}
+        if (
+            stat is not None
+            and cached.get("version") == CONFIG_CACHE_VERSION
+            and cached.get("stat") == stat
+        ):
+            sections = cached["sections"]
+        else:
+            sections = Main.compile_config(path)
+            if stat is not None:
+                try:
+                    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                    with atomic_write(cache_path, encoding="utf-8") as fp:
+                        json.dump(
+                            {
+                                "version": CONFIG_CACHE_VERSION,
+                                "stat": stat,
+                                "sections": sections,
+                            },
+                            fp,
+                        )
+                except OSError:
+                    # Nowhere to cache it; it'll just be checked every time
+                    pass
         config = configparser.ConfigParser()
-        config.read(path)
+        config.read_dict(sections)
+        # Expanded here rather than cached, in case the environment changes
+        for section in config.sections():
+            for key in PATH_KEYS:
+                if key in config[section]:
+                    config[section][key] = os.path.expanduser(
+                        os.path.expandvars(config[section][key])
+                    )
+        return config
+
+    @staticmethod
+    def compile_config(path: str) -> dict:
+        """Read the config file, resolve inheritance, and check every profile.
+
+        :return: {profile: {key: raw value}}, with DEFAULT and inherited keys
+        filled in.
+        """
+        # Keep DEFAULT as an ordinary section, so each profile's own keys can
+        # be told apart from the defaults
+        parser = configparser.ConfigParser(default_section="\0")
+        parser.read(path)
+        defaults = {}
+        if parser.has_section("DEFAULT"):
+            defaults = {
+                key: parser["DEFAULT"].get(key, raw=True) for key in parser["DEFAULT"]
+            }
+        sections = {}
         errors = []
+
+        def resolve(name: str, chain: list) -> dict:
+            if name in sections:
+                return sections[name]
+            values = dict(defaults)
+            parent = parser[name].get("inherits", raw=True)
+            if parent is not None:
+                if parent in chain + [name]:
+                    errors.append(
+                        "[{}] inherits from itself (through {})".format(
+                            name, " -> ".join(chain + [name, parent])
+                        )
+                    )
+                elif parent == "DEFAULT" or not parser.has_section(parent):
+                    errors.append(
+                        '[{}] inherits from "{}", which does not exist'.format(
+                            name, parent
+                        )
+                    )
+                else:
+                    values.update(resolve(parent, chain + [name]))
+            values.update(
+                (key, parser[name].get(key, raw=True)) for key in parser[name]
+            )
+            values.pop("inherits", None)
+            sections[name] = values
+            return values
+
+        for section in parser.sections():
+            if section != "DEFAULT":
+                resolve(section, [])
         # Check every section of the config file, except for DEFAULT (which we
         # don't care about)
-        for section in config:
-            if section == "DEFAULT":
-                continue
-            so = config[section]
+        for section, so in sections.items():
             # Just verify that the REQUIRED_TEXT_KEYS from above exist in the
             # file.  If they're just empty strings, that's the user's problem.
             for key in REQUIRED_TEXT_KEYS:
@@ -1229,17 +5874,48 @@ class Main:
                             'values ("True" or "False") for the key '
                             '"{key}"'.format(section=section, key=key)
                         )
-            if "cover_art" in so.keys():
-                so["cover_art"] = os.path.expandvars(so["cover_art"])
+            for key in NUMERIC_KEYS:
+                if key not in so.keys():
+                    continue
+                try:
+                    float(so[key])
+                except ValueError:
+                    errors.append(
+                        '[{section}] must use a number for the key "{key}"'.format(
+                            section=section, key=key
+                        )
+                    )
+            for value in so.get("waveform_resolutions", "").split(","):
+                if value.strip() and not (value.strip().isdigit() and int(value) > 0):
+                    errors.append(
+                        '[{section}] "waveform_resolutions" must be a list of '
+                        "whole numbers, like 256, 4096".format(section=section)
+                    )
+                    break
+            for fmt in so.get("formats", "mp3").split(","):
+                if fmt.strip() not in ["mp3"] + list(Controller.RENDITIONS):
+                    errors.append(
+                        '[{section}] "formats" can only include mp3, opus and '
+                        "aac".format(section=section)
+                    )
+            if so.get("encoder", "lame") not in ENCODER_BACKENDS:
+                errors.append(
+                    '[{section}] "encoder" must be one of: {names}'.format(
+                        section=section, names=", ".join(ENCODER_BACKENDS)
+                    )
+                )
         if len(errors) > 0:
             raise PostShowError(";\n".join(errors))
-        return config
+        return sections
 
     def main(self):
         """Kickstart the application."""
         c = Controller(self.args, self.config)
-        c.start()
-        c.loop.run()
+        try:
+            c.start()
+            c.loop.run()
+        finally:
+            c.save_profile_report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Search and retag published episodes through the catalog.
+
+The catalog is an SQLite index of the metadata and chapters in each MP3's
+tags. PostShowV2.py adds every episode it tags (set "catalog" in the
+profile), and "scan" adds existing files, rereading only the ones that
+changed since the last scan.
+"""
+
+from PostShowV2 import Catalog, PostShowError
+import argparse
+import json
+import sys
+
+
+def parse_pairs(pairs: list) -> dict:
+    """Turn ["key=value", ...] into a dict."""
+    result = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise PostShowError('"{}" should look like key=value'.format(pair))
+        result[key.strip()] = value
+    return result
+
+
+def print_rows(rows: list, as_json: bool) -> None:
+    if as_json:
+        json.dump(rows, sys.stdout, indent=2)
+        print()
+        return
+    for row in rows:
+        print(
+            "{path}\n    {title} | {album} | {date} | {chapters} chapters".format(
+                **dict(row, chapters=len(row["chapters"]))
+            )
+        )
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(
+        description="Search and retag published episodes through the catalog."
+    )
+    parser.add_argument("catalog", help="the catalog database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    scan = commands.add_parser(
+        "scan", help="add or update the MP3s in some directories"
+    )
+    scan.add_argument("paths", nargs="+", help="directories or MP3s to scan")
+    find = commands.add_parser("find", help="list the episodes matching filters")
+    retag = commands.add_parser(
+        "retag", help="change tags on the episodes matching filters"
+    )
+    for command in [find, retag]:
+        command.add_argument(
+            "-w",
+            "--where",
+            action="append",
+            default=[],
+            metavar="COLUMN=VALUE",
+            help="only episodes where COLUMN is VALUE. Use %% as a wildcard. "
+            "Columns: " + ", ".join(Catalog.COLUMNS),
+        )
+    find.add_argument(
+        "--json", action="store_true", help="print the rows and chapters as JSON"
+    )
+    retag.add_argument(
+        "-s",
+        "--set",
+        action="append",
+        default=[],
+        metavar="TAG=VALUE",
+        help="the new value of a tag. Tags: " + ", ".join(Catalog.FRAMES),
+    )
+    retag.add_argument("--cover-art", help="replace the cover art with this image")
+    retag.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="list the episodes that would be retagged, and stop",
+    )
+    args = parser.parse_args(argv[1:])
+
+    with Catalog(args.catalog) as catalog:
+        if args.command == "scan":
+            counts = catalog.scan(args.paths)
+            print(
+                "{added} added, {updated} updated, {unchanged} unchanged, "
+                "{removed} removed".format(**counts)
+            )
+            return
+        rows = catalog.find(**parse_pairs(args.where))
+        for row in rows:
+            row["chapters"] = [
+                {"start": c.start, "end": c.end, "text": c.text, "url": c.url}
+                for c in catalog.chapters(row["path"])
+            ]
+        if args.command == "find":
+            print_rows(rows, args.json)
+            return
+        changes = parse_pairs(args.set)
+        if not changes and args.cover_art is None:
+            parser.error("retag needs --set or --cover-art")
+        if not args.where:
+            parser.error("retag needs --where, so it can't touch every episode")
+        if args.dry_run:
+            print_rows(rows, False)
+            return
+        catalog.retag(rows, changes, args.cover_art)
+        print("Retagged {} episodes.".format(len(rows)))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
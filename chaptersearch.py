@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Find the episodes and times where a chapter mentions something.
+
+"update" indexes the chapters in every episode's sidecars (JSON, LRC, CUE or
+TXT) or MP3 tag under some directories, skipping episodes that haven't
+changed since the last update. "search" prints each matching chapter with its
+episode and start time in milliseconds, ready to use in a deep link.
+"""
+
+from PostShowV2 import ChapterIndex, MCS
+import argparse
+import json
+import sys
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(
+        description="Find the episodes and times where a chapter mentions something."
+    )
+    parser.add_argument("index", help="the chapter index database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    update = commands.add_parser(
+        "update", help="index the episodes in some directories that changed"
+    )
+    update.add_argument("paths", nargs="+", help="directories or files to index")
+    search = commands.add_parser("search", help="search the chapters")
+    search.add_argument("query", nargs="+", help="words to look for")
+    search.add_argument(
+        "--raw",
+        action="store_true",
+        help='treat the query as SQLite FTS5 syntax, like: "two words" OR prefix*',
+    )
+    search.add_argument(
+        "-l", "--limit", type=int, default=20, help="most results to show"
+    )
+    search.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args(argv[1:])
+
+    with ChapterIndex(args.index) as index:
+        if args.command == "update":
+            counts = index.update(args.paths)
+            print(
+                "{indexed} indexed, {unchanged} unchanged, "
+                "{removed} removed".format(**counts)
+            )
+            return
+        results = index.search(" ".join(args.query), args.limit, args.raw)
+        if args.json:
+            json.dump(results, sys.stdout, indent=2)
+            print()
+            return
+        for result in results:
+            print(
+                "{episode}\t{start_ms}\t{clock}\t{text}{url}".format(
+                    **dict(
+                        result,
+                        clock=MCS.clock(result["start_ms"]),
+                        url="" if result["url"] is None else "\t" + result["url"],
+                    )
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Build chapter sidecars while the show is still running.
+
+Follow a growing Audacity label file, LRC file, or now-playing file, and
+append each new chapter to the LRC, CUE, TXT and JSON sidecars that
+PostShowV2.py would otherwise write after the show. Afterwards, pass the JSON
+sidecar to PostShowV2.py with -m so there's nothing left to convert.
+"""
+
+from PostShowV2 import (
+    MCS,
+    Main,
+    Profile,
+    Controller,
+    EpisodeMetadata,
+    MarkerFollower,
+)
+import argparse
+import signal
+import time
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build chapter sidecars from a marker file as it grows."
+    )
+    parser.add_argument(
+        "markers",
+        help="the marker file to follow. Audacity labels (.txt) and LRC (.lrc) "
+        "are read line by line; anything else is treated as a now-playing "
+        "file holding the current segment name.",
+    )
+    parser.add_argument("outdir", help="directory in which to write sidecars")
+    parser.add_argument("number", help="the episode number")
+    parser.add_argument("name", help="the episode name")
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="configuration file to use, defaults to $HOME/.config/postshow.ini",
+        default=os.path.expandvars("$HOME/.config/postshow.ini"),
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        default="default",
+        help="the configuration profile on which to base default values",
+    )
+    parser.add_argument(
+        "--now-playing",
+        default=False,
+        action="store_true",
+        help="treat the marker file as a now-playing file, whatever its extension",
+    )
+    parser.add_argument(
+        "--poll",
+        default=False,
+        action="store_true",
+        help="check the marker file periodically instead of using inotify",
+    )
+    parser.add_argument(
+        "--interval",
+        default=3.0,
+        type=float,
+        help="seconds between checks when polling (default: 3)",
+    )
+    origin = parser.add_mutually_exclusive_group()
+    origin.add_argument(
+        "--origin",
+        type=float,
+        help="for now-playing files, the Unix time at which the recording "
+        "started. Chapter times count from here. Defaults to now",
+    )
+    origin.add_argument(
+        "--offset",
+        type=float,
+        help="for now-playing files, how many seconds ago the recording "
+        "started. An alternative to --origin",
+    )
+    args = parser.parse_args()
+    if args.offset is not None:
+        args.origin = time.time() - args.offset
+
+    profile = Profile(Main.check_config(args.config), args.profile)
+    metadata = EpisodeMetadata(args.number, args.name)
+    Controller.fill_metadata(metadata, profile)
+    os.makedirs(args.outdir, exist_ok=True)
+
+    def output_path(ext: str) -> str:
+        return os.path.join(args.outdir, profile.output_name(args.number, ext))
+
+    mcs = MCS(metadata=metadata, media_filename=output_path("mp3"))
+    mcs.begin_live(
+        {
+            MCS.LRC: output_path("lrc"),
+            MCS.CUE: output_path("cue"),
+            MCS.SIMPLE: output_path("txt"),
+            MCS.JSON: output_path("json"),
+        }
+    )
+    follower = MarkerFollower(
+        args.markers,
+        mcs,
+        kind=MarkerFollower.NOW_PLAYING if args.now_playing else None,
+        origin=args.origin,
+        interval=args.interval,
+        use_inotify=not args.poll,
+    )
+
+    def stop_handler(sig, frame):
+        follower.request_stop()
+
+    signal.signal(signal.SIGINT, stop_handler)
+    signal.signal(signal.SIGTERM, stop_handler)
+    follower.start()
+    print("Following {}; press Ctrl-C when the show is over.".format(args.markers))
+    while follower.is_alive():
+        time.sleep(0.5)
+    mcs.end_live()
+    print("Wrote {} chapters.".format(len(mcs.get())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""Benchmark marker conversion, tagging and the whole PostShowV2 pipeline.
+
+Everything is run on synthetic inputs made in a temporary directory:
+WAVs of the given lengths, and Audacity and LRC marker files with the
+given numbers of markers. Each case is run --repeat times and the fastest
+time is kept.
+
+Save the results with --output, and compare a later run against them with
+--baseline; any case more than --threshold slower than the baseline is
+reported, and the exit status is 1.
+
+    python benchmark.py --output before.json
+    python benchmark.py --baseline before.json --threshold 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import struct
+import platform
+import datetime
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import PostShowV2  # noqa: E402
+
+RATE = 44100
+LENGTHS = {"1m": 60, "10m": 600, "1h": 3600, "3h": 3 * 3600}
+SAVE_TYPES = {
+    "lrc": PostShowV2.MCS.LRC,
+    "cue": PostShowV2.MCS.CUE,
+    "txt": PostShowV2.MCS.SIMPLE,
+    "ffmetadata": PostShowV2.MCS.FFMETADATA1,
+    "json": PostShowV2.MCS.JSON,
+}
+CONFIG = """[bench]
+slug = BENCH
+filename = {slug}-{epnum}.{ext}
+bitrate = 128
+encoder = %s
+title = {slug}-{epnum} {name}
+album = Benchmark
+artist = Benchmark
+season = 1
+genre = Podcast
+language = eng
+write_date = True
+write_trackno = True
+lyrics_equals_comment = True
+"""
+
+
+def best_of(repeat: int, function) -> float:
+    """Run ``function`` ``repeat`` times, and return the fastest time."""
+    times = []
+    for i in range(repeat):
+        began = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - began)
+    return round(min(times), 6)
+
+
+def write_wav(path: str, seconds: int) -> None:
+    """Write 16-bit stereo noise, a second at a time."""
+    second = bytes(random.getrandbits(8) for i in range(RATE * 4))
+    size = seconds * len(second)
+    with open(path, "wb") as fp:
+        fp.write(b"RIFF" + struct.pack("<I", 36 + size) + b"WAVE")
+        fp.write(b"fmt " + struct.pack("<IHHIIHH", 16, 1, 2, RATE, RATE * 4, 4, 16))
+        fp.write(b"data" + struct.pack("<I", size))
+        for i in range(seconds):
+            fp.write(second)
+
+
+def write_markers(directory: str, count: int, seconds: int) -> dict:
+    """Write Audacity and LRC files with ``count`` markers over ``seconds``."""
+    step = seconds * 1000 / count
+    starts = [int(i * step) for i in range(count)]
+    paths = {
+        "txt": os.path.join(directory, "markers-{}.txt".format(count)),
+        "lrc": os.path.join(directory, "markers-{}.lrc".format(count)),
+    }
+    with open(paths["txt"], "w") as fp:
+        for i, start in enumerate(starts):
+            fp.write(
+                "{0:.3f}\t{0:.3f}\tMarker {1}|https://example.com/{1}\n".format(
+                    start / 1000, i
+                )
+            )
+    with open(paths["lrc"], "w") as fp:
+        for i, start in enumerate(starts):
+            fp.write(
+                "[{:02d}:{:05.2f}]Marker {}\n".format(
+                    start // 60000, (start % 60000) / 1000, i
+                )
+            )
+    return paths
+
+
+def bench_markers(directory: str, counts: list, repeat: int) -> dict:
+    results = {}
+    for count in counts:
+        paths = write_markers(directory, count, 3 * 3600)
+        for kind, path in paths.items():
+            results["mcs.load.{}.{}".format(kind, count)] = best_of(
+                repeat, lambda: PostShowV2.MCS().load(path)
+            )
+        mcs = PostShowV2.MCS(
+            metadata=PostShowV2.EpisodeMetadata("1", "Benchmark"),
+            media_filename="bench.mp3",
+        )
+        mcs.metadata.title = mcs.metadata.artist = mcs.metadata.album = "Benchmark"
+        mcs.load(paths["txt"])
+        for kind, type in SAVE_TYPES.items():
+            out = os.path.join(directory, "out." + kind)
+            results["mcs.save.{}.{}".format(kind, count)] = best_of(
+                repeat, lambda: mcs.save(out, type)
+            )
+    return results
+
+
+def encoder_name():
+    """The first encoder backend that's installed, or None."""
+    for name, backend in PostShowV2.ENCODER_BACKENDS.items():
+        if backend.available():
+            return name
+    return None
+
+
+def bench_tagger(directory: str, wav: str, encoder: str, repeat: int) -> dict:
+    """Time opening and saving an MP3's tags, with and without cover art."""
+    mp3 = os.path.join(directory, "tagged.mp3")
+    enc = PostShowV2.MP3Encoder()
+    enc.setup(wav, mp3, "128", encoder)
+    enc.start()
+    enc.join()
+    if not enc.succeeded():
+        raise SystemExit(enc.failure())
+    cover = os.path.join(directory, "cover.jpg")
+    with open(cover, "wb") as fp:
+        fp.write(bytes(random.getrandbits(8) for i in range(300 * 1024)))
+    mcs = PostShowV2.MCS()
+    mcs.load(write_markers(directory, 100, 60)["txt"])
+    chapters = mcs.get()
+
+    def tag(with_cover: bool):
+        tagger = PostShowV2.MP3Tagger(mp3)
+        tagger.set_title("Benchmark")
+        tagger.add_chapters(chapters)
+        if with_cover:
+            tagger.set_cover_art(cover)
+        tagger.save()
+
+    return {
+        "tagger.open": best_of(repeat, lambda: PostShowV2.MP3Tagger(mp3)),
+        "tagger.save": best_of(repeat, lambda: tag(False)),
+        "tagger.save.cover": best_of(repeat, lambda: tag(True)),
+    }
+
+
+def bench_pipeline(directory: str, wav: str, label: str, encoder: str) -> dict:
+    """Run PostShowV2 headless on a WAV, and break it down by stage."""
+    config = os.path.join(directory, "postshow.ini")
+    with open(config, "w") as fp:
+        fp.write(CONFIG % encoder)
+    markers = write_markers(directory, 100, 60)["txt"]
+    report = os.path.join(directory, "profile.json")
+    outdir = os.path.join(directory, "out-" + label)
+    args = PostShowV2.Main.parse_args(
+        [wav, outdir, "-c", config, "-p", "bench", "-m", markers, "--fresh"]
+        + ["--profile-report", report]
+    )
+    controller = PostShowV2.Controller(args, PostShowV2.Main.check_config(config))
+    began = time.perf_counter()
+    controller.run_headless("1", "Benchmark")
+    results = {"pipeline.{}".format(label): round(time.perf_counter() - began, 6)}
+    for span in controller.profiler.report()["spans"]:
+        key = "pipeline.{}.{}".format(label, span["name"])
+        results[key] = round(results.get(key, 0) + span["duration_ms"] / 1000, 6)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float, noise: float) -> list:
+    """List the cases that got more than ``threshold`` slower.
+
+    Differences smaller than ``noise`` seconds are ignored, since cases that
+    only take a millisecond or so vary by more than any threshold from run
+    to run.
+    """
+    slower = []
+    for name, seconds in sorted(results.items()):
+        before = baseline.get(name)
+        if before and seconds > before * (1 + threshold) + noise:
+            slower.append((name, before, seconds))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--wavs",
+        default="1m",
+        help="comma-separated WAV lengths from {} (default: 1m)".format(
+            ", ".join(LENGTHS)
+        ),
+    )
+    parser.add_argument(
+        "--markers",
+        default="10,1000,100000",
+        help="comma-separated marker counts (default: 10,1000,100000)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="how much slower than the baseline counts as a regression "
+        "(default: 0.2, for 20%%)",
+    )
+    parser.add_argument(
+        "--noise",
+        type=float,
+        default=0.005,
+        help="ignore slowdowns smaller than this many seconds (default: 0.005)",
+    )
+    parser.add_argument("--dir", help="where to make the synthetic files")
+    args = parser.parse_args()
+    random.seed(0)
+    results = {}
+    encoder = encoder_name()
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        results.update(
+            bench_markers(
+                directory, [int(c) for c in args.markers.split(",")], args.repeat
+            )
+        )
+        if encoder is None:
+            print("No encoder is installed; skipping tagging and the pipeline.")
+        else:
+            wavs = {}
+            for label in args.wavs.split(","):
+                wavs[label] = os.path.join(directory, label + ".wav")
+                write_wav(wavs[label], LENGTHS[label])
+            first = next(iter(wavs.values()))
+            results.update(bench_tagger(directory, first, encoder, args.repeat))
+            for label, wav in wavs.items():
+                results.update(bench_pipeline(directory, wav, label, encoder))
+    for name, seconds in sorted(results.items()):
+        print("{:<50} {:10.4f}s".format(name, seconds))
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(
+                {
+                    "version": 1,
+                    "created": datetime.datetime.now().isoformat(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "encoder": encoder
+                    and PostShowV2.ENCODER_BACKENDS[encoder].version(),
+                    "results": results,
+                },
+                fp,
+                indent=2,
+                sort_keys=True,
+            )
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)["results"]
+        slower = compare(results, baseline, args.threshold, args.noise)
+        for name, before, after in slower:
+            print(
+                "SLOWER {}: {:.4f}s -> {:.4f}s (+{:.0%})".format(
+                    name, before, after, after / before - 1
+                )
+            )
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Time each installed encoder backend on synthetic WAVs.
+
+Short clips show how much of the time goes on starting the encoder, and
+long ones show its throughput. Prints a table, and writes the results as
+JSON with --json.
+"""
+
+import os
+import sys
+import json
+import time
+import math
+import struct
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import PostShowV2  # noqa: E402
+
+RATE = 44100
+
+
+def write_wav(path: str, seconds: float) -> None:
+    """Write a 16-bit stereo WAV of a quiet chirp, with a little noise."""
+    frames = int(seconds * RATE)
+    data = bytearray(frames * 4)
+    state = 1
+    for i in range(frames):
+        t = i / RATE
+        tone = 0.3 * math.sin(2 * math.pi * (220 + 40 * (t % 5)) * t)
+        state = (state * 1103515245 + 12345) & 0x7FFFFFFF
+        noise = (state / 0x7FFFFFFF - 0.5) * 0.02
+        sample = int((tone + noise) * 32767)
+        struct.pack_into("<hh", data, i * 4, sample, sample)
+    with open(path, "wb") as fp:
+        fp.write(b"RIFF" + struct.pack("<I", 36 + len(data)) + b"WAVE")
+        fp.write(b"fmt " + struct.pack("<IHHIIHH", 16, 1, 2, RATE, RATE * 4, 4, 16))
+        fp.write(b"data" + struct.pack("<I", len(data)))
+        fp.write(data)
+
+
+def run(backend: str, fmt: str, wav: str, out: str, bitrate: str) -> dict:
+    encoder = PostShowV2.MP3Encoder()
+    encoder.setup(wav, out, bitrate, backend, fmt)
+    began = time.monotonic()
+    encoder.start()
+    encoder.join()
+    elapsed = time.monotonic() - began
+    if not encoder.succeeded():
+        return {"error": encoder.failure()}
+    progress = encoder.progress()
+    audio_seconds = encoder.audio_ms / 1000
+    return {
+        "seconds": round(elapsed, 4),
+        "realtime": round(audio_seconds / elapsed, 1),
+        "mb_per_second": round(progress["bytes_total"] / elapsed / 1024**2, 1),
+        "output_bytes": os.path.getsize(out),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--durations",
+        default="5,30,300",
+        help="comma-separated clip lengths in seconds (default: 5,30,300)",
+    )
+    parser.add_argument("--bitrate", default="128")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+    backends = [
+        backend
+        for backend in PostShowV2.ENCODER_BACKENDS.values()
+        if backend.available()
+    ]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for seconds in [float(d) for d in args.durations.split(",")]:
+            wav = os.path.join(directory, "{:g}.wav".format(seconds))
+            write_wav(wav, seconds)
+            for backend in backends:
+                for fmt in backend.FORMATS:
+                    out = os.path.join(directory, "out." + fmt)
+                    runs = [
+                        run(backend.name, fmt, wav, out, args.bitrate)
+                        for i in range(args.repeat)
+                    ]
+                    if any("error" in r for r in runs):
+                        result = next(r for r in runs if "error" in r)
+                    else:
+                        # The fastest run is the least disturbed by anything
+                        # else on the machine.
+                        result = min(runs, key=lambda r: r["seconds"])
+                    result.update(
+                        {
+                            "backend": backend.name,
+                            "version": backend.version(),
+                            "format": fmt,
+                            "audio_seconds": seconds,
+                        }
+                    )
+                    results.append(result)
+                    print(
+                        "{backend:>8} {format:>5} {audio_seconds:>7g}s  ".format(
+                            **result
+                        )
+                        + (
+                            result["error"]
+                            if "error" in result
+                            else "{seconds:8.3f}s {realtime:7.1f}x realtime".format(
+                                **result
+                            )
+                        )
+                    )
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
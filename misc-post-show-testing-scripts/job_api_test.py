@@ -0,0 +1,123 @@
+"""Check postshowd.py's HTTP job API with a local client.
+
+Starts the API on a free port in this process, submits a job for a
+synthetic WAV, follows its progress over server-sent events until it's done,
+and checks the MP3 it made. Nothing outside this machine is needed, apart
+from one of the encoders.
+"""
+
+import os
+import sys
+import json
+import math
+import struct
+import tempfile
+import argparse
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import PostShowV2  # noqa: E402
+import postshowd  # noqa: E402
+
+RATE = 44100
+CONFIG = """[test]
+slug = TEST
+filename = {slug}-{epnum}.{ext}
+bitrate = 128
+encoder = %s
+title = {slug}-{epnum} {name}
+album = Test
+artist = Test
+season = 1
+genre = Podcast
+language = eng
+write_date = False
+write_trackno = True
+lyrics_equals_comment = True
+"""
+
+
+def write_wav(path: str, seconds: int) -> None:
+    """Write a 16-bit stereo sine wave."""
+    frames = seconds * RATE
+    data = bytearray(frames * 4)
+    for i in range(frames):
+        sample = int(0.3 * 32767 * math.sin(2 * math.pi * 440 * i / RATE))
+        struct.pack_into("<hh", data, i * 4, sample, sample)
+    with open(path, "wb") as fp:
+        fp.write(b"RIFF" + struct.pack("<I", 36 + len(data)) + b"WAVE")
+        fp.write(b"fmt " + struct.pack("<IHHIIHH", 16, 1, 2, RATE, RATE * 4, 4, 16))
+        fp.write(b"data" + struct.pack("<I", len(data)))
+        fp.write(data)
+
+
+def request(base: str, method: str, path: str, body=None):
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    req = urllib.request.Request(base + path, data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def events(base: str, job_id: str):
+    """Yield the progress events for a job, as they arrive."""
+    with urllib.request.urlopen(base + "/jobs/{}/events".format(job_id)) as stream:
+        event = None
+        for line in stream:
+            line = line.decode("utf-8").rstrip("\n")
+            if line.startswith("event: "):
+                event = line[len("event: ") :]
+            elif line.startswith("data: ") and event == "progress":
+                yield json.loads(line[len("data: ") :])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--seconds", type=int, default=60, help="WAV length")
+    args = parser.parse_args()
+    encoder = next(
+        (n for n, b in PostShowV2.ENCODER_BACKENDS.items() if b.available()), None
+    )
+    if encoder is None:
+        raise SystemExit("No encoder is installed.")
+    with tempfile.TemporaryDirectory() as directory:
+        wav = os.path.join(directory, "show.wav")
+        write_wav(wav, args.seconds)
+        config = os.path.join(directory, "postshow.ini")
+        with open(config, "w") as fp:
+            fp.write(CONFIG % encoder)
+        outdir = os.path.join(directory, "out")
+        os.mkdir(outdir)
+        queue = PostShowV2.JobQueue(os.path.join(directory, "queue.json"), config)
+        server = postshowd.serve("127.0.0.1:0", queue, outdir, "test")
+        base = "http://127.0.0.1:{}".format(server.server_address[1])
+        try:
+            status, body = request(base, "POST", "/jobs", {"number": "1"})
+            assert status == 400, (status, body)
+            status, job = request(
+                base, "POST", "/jobs", {"wav": wav, "number": 1, "name": "API"}
+            )
+            assert status == 201, (status, job)
+            seen = []
+            for progress in events(base, job["id"]):
+                print("{state:>8} {percent:3d}%".format(**progress))
+                seen.append(progress)
+            assert seen[-1]["state"] == "done", seen[-1]
+            status, job = request(base, "GET", "/jobs/" + job["id"])
+            assert status == 200 and job["progress"]["percent"] == 100, job
+            status, jobs = request(base, "GET", "/jobs")
+            assert [j["id"] for j in jobs] == [job["id"]]
+            tagger = PostShowV2.MP3Tagger(os.path.join(outdir, "test-1.mp3"))
+            assert str(tagger.tag["TIT2"]) == "TEST-1 API"
+        finally:
+            server.shutdown()
+            queue.shutdown()
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
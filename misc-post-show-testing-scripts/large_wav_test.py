@@ -0,0 +1,156 @@
+"""Check that PostShowV2 copes with recordings over 4 GB.
+
+Writes sparse RF64, Wave64 and (overflowed) plain RIFF files of about 5 GB
+each, so they take up almost no disk space, then checks the parsed sizes
+and the sidecar timestamps for chapters near the end of a 24-hour show.
+
+Pass --encode to also pipe one of them through LAME, which reads all 5 GB.
+"""
+
+import os
+import sys
+import time
+import struct
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import PostShowV2  # noqa: E402
+
+RATE = 48000
+CHANNELS = 2
+BITS = 16
+ALIGN = CHANNELS * BITS // 8
+# A little over 4 GiB of audio, so every 32-bit size overflows
+FRAMES = (5 * 1024**3) // ALIGN
+DATA_SIZE = FRAMES * ALIGN
+FMT = struct.pack("<HHIIHH", 1, CHANNELS, RATE, RATE * ALIGN, ALIGN, BITS)
+
+
+def sparse(path: str, header: bytes) -> None:
+    with open(path, "wb") as fp:
+        fp.write(header)
+        fp.truncate(len(header) + DATA_SIZE)
+
+
+def write_rf64(path: str) -> None:
+    ds64 = b"ds64" + struct.pack("<IQQQI", 28, 0, DATA_SIZE, FRAMES, 0)
+    header = (
+        b"RF64"
+        + struct.pack("<I", 0xFFFFFFFF)
+        + b"WAVE"
+        + ds64
+        + b"fmt "
+        + struct.pack("<I", len(FMT))
+        + FMT
+        + b"data"
+        + struct.pack("<I", 0xFFFFFFFF)
+    )
+    sparse(path, header)
+
+
+def write_w64(path: str) -> None:
+    suffix = PostShowV2.WAVFile.W64_SUFFIX
+    header = (
+        PostShowV2.WAVFile.W64_RIFF
+        + struct.pack("<Q", 0)
+        + PostShowV2.WAVFile.W64_WAVE
+        + b"fmt "
+        + suffix
+        + struct.pack("<Q", 24 + len(FMT))
+        + FMT
+        + b"data"
+        + suffix
+        + struct.pack("<Q", 24 + DATA_SIZE)
+    )
+    sparse(path, header)
+
+
+def write_wrapped_riff(path: str) -> None:
+    header = (
+        b"RIFF"
+        + struct.pack("<I", (36 + DATA_SIZE) & 0xFFFFFFFF)
+        + b"WAVE"
+        + b"fmt "
+        + struct.pack("<I", len(FMT))
+        + FMT
+        + b"data"
+        + struct.pack("<I", DATA_SIZE & 0xFFFFFFFF)
+    )
+    sparse(path, header)
+
+
+def check_wav(path: str) -> None:
+    with PostShowV2.WAVFile(path) as wav:
+        assert wav.problems() == [], wav.problems()
+        assert wav.data_size == DATA_SIZE, (wav.data_size, DATA_SIZE)
+        assert wav.frames == FRAMES
+        assert wav.duration_ms == FRAMES * 1000 // RATE
+        print("{:>8}  {}".format(wav.container, wav.describe()))
+
+
+def check_sidecars(directory: str) -> None:
+    day = 24 * 60 * 60 * 1000
+    mcs = PostShowV2.MCS(media_filename="long.mp3")
+    mcs.chapters = [
+        PostShowV2.Chapter(0, 100 * 60 * 1000, text="Start"),
+        PostShowV2.Chapter(100 * 60 * 1000, day - 1000, text="Minute 100"),
+        PostShowV2.Chapter(day - 1000, day, text="Last second"),
+        PostShowV2.Chapter(day, day + 60 * 60 * 1000, text="Overrun"),
+        PostShowV2.Chapter(day + 60 * 60 * 1000, day + 61 * 60 * 1000, text="Hour 25"),
+    ]
+    mcs._canonicalize()
+    lrc = os.path.join(directory, "long.lrc")
+    cue = os.path.join(directory, "long.cue")
+    txt = os.path.join(directory, "long.txt")
+    mcs.save(lrc, PostShowV2.MCS.LRC)
+    mcs.save(cue, PostShowV2.MCS.CUE)
+    mcs.save(txt, PostShowV2.MCS.SIMPLE)
+    with open(cue) as fp:
+        assert "INDEX 01 1439:59:00" in fp.read()
+    with open(txt) as fp:
+        assert "25:00:00 - Hour 25\n" in fp.read()
+    again = PostShowV2.MCS()
+    again.load(lrc)
+    assert [c.start for c in again.get()] == [c.start for c in mcs.chapters]
+    # Past 49 days, CHAP times stop at the largest 32-bit value
+    far = PostShowV2.Chapter(50 * day, 51 * day, text="Far")
+    far.elem_id = "chp0"
+    assert far.as_chap().start_time == 0xFFFFFFFF
+    print("sidecars  ok")
+
+
+def encode(path: str, directory: str) -> None:
+    encoder = PostShowV2.MP3Encoder()
+    encoder.setup(path, os.path.join(directory, "long.mp3"), "64")
+    began = time.monotonic()
+    encoder.start()
+    encoder.join()
+    if not encoder.succeeded():
+        raise SystemExit(encoder.failure())
+    elapsed = time.monotonic() - began
+    print(
+        "encoded   {:.0f} MB/s".format(
+            os.path.getsize(path) / elapsed / 1024**2 if elapsed else 0
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--encode", action="store_true", help="also run LAME")
+    parser.add_argument("--dir", default=None, help="where to write the files")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        writers = [write_rf64, write_w64, write_wrapped_riff]
+        for writer in writers:
+            path = os.path.join(directory, writer.__name__ + ".wav")
+            writer(path)
+            check_wav(path)
+        check_sidecars(directory)
+        if args.encode:
+            encode(os.path.join(directory, "write_rf64.wav"), directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Check that a job run again with different settings encodes again.
+
+Runs a job for a synthetic WAV through a JobQueue, changes the profile's
+bitrate, and runs the same WAV again into the same output directory. The
+second run has to see that the journal's MP3 (and loudness measurement) are
+for the old settings, encode the WAV again, and come out at the new bitrate.
+Nothing outside this machine is needed, apart from one of the encoders.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import mutagen.mp3
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import PostShowV2  # noqa: E402
+from job_api_test import CONFIG, write_wav  # noqa: E402
+
+
+def run_job(directory: str, wav: str, outdir: str, config: str) -> dict:
+    """Run one job to the end, and return it."""
+    queue = PostShowV2.JobQueue(os.path.join(directory, "queue.json"), config)
+    try:
+        job = queue.submit(wav, outdir, "1", "Rerun", "test", None)
+        while queue.get(job["id"])["state"] not in [queue.DONE, queue.FAILED]:
+            time.sleep(0.1)
+        return queue.get(job["id"])
+    finally:
+        queue.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--seconds", type=int, default=30, help="WAV length")
+    args = parser.parse_args()
+    encoder = next(
+        (n for n, b in PostShowV2.ENCODER_BACKENDS.items() if b.available()), None
+    )
+    if encoder is None:
+        raise SystemExit("No encoder is installed.")
+    with tempfile.TemporaryDirectory() as directory:
+        wav = os.path.join(directory, "show.wav")
+        write_wav(wav, args.seconds)
+        config = os.path.join(directory, "postshow.ini")
+        outdir = os.path.join(directory, "out")
+        os.mkdir(outdir)
+        mp3 = os.path.join(outdir, "test-1.mp3")
+        for bitrate in ["128", "64"]:
+            with open(config, "w") as fp:
+                fp.write(
+                    (CONFIG % encoder).replace("bitrate = 128", "bitrate = " + bitrate)
+                )
+            job = run_job(directory, wav, outdir, config)
+            assert job["state"] == "done", job
+            kbps = mutagen.mp3.MP3(mp3).info.bitrate // 1000
+            print("bitrate {}: {} kbps".format(bitrate, kbps))
+            assert kbps == int(bitrate), (bitrate, kbps)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Process recordings as they land in a watched directory.
+
+The recorder drops a WAV (and an Audacity label file with the same name) into
+a directory. Once the WAV is finished, it is queued and run through the same
+encode, chapter and tagging steps as PostShowV2.py, without the UI.
+
+A WAV counts as finished when a manifest appears next to it
+(<name>.manifest.json, holding the episode "number" and "name", and
+optionally "profile", "markers" and the WAV's "size" in bytes), or when its
+size hasn't changed for --settle seconds. Without a manifest, the episode number is the last number in
+the file name, and the name is left empty.
+
+The queue is kept in a file, so anything queued or running when the daemon
+stops is picked up again next time.
+
+With --listen, jobs can also be submitted and followed over HTTP:
+* POST /jobs with a JSON object holding "wav", "number" and "name", and
+  optionally "markers", "profile" and "outdir", queues a job
+* GET /jobs lists every job, and GET /jobs/<id> gets one with its progress
+* GET /jobs/<id>/events streams the job's progress as server-sent events,
+  one "progress" event each time it changes, until it's done or failed
+"""
+
+from PostShowV2 import JobQueue, FileWatcher, HashMemo
+import http.server
+import threading
+import argparse
+import signal
+import json
+import time
+import sys
+import os
+import re
+
+# Marker files looked for next to a WAV, in order of preference
+MARKER_EXTENSIONS = [".txt", ".lrc", ".json"]
+
+
+def log(message: str) -> None:
+    print(time.strftime("%Y-%m-%d %H:%M:%S"), message, flush=True)
+
+
+def read_manifest(wav: str):
+    """Read the manifest for a WAV, or None if there isn't one (yet)."""
+    try:
+        with open(os.path.splitext(wav)[0] + ".manifest.json", encoding="utf-8") as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        # Probably still being written
+        return None
+
+
+def find_markers(wav: str):
+    stem = os.path.splitext(wav)[0]
+    for ext in MARKER_EXTENSIONS:
+        if os.path.exists(stem + ext):
+            return stem + ext
+    return None
+
+
+class Watcher:
+    """Find finished recordings in some directories, and queue them."""
+
+    def __init__(self, args, queue: JobQueue):
+        self.args = args
+        self.queue = queue
+        # WAV path -> (stat, when it was first seen with that stat)
+        self.seen = {}
+
+    def recordings(self):
+        for directory in self.args.dirs:
+            for entry in os.scandir(directory):
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                if entry.name.lower().endswith((".wav", ".w64")):
+                    yield entry.path
+
+    def check(self) -> None:
+        now = time.monotonic()
+        for wav in self.recordings():
+            stat = HashMemo.stat(wav)
+            latest = self.queue.latest(wav)
+            if latest is not None and (
+                latest["stat"] == stat
+                or latest["state"] in [JobQueue.QUEUED, JobQueue.RUNNING]
+            ):
+                # Already done as it is now, or wait until the job for the
+                # old version is over before starting one for the new
+                continue
+            since = self.seen.get(wav)
+            if since is None or since[0] != stat:
+                self.seen[wav] = (stat, now)
+                continue
+            manifest = read_manifest(wav)
+            if manifest is None:
+                if now - since[1] < self.args.settle:
+                    continue
+                manifest = {}
+            elif manifest.get("size", stat[0]) != stat[0]:
+                continue
+            self.seen.pop(wav, None)
+            self.enqueue(wav, manifest)
+
+    def enqueue(self, wav: str, manifest: dict) -> None:
+        number = manifest.get("number")
+        if number is None:
+            numbers = re.findall(r"\d+", os.path.basename(wav))
+            if not numbers:
+                log("Skipping {}: no manifest and no number in its name".format(wav))
+                return
+            number = numbers[-1]
+        markers = manifest.get("markers")
+        if markers is not None:
+            markers = os.path.join(os.path.dirname(wav), markers)
+        else:
+            markers = find_markers(wav)
+        job = self.queue.submit(
+            wav,
+            self.args.outdir,
+            str(number),
+            manifest.get("name", ""),
+            manifest.get("profile", self.args.profile),
+            markers,
+        )
+        log("Queued job {id}: {wav} as episode {number}".format(**job))
+
+
+class JobAPI(http.server.BaseHTTPRequestHandler):
+    """Submit and follow jobs over HTTP. The server holds the ``queue``, and
+    the ``outdir`` and ``profile`` to use when a job doesn't say."""
+
+    def send_json(self, status: int, value, headers=None) -> None:
+        body = json.dumps(value, indent=2).encode("utf-8") + b"\n"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, header in (headers or {}).items():
+            self.send_header(name, header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int, message: str) -> None:
+        self.send_json(status, {"error": message})
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        queue = self.server.queue
+        if parts == ["jobs"]:
+            self.send_json(200, queue.jobs())
+            return
+        if len(parts) not in [2, 3] or parts[0] != "jobs":
+            self.send_error_json(404, "No such endpoint")
+            return
+        job = queue.get(parts[1])
+        if job is None:
+            self.send_error_json(404, "No such job")
+        elif len(parts) == 2:
+            self.send_json(200, dict(job, progress=queue.progress(job["id"])))
+        elif parts[2] == "events":
+            self.stream_events(job["id"])
+        else:
+            self.send_error_json(404, "No such endpoint")
+
+    def stream_events(self, job_id: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            for progress in self.server.queue.watch(job_id):
+                if progress is None:
+                    self.wfile.write(b": keepalive\n\n")
+                else:
+                    self.wfile.write(
+                        "event: progress\ndata: {}\n\n".format(
+                            json.dumps(progress)
+                        ).encode("utf-8")
+                    )
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away
+            pass
+
+    def do_POST(self):
+        if self.path.split("?")[0].strip("/") != "jobs":
+            self.send_error_json(404, "No such endpoint")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            self.send_error_json(400, "The body must be a JSON object")
+            return
+        if not isinstance(request, dict):
+            self.send_error_json(400, "The body must be a JSON object")
+            return
+        missing = [key for key in ["wav", "number", "name"] if key not in request]
+        if missing:
+            self.send_error_json(400, "Missing " + ", ".join(missing))
+            return
+        for key in ["wav", "markers"]:
+            if request.get(key) is not None and not os.path.isfile(request[key]):
+                self.send_error_json(400, "{} does not exist".format(request[key]))
+                return
+        job = self.server.queue.submit(
+            request["wav"],
+            request.get("outdir", self.server.outdir),
+            str(request["number"]),
+            str(request["name"]),
+            request.get("profile", self.server.profile),
+            request.get("markers"),
+        )
+        log("Queued job {id}: {wav} as episode {number}".format(**job))
+        self.send_json(201, job, {"Location": "/jobs/" + job["id"]})
+
+    def log_message(self, format, *args):
+        log("{} {}".format(self.address_string(), format % args))
+
+
+def serve(address: str, queue: JobQueue, outdir: str, profile: str):
+    """Start the job API on another thread. Returns the server."""
+    host, sep, port = address.rpartition(":")
+    server = http.server.ThreadingHTTPServer((host or "127.0.0.1", int(port)), JobAPI)
+    # Streams still open when the daemon stops shouldn't hold it up
+    server.daemon_threads = True
+    server.queue = queue
+    server.outdir = outdir
+    server.profile = profile
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(
+        description="Process recordings as they land in a watched directory."
+    )
+    parser.add_argument("dirs", nargs="*", help="directories to watch")
+    parser.add_argument(
+        "-o", "--outdir", required=True, help="directory to write output files to"
+    )
+    parser.add_argument(
+        "--listen",
+        metavar="[HOST:]PORT",
+        help="also take jobs over HTTP on this port (on 127.0.0.1 unless a "
+        "host is given)",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="configuration file to use, defaults to $HOME/.config/postshow.ini",
+        default=os.path.expandvars("$HOME/.config/postshow.ini"),
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        default="default",
+        help="the profile to use when a recording's manifest doesn't name one",
+    )
+    parser.add_argument(
+        "-q",
+        "--queue",
+        help="file to keep the job queue in (default: .postshowd-queue.json in "
+        "the output directory)",
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, default=2, help="jobs to run at once (default: 2)"
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=30,
+        help="seconds a WAV without a manifest has to stay the same size before "
+        "it's processed (default: 30)",
+    )
+    parser.add_argument(
+        "--poll",
+        default=False,
+        action="store_true",
+        help="check the directories periodically instead of using inotify",
+    )
+    parser.add_argument(
+        "--interval",
+        default=3.0,
+        type=float,
+        help="seconds between checks when polling (default: 3)",
+    )
+    args = parser.parse_args(argv[1:])
+    if not args.dirs and args.listen is None:
+        parser.error("give some directories to watch, or --listen, or both")
+    os.makedirs(args.outdir, exist_ok=True)
+    if args.queue is None:
+        args.queue = os.path.join(args.outdir, ".postshowd-queue.json")
+
+    queue = JobQueue(args.queue, args.config, args.workers)
+    watcher = Watcher(args, queue)
+    files = FileWatcher(args.dirs, args.interval, use_inotify=not args.poll)
+    stopping = []
+
+    def stop_handler(sig, frame):
+        stopping.append(sig)
+
+    signal.signal(signal.SIGINT, stop_handler)
+    signal.signal(signal.SIGTERM, stop_handler)
+    server = None
+    if args.listen is not None:
+        server = serve(args.listen, queue, args.outdir, args.profile)
+        log("Listening on {}:{}".format(*server.server_address[:2]))
+    if args.dirs:
+        log("Watching {}".format(", ".join(args.dirs)))
+    finished = [JobQueue.DONE, JobQueue.FAILED]
+    reported = {job["id"] for job in queue.jobs() if job["state"] in finished}
+    while not stopping:
+        watcher.check()
+        for job in queue.jobs():
+            if job["state"] in finished and job["id"] not in reported:
+                reported.add(job["id"])
+                log(
+                    "Job {id} {state}{error}".format(
+                        **dict(
+                            job,
+                            error="" if job["error"] is None else ": " + job["error"],
+                        )
+                    )
+                )
+        # Wake up now and then even without changes, to see what has settled
+        files.wait(timeout=min(args.settle, args.interval) or 1)
+    log("Stopping; waiting for running jobs to finish")
+    if server is not None:
+        server.shutdown()
+    files.close()
+    queue.shutdown()
+
+
+if __name__ == "__main__":
+    main(sys.argv)